@@ -141,3 +141,42 @@ CREATE TABLE IF NOT EXISTS blocked_users (
     tg_id BIGINT PRIMARY KEY,
     blocked_at TIMESTAMP DEFAULT NOW()
 );
+
+CREATE OR REPLACE FUNCTION notify_cache_invalidation() RETURNS TRIGGER AS $$
+DECLARE
+    new_id TEXT;
+    old_id TEXT;
+BEGIN
+    IF TG_OP <> 'DELETE' THEN
+        new_id := to_jsonb(NEW) ->> TG_ARGV[0];
+        PERFORM pg_notify('cache_invalidation', json_build_object('entity', TG_TABLE_NAME, 'id', new_id)::text);
+    END IF;
+    IF TG_OP <> 'INSERT' THEN
+        old_id := to_jsonb(OLD) ->> TG_ARGV[0];
+        IF old_id IS DISTINCT FROM new_id THEN
+            PERFORM pg_notify('cache_invalidation', json_build_object('entity', TG_TABLE_NAME, 'id', old_id)::text);
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS keys_cache_invalidation ON keys;
+CREATE TRIGGER keys_cache_invalidation
+    AFTER INSERT OR UPDATE OR DELETE ON keys
+    FOR EACH ROW EXECUTE FUNCTION notify_cache_invalidation('tg_id');
+
+DROP TRIGGER IF EXISTS connections_cache_invalidation ON connections;
+CREATE TRIGGER connections_cache_invalidation
+    AFTER INSERT OR UPDATE OR DELETE ON connections
+    FOR EACH ROW EXECUTE FUNCTION notify_cache_invalidation('tg_id');
+
+DROP TRIGGER IF EXISTS servers_cache_invalidation ON servers;
+CREATE TRIGGER servers_cache_invalidation
+    AFTER INSERT OR UPDATE OR DELETE ON servers
+    FOR EACH ROW EXECUTE FUNCTION notify_cache_invalidation('cluster_name');
+
+DROP TRIGGER IF EXISTS coupons_cache_invalidation ON coupons;
+CREATE TRIGGER coupons_cache_invalidation
+    AFTER INSERT OR UPDATE OR DELETE ON coupons
+    FOR EACH ROW EXECUTE FUNCTION notify_cache_invalidation('code');
@@ -0,0 +1,11 @@
+-- migrate: no-transaction
+-- Индексы строятся без блокировки записи в таблицы, поэтому миграция выполняется вне транзакции.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_keys_email ON keys (email);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_keys_expiry_time ON keys (expiry_time);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_keys_server_id ON keys (server_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_keys_client_id ON keys (client_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_payments_tg_id_created_at ON payments (tg_id, created_at);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_referrals_referrer_tg_id ON referrals (referrer_tg_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_username ON users (username);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_created_at ON users (created_at);
@@ -0,0 +1,44 @@
+CREATE TABLE IF NOT EXISTS stats_rollup_watermarks
+(
+    name            TEXT PRIMARY KEY NOT NULL,
+    processed_until TIMESTAMP WITH TIME ZONE NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS payments_rollup_hourly
+(
+    bucket         TIMESTAMP WITH TIME ZONE NOT NULL,
+    payment_system TEXT                     NOT NULL,
+    payments_count INTEGER                  NOT NULL DEFAULT 0,
+    amount_sum     DOUBLE PRECISION         NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket, payment_system)
+);
+
+CREATE TABLE IF NOT EXISTS registrations_rollup_hourly
+(
+    bucket        TIMESTAMP WITH TIME ZONE PRIMARY KEY NOT NULL,
+    registrations INTEGER                  NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS keys_rollup_hourly
+(
+    bucket        TIMESTAMP WITH TIME ZONE NOT NULL,
+    cluster_name  TEXT                     NOT NULL,
+    tariff_period TEXT                     NOT NULL,
+    keys_created  INTEGER                  NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket, cluster_name, tariff_period)
+);
+
+CREATE OR REPLACE VIEW payments_rollup_daily AS
+SELECT date_trunc('day', bucket) AS day, payment_system, SUM(payments_count) AS payments_count, SUM(amount_sum) AS amount_sum
+FROM payments_rollup_hourly
+GROUP BY 1, 2;
+
+CREATE OR REPLACE VIEW registrations_rollup_daily AS
+SELECT date_trunc('day', bucket) AS day, SUM(registrations) AS registrations
+FROM registrations_rollup_hourly
+GROUP BY 1;
+
+CREATE OR REPLACE VIEW keys_rollup_daily AS
+SELECT date_trunc('day', bucket) AS day, cluster_name, tariff_period, SUM(keys_created) AS keys_created
+FROM keys_rollup_hourly
+GROUP BY 1, 2, 3;
@@ -0,0 +1,4 @@
+-- migrate: no-transaction
+-- Инкрементальный агрегатор выбирает ключи по created_at с момента последнего прохода.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_keys_created_at ON keys (created_at);
@@ -0,0 +1,22 @@
+CREATE TABLE IF NOT EXISTS broadcasts
+(
+    id                BIGSERIAL PRIMARY KEY,
+    admin_chat_id     BIGINT                   NOT NULL,
+    status_message_id BIGINT,
+    from_chat_id      BIGINT                   NOT NULL,
+    message_id        BIGINT                   NOT NULL,
+    audience          TEXT                     NOT NULL,
+    cluster_name      TEXT,
+    status            TEXT                     NOT NULL DEFAULT 'running'
+        CHECK (status IN ('running', 'paused', 'finished', 'cancelled')),
+    cursor_tg_id      BIGINT                   NOT NULL DEFAULT 0,
+    total             INTEGER                  NOT NULL DEFAULT 0,
+    sent              INTEGER                  NOT NULL DEFAULT 0,
+    failed            INTEGER                  NOT NULL DEFAULT 0,
+    blocked           INTEGER                  NOT NULL DEFAULT 0,
+    created_at        TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at        TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    finished_at       TIMESTAMP WITH TIME ZONE
+);
+
+CREATE INDEX IF NOT EXISTS idx_broadcasts_status ON broadcasts (status);
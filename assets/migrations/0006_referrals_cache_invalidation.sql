@@ -0,0 +1,4 @@
+DROP TRIGGER IF EXISTS referrals_cache_invalidation ON referrals;
+CREATE TRIGGER referrals_cache_invalidation
+    AFTER INSERT OR UPDATE OR DELETE ON referrals
+    FOR EACH ROW EXECUTE FUNCTION notify_cache_invalidation('referrer_tg_id');
@@ -0,0 +1,4 @@
+-- Последовательность для выдачи имён ключей: номер проходит через ключевую перестановку
+-- и кодируется в base36 (utils/key_names.py), поэтому имена не повторяются и не угадываются.
+
+CREATE SEQUENCE IF NOT EXISTS key_name_seq AS BIGINT MINVALUE 1 START WITH 1;
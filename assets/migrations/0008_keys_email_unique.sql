@@ -0,0 +1,7 @@
+-- migrate: no-transaction
+-- Имя ключа (email) используется как имя клиента на панелях и в ссылке подписки, поэтому уникальность
+-- теперь гарантирует база. Если в таблице остались дубли, построение индекса завершится ошибкой
+-- с именем дублирующегося ключа, и миграция повторится при следующем старте после их устранения.
+
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS idx_keys_email_unique ON keys (email);
+DROP INDEX CONCURRENTLY IF EXISTS idx_keys_email;
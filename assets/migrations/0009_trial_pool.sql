@@ -0,0 +1,14 @@
+-- Пул заранее созданных на панелях и отключённых клиентов для пробных ключей.
+-- Строка удаляется при выдаче клиента пользователю; servers — серверы кластера на момент создания.
+
+CREATE TABLE IF NOT EXISTS trial_pool
+(
+    id           BIGSERIAL PRIMARY KEY,
+    cluster_name TEXT                     NOT NULL,
+    client_id    TEXT                     NOT NULL,
+    email        TEXT                     NOT NULL UNIQUE,
+    servers      TEXT[]                   NOT NULL,
+    created_at   TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_trial_pool_cluster_name ON trial_pool (cluster_name);
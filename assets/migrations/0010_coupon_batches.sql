@@ -0,0 +1,7 @@
+-- Купоны, созданные одной массовой генерацией, помечаются общим batch_id для выгрузки в CSV.
+
+CREATE SEQUENCE IF NOT EXISTS coupon_batch_seq AS BIGINT MINVALUE 1 START WITH 1;
+
+ALTER TABLE coupons ADD COLUMN IF NOT EXISTS batch_id BIGINT;
+
+CREATE INDEX IF NOT EXISTS idx_coupons_batch_id ON coupons (batch_id) WHERE batch_id IS NOT NULL;
@@ -0,0 +1,23 @@
+-- Входящие уведомления платежных систем. Вебхук только сохраняет событие; баланс, реферальные
+-- бонусы и запись в payments применяет обработчик очереди в одной транзакции с пометкой события.
+-- Уникальность (provider, external_id) отсекает повторные доставки одного и того же платежа.
+
+CREATE TABLE IF NOT EXISTS payment_events
+(
+    id           BIGSERIAL PRIMARY KEY,
+    provider     TEXT                     NOT NULL,
+    external_id  TEXT                     NOT NULL,
+    tg_id        BIGINT                   NOT NULL,
+    amount       REAL                     NOT NULL,
+    payload      JSONB,
+    status       TEXT                     NOT NULL DEFAULT 'pending'
+        CHECK (status IN ('pending', 'processed', 'failed')),
+    attempts     INTEGER                  NOT NULL DEFAULT 0,
+    last_error   TEXT,
+    available_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    created_at   TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    processed_at TIMESTAMP WITH TIME ZONE,
+    UNIQUE (provider, external_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_payment_events_pending ON payment_events (available_at) WHERE status = 'pending';
@@ -0,0 +1,113 @@
+-- Секционированная по месяцам created_at таблица платежей. У каждой секции локальные индексы
+-- (tg_id, created_at) для истории пользователя и BRIN по created_at для отчетов по периодам.
+-- payments_default принимает строки вне созданных секций, чтобы вставка никогда не падала.
+--
+-- Миграция только создает пустую payments_partitioned и триггеры, которые зеркалируют в нее
+-- новые и удаленные платежи. Существующие строки переносятся пачками и таблицы меняются
+-- местами отдельной командой, без долгой блокировки при старте бота:
+--     python -m utils.payments_partitions migrate
+
+CREATE SCHEMA IF NOT EXISTS payments_archive;
+
+CREATE TABLE IF NOT EXISTS payments_partitioned
+(
+    id             INTEGER                  NOT NULL DEFAULT nextval('payments_id_seq'),
+    tg_id          BIGINT                   NOT NULL,
+    amount         REAL                     NOT NULL,
+    payment_system TEXT                     NOT NULL,
+    status         TEXT                              DEFAULT 'success',
+    created_at     TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, created_at),
+    FOREIGN KEY (tg_id) REFERENCES users (tg_id)
+) PARTITION BY RANGE (created_at);
+
+CREATE INDEX IF NOT EXISTS idx_payments_partitioned_tg_id_created_at ON payments_partitioned (tg_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_payments_created_at_brin ON payments_partitioned USING brin (created_at);
+
+CREATE TABLE IF NOT EXISTS payments_default PARTITION OF payments_partitioned DEFAULT;
+
+-- Создает секцию месяца, в который попадает target, в секционированной таблице платежей
+-- (payments_partitioned до переключения, payments после). Строки этого месяца, успевшие попасть
+-- в секцию по умолчанию, переносятся в новую секцию. Возвращает имя секции.
+CREATE OR REPLACE FUNCTION ensure_payments_partition(target TIMESTAMP WITH TIME ZONE) RETURNS TEXT
+    LANGUAGE plpgsql AS
+$$
+DECLARE
+    range_start    TIMESTAMP WITH TIME ZONE := date_trunc('month', target AT TIME ZONE 'UTC') AT TIME ZONE 'UTC';
+    range_end      TIMESTAMP WITH TIME ZONE := range_start + INTERVAL '1 month';
+    partition_name TEXT                     := 'payments_p' || to_char(range_start AT TIME ZONE 'UTC', 'YYYY_MM');
+    parent         REGCLASS;
+    default_name   REGCLASS;
+BEGIN
+    IF to_regclass(partition_name) IS NOT NULL THEN
+        RETURN partition_name;
+    END IF;
+
+    SELECT c.oid::regclass INTO parent
+    FROM pg_class c
+    WHERE c.relname IN ('payments', 'payments_partitioned') AND c.relkind = 'p'
+      AND c.relnamespace = 'public'::regnamespace;
+    SELECT i.inhrelid::regclass INTO default_name
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = parent AND pg_get_expr(c.relpartbound, c.oid) = 'DEFAULT';
+
+    EXECUTE format('CREATE TABLE %I (LIKE %s INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', partition_name, parent);
+    EXECUTE format(
+        'ALTER TABLE %I ADD CONSTRAINT %I CHECK (created_at >= %L AND created_at < %L)',
+        partition_name, partition_name || '_range', range_start, range_end
+    );
+    IF default_name IS NOT NULL THEN
+        EXECUTE format(
+            'WITH moved AS (DELETE FROM %s WHERE created_at >= %L AND created_at < %L RETURNING *) '
+                'INSERT INTO %I SELECT * FROM moved',
+            default_name, range_start, range_end, partition_name
+        );
+    END IF;
+    EXECUTE format(
+        'ALTER TABLE %s ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+        parent, partition_name, range_start, range_end
+    );
+    -- Ограничение нужно только для быстрого ATTACH без проверки строк
+    EXECUTE format('ALTER TABLE %I DROP CONSTRAINT %I', partition_name, partition_name || '_range');
+    RETURN partition_name;
+END;
+$$;
+
+SELECT ensure_payments_partition(months.target)
+FROM generate_series(
+    date_trunc('month', CURRENT_TIMESTAMP),
+    CURRENT_TIMESTAMP + INTERVAL '3 months',
+    INTERVAL '1 month'
+) AS months (target);
+
+-- Позиция переноса существующих строк: последний перенесенный id
+CREATE TABLE IF NOT EXISTS payments_migration_progress
+(
+    single  BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (single),
+    last_id BIGINT  NOT NULL    DEFAULT 0
+);
+INSERT INTO payments_migration_progress DEFAULT VALUES ON CONFLICT DO NOTHING;
+
+-- Пока идет перенос, новые и удаленные платежи сразу отражаются в payments_partitioned
+CREATE OR REPLACE FUNCTION mirror_payments_to_partitioned() RETURNS TRIGGER
+    LANGUAGE plpgsql AS
+$$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO payments_partitioned (id, tg_id, amount, payment_system, status, created_at)
+        VALUES (NEW.id, NEW.tg_id, NEW.amount, NEW.payment_system, NEW.status, COALESCE(NEW.created_at, CURRENT_TIMESTAMP))
+        ON CONFLICT DO NOTHING;
+        RETURN NEW;
+    END IF;
+    DELETE FROM payments_partitioned WHERE id = OLD.id;
+    RETURN OLD;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_payments_mirror ON payments;
+CREATE TRIGGER trg_payments_mirror
+    AFTER INSERT OR DELETE
+    ON payments
+    FOR EACH ROW
+EXECUTE FUNCTION mirror_payments_to_partitioned();
@@ -1,26 +1,56 @@
+import asyncio
 import os
-import subprocess
 
 from datetime import datetime, timedelta
 from pathlib import Path
 
 import aiofiles
+import asyncpg
 
-from aiogram.types import BufferedInputFile
+from aiogram.types import FSInputFile
 
 from bot import bot
-from config import ADMIN_ID, BACK_DIR, DB_NAME, DB_PASSWORD, DB_USER, PG_HOST, PG_PORT
+from config import ADMIN_ID, BACK_DIR, DATABASE_URL, DB_NAME, DB_PASSWORD, DB_USER, PG_HOST, PG_PORT
 from logger import logger
+from utils.leader import lease_key
+
+
+BACKUP_COMPRESS_LEVEL = 6
+BACKUP_READ_CHUNK = 1024 * 1024
+BACKUP_PART_SIZE = 45 * 1024 * 1024
+
+
+class BackupError(Exception):
+    """Ошибка pg_dump или проверки бэкапа через pg_restore."""
 
 
 async def backup_database() -> Exception | None:
     """
     Создает резервную копию базы данных и отправляет ее администраторам.
 
+    На время бэкапа берется advisory lock, поэтому при нескольких репликах бэкап
+    выполняет только одна из них; остальные получают BackupError.
+
     Returns:
         Optional[Exception]: Исключение в случае ошибки или None при успешном выполнении
     """
-    backup_file_path, exception = _create_database_backup()
+    try:
+        conn = await asyncpg.connect(DATABASE_URL)
+    except Exception as e:
+        logger.error(f"Ошибка подключения к базе данных перед бэкапом: {e}")
+        return e
+
+    try:
+        if not await conn.fetchval("SELECT pg_try_advisory_lock($1)", lease_key("backup_database")):
+            logger.info("Бэкап базы данных уже выполняется на другой реплике, пропуск")
+            return BackupError("бэкап уже выполняется на другой реплике")
+        return await _run_backup()
+    finally:
+        await conn.close()
+
+
+async def _run_backup() -> Exception | None:
+    backup_file_path, exception = await _create_database_backup()
 
     if exception:
         logger.error(f"Ошибка при создании бэкапа базы данных: {exception}")
@@ -40,10 +70,18 @@ async def backup_database() -> Exception | None:
         return e
 
 
-def _create_database_backup() -> tuple[str | None, Exception | None]:
+def _pg_env() -> dict[str, str]:
+    """Окружение для утилит PostgreSQL с паролем, не затрагивающее os.environ процесса."""
+    return {**os.environ, "PGPASSWORD": DB_PASSWORD}
+
+
+async def _create_database_backup() -> tuple[str | None, Exception | None]:
     """
     Создает резервную копию базы данных PostgreSQL.
 
+    pg_dump запускается асинхронным подпроцессом и пишет сжатый архив в stdout, который
+    потоково сохраняется на диск. Готовый архив проверяется через pg_restore --list.
+
     Returns:
         Tuple[Optional[str], Optional[Exception]]: Путь к файлу бэкапа и исключение (если произошла ошибка)
     """
@@ -54,39 +92,83 @@ def _create_database_backup() -> tuple[str | None, Exception | None]:
 
     filename = backup_dir / f"{DB_NAME}-backup-{date_formatted}.sql"
 
+    process = None
     try:
-        os.environ["PGPASSWORD"] = DB_PASSWORD
-
-        subprocess.run(
-            [
-                "pg_dump",
-                "-U",
-                DB_USER,
-                "-h",
-                PG_HOST,
-                "-p",
-                PG_PORT,
-                "-F",
-                "c",
-                "-f",
-                str(filename),
-                DB_NAME,
-            ],
-            check=True,
-            capture_output=True,
-            text=True,
+        process = await asyncio.create_subprocess_exec(
+            "pg_dump",
+            "-U",
+            DB_USER,
+            "-h",
+            PG_HOST,
+            "-p",
+            str(PG_PORT),
+            "-F",
+            "c",
+            "-Z",
+            str(BACKUP_COMPRESS_LEVEL),
+            DB_NAME,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            env=_pg_env(),
         )
-        logger.info(f"Бэкап базы данных создан: {filename}")
+
+        async def write_dump() -> int:
+            size = 0
+            async with aiofiles.open(filename, "wb") as backup_file:
+                while chunk := await process.stdout.read(BACKUP_READ_CHUNK):
+                    await backup_file.write(chunk)
+                    size += len(chunk)
+            return size
+
+        size, stderr = await asyncio.gather(write_dump(), process.stderr.read())
+        if await process.wait() != 0:
+            raise BackupError(f"pg_dump завершился с кодом {process.returncode}: {stderr.decode(errors='replace')}")
+
+        entries = await _verify_backup(filename)
+        logger.info(f"Бэкап базы данных создан: {filename} ({size / 1024 / 1024:.1f} МБ, объектов: {entries})")
         return str(filename), None
-    except subprocess.CalledProcessError as e:
-        logger.error(f"Ошибка при выполнении pg_dump: {e.stderr}")
-        return None, e
     except Exception as e:
-        logger.error(f"Непредвиденная ошибка при создании бэкапа: {e}")
+        logger.error(f"Ошибка при создании бэкапа: {e}")
+        filename.unlink(missing_ok=True)
         return None, e
     finally:
-        if "PGPASSWORD" in os.environ:
-            del os.environ["PGPASSWORD"]
+        if process is not None:
+            await _stop_process(process)
+
+
+async def _stop_process(process: asyncio.subprocess.Process) -> None:
+    """Завершает подпроцесс, если он еще работает (ошибка записи или отмена задачи), и дожидается его."""
+    if process.returncode is None:
+        process.kill()
+        logger.warning(f"Подпроцесс {process.pid} остановлен принудительно")
+    await process.wait()
+
+
+async def _verify_backup(backup_file_path: Path) -> int:
+    """
+    Проверяет, что архив читается pg_restore, и возвращает число объектов в его оглавлении.
+
+    Raises:
+        BackupError: Если архив поврежден или пуст
+    """
+    process = await asyncio.create_subprocess_exec(
+        "pg_restore",
+        "--list",
+        str(backup_file_path),
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    try:
+        stdout, stderr = await process.communicate()
+    finally:
+        await _stop_process(process)
+    if process.returncode != 0:
+        raise BackupError(f"pg_restore не смог прочитать бэкап: {stderr.decode(errors='replace')}")
+
+    entries = sum(1 for line in stdout.decode(errors="replace").splitlines() if line and not line.startswith(";"))
+    if entries == 0:
+        raise BackupError("Оглавление бэкапа пустое")
+    return entries
 
 
 def _cleanup_old_backups() -> Exception | None:
@@ -128,10 +210,41 @@ async def create_backup_and_send_to_admins(client) -> None:
     await client.database.export()
 
 
+async def _split_backup(backup_file_path: Path) -> list[Path]:
+    """
+    Делит бэкап на части не больше BACKUP_PART_SIZE, чтобы уложиться в лимит загрузки Telegram.
+
+    Returns:
+        list[Path]: Файлы частей или исходный файл, если он помещается целиком
+    """
+    if backup_file_path.stat().st_size <= BACKUP_PART_SIZE:
+        return [backup_file_path]
+
+    parts = []
+    async with aiofiles.open(backup_file_path, "rb") as backup_file:
+        while True:
+            part_path = backup_file_path.with_name(f"{backup_file_path.name}.part{len(parts) + 1:02d}")
+            written = 0
+            async with aiofiles.open(part_path, "wb") as part_file:
+                while written < BACKUP_PART_SIZE:
+                    chunk = await backup_file.read(min(BACKUP_READ_CHUNK, BACKUP_PART_SIZE - written))
+                    if not chunk:
+                        break
+                    await part_file.write(chunk)
+                    written += len(chunk)
+            if written == 0:
+                part_path.unlink(missing_ok=True)
+                break
+            parts.append(part_path)
+    return parts
+
+
 async def _send_backup_to_admins(backup_file_path: str) -> None:
     """
     Отправляет файл бэкапа всем администраторам через Telegram.
 
+    Каждая часть загружается один раз, остальным администраторам пересылается её file_id.
+
     Args:
         backup_file_path: Путь к файлу бэкапа
 
@@ -141,18 +254,31 @@ async def _send_backup_to_admins(backup_file_path: str) -> None:
     if not backup_file_path or not os.path.exists(backup_file_path):
         raise FileNotFoundError(f"Файл бэкапа не найден: {backup_file_path}")
 
+    backup_path = Path(backup_file_path)
+    parts = await _split_backup(backup_path)
+
     try:
-        async with aiofiles.open(backup_file_path, "rb") as backup_file:
-            backup_data = await backup_file.read()
-            filename = os.path.basename(backup_file_path)
-            backup_input_file = BufferedInputFile(file=backup_data, filename=filename)
+        for index, part_path in enumerate(parts, start=1):
+            caption = None
+            if len(parts) > 1:
+                caption = f"💾 Часть {index}/{len(parts)}. Сборка: cat {backup_path.name}.part* > {backup_path.name}"
 
+            file_id = None
             for admin_id in ADMIN_ID:
                 try:
-                    await bot.send_document(chat_id=admin_id, document=backup_input_file)
-                    logger.info(f"Бэкап базы данных отправлен админу: {admin_id}")
+                    document = file_id or FSInputFile(part_path, filename=part_path.name)
+                    message = await bot.send_document(chat_id=admin_id, document=document, caption=caption)
+                    file_id = file_id or message.document.file_id
+                    logger.info(f"Бэкап базы данных ({part_path.name}) отправлен админу: {admin_id}")
                 except Exception as e:
                     logger.error(f"Не удалось отправить бэкап админу {admin_id}: {e}")
+
+            if file_id is None:
+                raise BackupError(f"Не удалось загрузить {part_path.name} ни одному администратору")
     except Exception as e:
         logger.error(f"Ошибка при отправке бэкапа в Telegram: {e}")
         raise
+    finally:
+        for part_path in parts:
+            if part_path != backup_path:
+                part_path.unlink(missing_ok=True)
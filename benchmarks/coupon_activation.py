@@ -0,0 +1,144 @@
+"""
+Конкурентная активация одного купона тысячами пользователей.
+
+Скрипт создает временный купон с лимитом --limit и параллельно активирует его от имени
+--users синтетических пользователей (отрицательные tg_id) двумя способами: прежней
+цепочкой отдельных запросов без транзакции и одним запросом activate_coupon_atomically.
+Для каждого способа печатаются пропускная способность, перцентили задержки и итог
+по купону: сколько активаций прошло сверх лимита и сколько начислено на балансы.
+Временные купоны и строки connections удаляются после прогона.
+
+Пример:
+    python -m benchmarks.coupon_activation --users 5000 --limit 1000 --concurrency 200
+"""
+
+import argparse
+import asyncio
+import secrets
+import statistics
+import time
+
+import asyncpg
+
+from config import DATABASE_URL
+from database import activate_coupon_atomically
+
+
+COUPON_AMOUNT = 10
+USER_ID_BASE = -(10**12)
+
+
+async def activate_legacy(conn: asyncpg.Connection, code: str, user_id: int) -> bool:
+    """Прежняя последовательность: поиск, проверка, счетчик, использование, баланс."""
+    coupon = await conn.fetchrow(
+        """
+        SELECT id, usage_limit, usage_count, amount
+        FROM coupons
+        WHERE code = $1 AND (usage_count < usage_limit OR usage_limit = 0) AND is_used = FALSE
+        """,
+        code,
+    )
+    if not coupon:
+        return False
+    if await conn.fetchrow("SELECT 1 FROM coupon_usages WHERE coupon_id = $1 AND user_id = $2", coupon["id"], user_id):
+        return False
+    await conn.execute(
+        """
+        UPDATE coupons
+        SET usage_count = usage_count + 1,
+            is_used = CASE WHEN usage_count + 1 >= usage_limit AND usage_limit > 0 THEN TRUE ELSE FALSE END
+        WHERE id = $1
+        """,
+        coupon["id"],
+    )
+    await conn.execute("INSERT INTO coupon_usages (coupon_id, user_id) VALUES ($1, $2)", coupon["id"], user_id)
+    balance = await conn.fetchval("SELECT balance FROM connections WHERE tg_id = $1", user_id) or 0
+    await conn.execute("UPDATE connections SET balance = $1 WHERE tg_id = $2", balance + coupon["amount"], user_id)
+    return True
+
+
+async def activate_atomic(conn: asyncpg.Connection, code: str, user_id: int) -> bool:
+    result = await activate_coupon_atomically(code, user_id, conn)
+    return result["status"] == "activated"
+
+
+async def run(pool: asyncpg.Pool, mode: str, users: int, limit: int, concurrency: int) -> None:
+    code = f"bench_{mode}_{secrets.token_hex(4)}"
+    user_ids = [USER_ID_BASE - index for index in range(users)]
+    activate = activate_legacy if mode == "legacy" else activate_atomic
+
+    async with pool.acquire() as conn:
+        await conn.execute(
+            "INSERT INTO coupons (code, amount, usage_limit) VALUES ($1, $2, $3)", code, COUPON_AMOUNT, limit
+        )
+        await conn.execute(
+            "INSERT INTO connections (tg_id, balance) SELECT unnest($1::bigint[]), 0 ON CONFLICT (tg_id) DO NOTHING",
+            user_ids,
+        )
+
+    latencies: list[float] = []
+    activated = 0
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def call(user_id: int) -> None:
+        nonlocal activated, errors
+        async with semaphore, pool.acquire() as conn:
+            started = time.perf_counter()
+            try:
+                activated += await activate(conn, code, user_id)
+            except asyncpg.PostgresError:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(call(user_id) for user_id in user_ids))
+    elapsed = time.perf_counter() - started
+
+    async with pool.acquire() as conn:
+        usage_count = await conn.fetchval("SELECT usage_count FROM coupons WHERE code = $1", code)
+        usages = await conn.fetchval(
+            "SELECT COUNT(*) FROM coupon_usages u JOIN coupons c ON c.id = u.coupon_id WHERE c.code = $1", code
+        )
+        credited = await conn.fetchval(
+            "SELECT COALESCE(SUM(balance), 0) FROM connections WHERE tg_id = ANY($1::bigint[])", user_ids
+        )
+        await conn.execute("DELETE FROM coupons WHERE code = $1", code)
+        await conn.execute("DELETE FROM connections WHERE tg_id = ANY($1::bigint[])", user_ids)
+
+    latencies.sort()
+    print(
+        f"{mode:>6}: {len(latencies) / elapsed:7.0f} активаций/с | "
+        f"p50 {statistics.median(latencies) * 1000:7.1f} мс | "
+        f"p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:7.1f} мс | "
+        f"p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:7.1f} мс | {elapsed:.2f} с"
+    )
+    print(
+        f"        успешно: {activated}, ошибок: {errors}, usage_count: {usage_count}, записей использования: {usages}, "
+        f"сверх лимита: {max(usages - limit, 0)}, начислено: {credited:.0f} из {limit * COUPON_AMOUNT}"
+    )
+
+
+async def main_async(args: argparse.Namespace) -> None:
+    pool = await asyncpg.create_pool(args.dsn, min_size=args.concurrency, max_size=args.concurrency)
+    try:
+        modes = ("legacy", "atomic") if args.mode == "both" else (args.mode,)
+        for mode in modes:
+            await run(pool, mode, args.users, args.limit, args.concurrency)
+    finally:
+        await pool.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--limit", type=int, default=1000, help="лимит активаций купона")
+    parser.add_argument("--concurrency", type=int, default=100, help="одновременных соединений")
+    parser.add_argument("--mode", choices=("legacy", "atomic", "both"), default="both")
+    parser.add_argument("--dsn", default=DATABASE_URL)
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
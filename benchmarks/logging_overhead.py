@@ -0,0 +1,93 @@
+"""
+Замер влияния логирования на задержку обработчика.
+
+Синтетический обработчик пишет несколько строк лога на запрос, как горячие пути
+subscriptions и key_utils, и выполняется параллельно. Скрипт печатает пропускную
+способность и перцентили задержки для трех конфигураций: без логов, синхронный
+текстовый файл (прежняя настройка) и очередь с JSON и сэмплированием (logger.py).
+
+Пример:
+    python -m benchmarks.logging_overhead --requests 20000 --concurrency 200 --lines 5
+"""
+
+import argparse
+import asyncio
+import statistics
+import tempfile
+import time
+
+from datetime import timedelta
+from pathlib import Path
+
+from loguru import logger
+
+from logger import json_formatter, sample_filter
+
+
+TEXT_FORMAT = "{time:YYYY-MM-DD HH:mm:ss} | {level} | {module}:{function}:{line} | {message}"
+
+
+async def handler(request_id: int, lines: int) -> None:
+    for index in range(lines):
+        logger.bind(request_id=request_id).debug(f"Обработка запроса {request_id}, шаг {index}")
+        await asyncio.sleep(0)
+
+
+async def run(requests: int, concurrency: int, lines: int) -> tuple[float, list[float]]:
+    latencies: list[float] = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def call(request_id: int) -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            await handler(request_id, lines)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(call(request_id) for request_id in range(requests)))
+    return time.perf_counter() - started, latencies
+
+
+def configure(mode: str, log_dir: Path) -> None:
+    logger.remove()
+    if mode == "sync":
+        logger.add(log_dir / "sync.log", level="DEBUG", format=TEXT_FORMAT, rotation=timedelta(minutes=60))
+    elif mode == "queued":
+        logger.add(
+            log_dir / "queued.jsonl",
+            level="DEBUG",
+            format=json_formatter,
+            filter=sample_filter,
+            rotation=timedelta(minutes=60),
+            compression="gz",
+            enqueue=True,
+        )
+
+
+def report(mode: str, elapsed: float, latencies: list[float]) -> None:
+    latencies.sort()
+    p50 = statistics.median(latencies) * 1000
+    p99 = latencies[int(len(latencies) * 0.99) - 1] * 1000
+    print(
+        f"{mode:>7}: {len(latencies) / elapsed:9.0f} запросов/с | p50 {p50:7.3f} мс | p99 {p99:7.3f} мс | {elapsed:.2f} с"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--lines", type=int, default=5, help="строк лога на запрос")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as log_dir:
+        for mode in ("off", "sync", "queued"):
+            configure(mode, Path(log_dir))
+            elapsed, latencies = asyncio.run(run(args.requests, args.concurrency, args.lines))
+            logger.complete()
+            report(mode, elapsed, latencies)
+        logger.remove()
+
+
+if __name__ == "__main__":
+    main()
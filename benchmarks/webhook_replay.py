@@ -0,0 +1,91 @@
+"""
+Нагрузочный прогон webhook-режима: воспроизводит записанные апдейты Telegram.
+
+Файл с апдейтами — JSONL, по одному апдейту на строку (например, выгрузка getUpdates).
+Скрипт отправляет их на webhook с заданной параллельностью и печатает пропускную
+способность и перцентили задержки ответа.
+
+Пример:
+    python -m benchmarks.webhook_replay updates.jsonl --url http://127.0.0.1:3001/webhook \
+        --secret <token> --concurrency 200 --repeat 10
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+import aiohttp
+
+
+async def replay(
+    updates: list[dict], url: str, secret: str | None, concurrency: int, repeat: int
+) -> tuple[list[float], int]:
+    headers = {"Content-Type": "application/json"}
+    if secret:
+        headers["X-Telegram-Bot-Api-Secret-Token"] = secret
+
+    latencies: list[float] = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(session: aiohttp.ClientSession, update_id: int, update: dict) -> None:
+        nonlocal errors
+        payload = json.dumps({**update, "update_id": update_id}).encode()
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                async with session.post(url, data=payload, headers=headers) as response:
+                    await response.read()
+                    if response.status != 200:
+                        errors += 1
+            except aiohttp.ClientError:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        tasks = [
+            send(session, round_index * len(updates) + index, update)
+            for round_index in range(repeat)
+            for index, update in enumerate(updates)
+        ]
+        await asyncio.gather(*tasks)
+
+    return latencies, errors
+
+
+def percentile(values: list[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Воспроизведение записанных апдейтов на webhook")
+    parser.add_argument("updates", help="JSONL-файл с апдейтами")
+    parser.add_argument("--url", default="http://127.0.0.1:3001/webhook")
+    parser.add_argument("--secret", default=None)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args()
+
+    with open(args.updates, encoding="utf-8") as file:
+        updates = [json.loads(line) for line in file if line.strip()]
+
+    started = time.perf_counter()
+    latencies, errors = asyncio.run(replay(updates, args.url, args.secret, args.concurrency, args.repeat))
+    elapsed = time.perf_counter() - started
+
+    total = len(latencies)
+    print(f"Апдейтов: {total}, ошибок: {errors}, время: {elapsed:.2f} с, {total / elapsed:.0f} апд/с")
+    print(
+        f"Задержка ответа: p50={percentile(latencies, 50) * 1000:.1f} мс, "
+        f"p95={percentile(latencies, 95) * 1000:.1f} мс, "
+        f"p99={percentile(latencies, 99) * 1000:.1f} мс, "
+        f"среднее={statistics.mean(latencies) * 1000:.1f} мс"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -13,9 +13,12 @@ from config import ADMIN_ID, API_TOKEN
 from filters.private import IsPrivateFilter
 from logger import logger
 from middlewares import register_middleware
+from utils.error_digest import error_digest
+from utils.rate_governor import rate_governor
 
 
 bot = Bot(token=API_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+bot.session.middleware(rate_governor)
 storage = MemoryStorage()
 dp = Dispatcher(bot=bot, storage=storage)
 
@@ -27,6 +30,11 @@ dp.message.filter(IsPrivateFilter())
 dp.callback_query.filter(IsPrivateFilter())
 
 
+async def send_error_digest(text: str) -> None:
+    for admin_id in ADMIN_ID:
+        await bot.send_message(chat_id=admin_id, text=text)
+
+
 @dp.errors(ExceptionTypeFilter(Exception))
 async def errors_handler(
     event: ErrorEvent,
@@ -65,15 +73,19 @@ async def errors_handler(
     if not ADMIN_ID:
         return True
     try:
-        for admin_id in ADMIN_ID:
-            await bot.send_document(
-                chat_id=admin_id,
-                document=BufferedInputFile(
-                    traceback.format_exc().encode(),
-                    filename=f"error_{event.update.update_id}.txt",
-                ),
-                caption=f"{hbold(type(event.exception).__name__)}: {str(event.exception)[:1021]}...",
-            )
+        error_key, is_new = error_digest.record(event.exception, event.update.update_id)
+        if is_new:
+            for admin_id in ADMIN_ID:
+                await bot.send_document(
+                    chat_id=admin_id,
+                    document=BufferedInputFile(
+                        traceback.format_exc().encode(),
+                        filename=f"error_{event.update.update_id}.txt",
+                    ),
+                    caption=f"{hbold(type(event.exception).__name__)} [{error_key}]: {str(event.exception)[:900]}...",
+                )
+        else:
+            error_digest.schedule_flush(send_error_digest)
         try:
             from handlers.start import handle_start_callback_query, start_command
 
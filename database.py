@@ -1,13 +1,38 @@
 import json
+import re
+import secrets
 
 from datetime import datetime
+from pathlib import Path
 from typing import Any
 
 import asyncpg
 import pytz
 
+from cachetools import TTLCache
+
 from config import CASHBACK, CHECK_REFERRAL_REWARD_ISSUED, DATABASE_URL, REFERRAL_BONUS_PERCENTAGES
 from logger import logger
+from utils.cache_bus import invalidation_bus
+from utils.db_metrics import InstrumentedConnection
+from utils.leader import lease_key
+from utils.payments_partitions import ensure_payments_maintenance, ensure_payments_partitions
+
+
+MIGRATIONS_DIR = "assets/migrations"
+MIGRATIONS_LOCK_KEY = lease_key("schema_migrations")
+NO_TRANSACTION_MARKER = "-- migrate: no-transaction"
+
+USER_SNAPSHOT_TTL = 60
+RENEWAL_NOTIFICATION_SUFFIXES = ("key_24h", "key_10h", "key_expired", "renew")
+COUPON_CODE_ALPHABET = "ABCDEFGHJKLMNPQRSTUVWXYZ23456789"
+COUPON_CODE_LENGTH = 10
+
+_payments_partition_months: set[str] = set()
+
+user_snapshot_cache = TTLCache(maxsize=10_000, ttl=USER_SNAPSHOT_TTL)
+for _entity in ("connections", "keys", "referrals"):
+    invalidation_bus.subscribe_cache(_entity, user_snapshot_cache, key_type=int)
 
 
 async def create_temporary_data(session, tg_id: int, state: str, data: dict):
@@ -59,21 +84,101 @@ async def delete_blocked_user(tg_id: int | list[int], conn: asyncpg.Connection):
         await conn.execute("DELETE FROM blocked_users WHERE tg_id = $1", tg_id)
 
 
-async def init_db(file_path: str = "assets/schema.sql"):
-    with open(file_path) as file:
-        sql_content = file.read()
+async def init_db(migrations_dir: str = MIGRATIONS_DIR):
+    """
+    Применяет к базе данных непримененные версионные миграции из assets/migrations.
+
+    Примененные версии хранятся в таблице schema_migrations, поэтому при обычном старте
+    выполняется только проверка списка версий, без сканирования information_schema. Миграции применяются под
+    advisory lock, чтобы одновременно стартующие реплики не выполняли их дважды.
+
+    Файл миграции называется `<версия>_<описание>.sql`. Миграции выполняются в транзакции,
+    кроме помеченных строкой `-- migrate: no-transaction` (например, с CREATE INDEX CONCURRENTLY):
+    их выражения выполняются по одному.
+
+    После миграций создаются недостающие месячные секции payments на ближайшие месяцы
+    и в фоне запускается обслуживание секций.
+    """
+    migrations = _load_migrations(migrations_dir)
+    conn = await asyncpg.connect(DATABASE_URL, connection_class=InstrumentedConnection)
 
-    conn = await asyncpg.connect(DATABASE_URL)
+    try:
+        await conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+            )
+            """
+        )
+        applied = {row["version"] for row in await conn.fetch("SELECT version FROM schema_migrations")}
+        if all(version in applied for version, _, _ in migrations):
+            logger.info("Схема базы данных актуальна, миграции не требуются")
+        else:
+            await conn.execute("SELECT pg_advisory_lock($1)", MIGRATIONS_LOCK_KEY)
+            try:
+                applied = {row["version"] for row in await conn.fetch("SELECT version FROM schema_migrations")}
+                for version, name, sql in migrations:
+                    if version not in applied:
+                        await _apply_migration(conn, version, name, sql)
+            finally:
+                await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATIONS_LOCK_KEY)
+            logger.info("Миграции базы данных применены успешно")
+    except Exception as e:
+        logger.error(f"Ошибка при применении миграций базы данных: {e}")
+        await conn.close()
+        return
 
     try:
-        await conn.execute(sql_content)
+        await ensure_payments_partitions(conn)
+        _payments_partition_months.add(_current_month())
+        if await conn.fetchval("SELECT to_regclass('payments_partitioned')") is not None:
+            logger.warning(
+                "Платежи еще не перенесены в секционированную таблицу: "
+                "выполните python -m utils.payments_partitions migrate"
+            )
+        ensure_payments_maintenance()
     except Exception as e:
-        logger.error(f"Error while executing SQL statement: {e}")
+        logger.warning(f"Не удалось создать секции таблицы payments: {e}")
     finally:
-        logger.info("Tables created successfully")
         await conn.close()
 
 
+def _load_migrations(migrations_dir: str) -> list[tuple[int, str, str]]:
+    """Загружает файлы миграций, отсортированные по версии."""
+    migrations = []
+    for path in Path(migrations_dir).glob("*.sql"):
+        version, _, name = path.stem.partition("_")
+        migrations.append((int(version), name, path.read_text(encoding="utf-8")))
+    return sorted(migrations)
+
+
+async def _apply_migration(conn: asyncpg.Connection, version: int, name: str, sql: str):
+    logger.info(f"Применение миграции {version}: {name}")
+
+    if NO_TRANSACTION_MARKER not in sql:
+        async with conn.transaction():
+            await conn.execute(sql)
+            await conn.execute("INSERT INTO schema_migrations (version, name) VALUES ($1, $2)", version, name)
+        return
+
+    for index_name in re.findall(r"INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+(\w+)", sql, flags=re.IGNORECASE):
+        is_valid = await conn.fetchval(
+            "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = $1",
+            index_name,
+        )
+        if is_valid is False:
+            logger.warning(f"Удаление невалидного индекса {index_name}, оставшегося после прерванной миграции")
+            await conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}")
+
+    code = "\n".join(line for line in sql.splitlines() if not line.lstrip().startswith("--"))
+    for statement in code.split(";"):
+        if statement.strip():
+            await conn.execute(statement)
+    await conn.execute("INSERT INTO schema_migrations (version, name) VALUES ($1, $2)", version, name)
+
+
 async def check_unique_server_name(server_name: str, session: Any, cluster_name: str | None = None) -> bool:
     """
     Проверяет уникальность имени сервера.
@@ -159,6 +264,79 @@ async def create_coupon(coupon_code: str, amount: int, usage_limit: int, session
         raise
 
 
+async def create_coupons_bulk(
+    count: int, amount: int, usage_limit: int, session: Any, days: int = None, code_length: int = COUPON_CODE_LENGTH
+) -> int:
+    """
+    Создает пачку купонов со случайными уникальными кодами.
+
+    Коды загружаются через COPY во временную таблицу и переносятся в coupons одним
+    INSERT ... SELECT. Коды, совпавшие с существующими, пропускаются и генерируются заново,
+    пока не будет создано ровно count купонов. Все купоны пачки получают общий batch_id.
+
+    Args:
+        count (int): Количество купонов
+        amount (int): Сумма купона (0 для купонов на дни)
+        usage_limit (int): Лимит использований каждого купона
+        session (Any): Соединение с базой данных (не пул: временная таблица живет в транзакции)
+        days (int, optional): Количество дней для продления подписки
+        code_length (int): Длина кода купона
+
+    Returns:
+        int: batch_id созданной пачки
+    """
+    try:
+        async with session.transaction():
+            batch_id = await session.fetchval("SELECT nextval('coupon_batch_seq')")
+            await session.execute("CREATE TEMP TABLE coupon_codes_staging (code TEXT) ON COMMIT DROP")
+
+            created = 0
+            while created < count:
+                codes = set()
+                while len(codes) < count - created:
+                    codes.add("".join(secrets.choice(COUPON_CODE_ALPHABET) for _ in range(code_length)))
+                await session.copy_records_to_table(
+                    "coupon_codes_staging", records=[(code,) for code in codes], columns=["code"]
+                )
+                status = await session.execute(
+                    """
+                    INSERT INTO coupons (code, amount, usage_limit, usage_count, is_used, days, batch_id)
+                    SELECT code, $1, $2, 0, FALSE, $3, $4 FROM coupon_codes_staging
+                    ON CONFLICT (code) DO NOTHING
+                    """,
+                    amount,
+                    usage_limit,
+                    days,
+                    batch_id,
+                )
+                created += int(status.split()[-1])
+                await session.execute("TRUNCATE coupon_codes_staging")
+
+        logger.info(f"Создана пачка купонов {batch_id}: {count} шт. на сумму {amount} или {days} дней")
+        return batch_id
+    except Exception as e:
+        logger.error(f"Ошибка при массовом создании купонов: {e}")
+        raise
+
+
+async def find_coupon(coupon_code: str, session: Any) -> dict | None:
+    """
+    Ищет купон по коду независимо от того, исчерпан ли он.
+
+    Args:
+        coupon_code (str): Код купона
+        session (Any): Сессия базы данных
+
+    Returns:
+        dict | None: id, code, amount, usage_limit, usage_count, days, is_used или None
+    """
+    record = await session.fetchrow(
+        "SELECT id, code, amount, usage_limit, usage_count, days, is_used FROM coupons WHERE code = $1",
+        coupon_code,
+    )
+    return dict(record) if record else None
+
+
 async def get_coupon_by_code(coupon_code: str, session: Any) -> dict | None:
     """
     Получает информацию о купоне по его коду.
@@ -194,45 +372,130 @@ async def get_coupon_by_code(coupon_code: str, session: Any) -> dict | None:
         raise
 
 
-async def get_all_coupons(session: Any, page: int = 1, per_page: int = 10):
+async def activate_coupon_atomically(coupon_code: str, user_id: int, session: Any) -> dict[str, Any]:
     """
-    Получает список купонов из базы данных с пагинацией.
+    Активирует денежный купон одним запросом.
+
+    Счетчик использований увеличивается условным UPDATE: параллельные активации одного кода
+    ждут блокировку строки купона и перепроверяют лимит, поэтому купон не может быть
+    активирован больше usage_limit раз. В том же запросе записывается использование и
+    начисляется баланс (строка connections создается, если ее нет). Повторная одновременная
+    активация тем же пользователем упирается в первичный ключ coupon_usages, и весь запрос
+    откатывается.
 
     Args:
-        session (Any): Сессия базы данных для выполнения запроса
-        page (int): Номер страницы (по умолчанию 1)
-        per_page (int): Количество купонов на странице (по умолчанию 10)
+        coupon_code (str): Код купона
+        user_id (int): ID пользователя Telegram
+        session (Any): Сессия базы данных
 
     Returns:
-        dict: Словарь с информацией о купонах и пагинации:
-            - coupons (list): Список словарей с информацией о купонах
-            - total (int): Общее количество купонов
-            - pages (int): Общее количество страниц
-            - current_page (int): Текущая страница
-
-    Raises:
-        Exception: В случае ошибки при получении данных из базы
+        dict[str, Any]: status и amount купона. status — одно из:
+            "activated", "not_found", "already_used", "exhausted" или "not_balance"
+            (купон без суммы, например на продление подписки)
     """
     try:
-        offset = (page - 1) * per_page
-        coupons = await session.fetch(
+        record = await session.fetchrow(
             """
-            SELECT id, code, amount, usage_limit, usage_count, days, is_used  -- Добавлено id
-            FROM coupons
-            ORDER BY id
-            LIMIT $1 OFFSET $2
+            WITH claimed AS (
+                UPDATE coupons c
+                SET usage_count = c.usage_count + 1,
+                    is_used = (c.usage_limit > 0 AND c.usage_count + 1 >= c.usage_limit)
+                WHERE c.code = $1
+                  AND c.amount > 0
+                  AND c.is_used = FALSE
+                  AND (c.usage_limit = 0 OR c.usage_count < c.usage_limit)
+                  AND NOT EXISTS (SELECT 1 FROM coupon_usages u WHERE u.coupon_id = c.id AND u.user_id = $2)
+                RETURNING c.id, c.amount
+            ), used AS (
+                INSERT INTO coupon_usages (coupon_id, user_id)
+                SELECT id, $2 FROM claimed
+            ), credited AS (
+                INSERT INTO connections (tg_id, balance)
+                SELECT $2, amount FROM claimed
+                ON CONFLICT (tg_id) DO UPDATE SET balance = connections.balance + EXCLUDED.balance
+            )
+            SELECT
+                CASE
+                    WHEN EXISTS (SELECT 1 FROM claimed) THEN 'activated'
+                    WHEN c.id IS NULL THEN 'not_found'
+                    WHEN c.amount <= 0 THEN 'not_balance'
+                    WHEN EXISTS (SELECT 1 FROM coupon_usages u WHERE u.coupon_id = c.id AND u.user_id = $2)
+                        THEN 'already_used'
+                    ELSE 'exhausted'
+                END AS status,
+                c.amount
+            FROM (SELECT 1) AS probe
+            LEFT JOIN coupons c ON c.code = $1
             """,
-            per_page,
-            offset,
+            coupon_code,
+            user_id,
         )
-        total_count = await session.fetchval("SELECT COUNT(*) FROM coupons")
-        total_pages = -(-total_count // per_page)
-        logger.info(f"Успешно получено {len(coupons)} купонов из базы данных (страница {page})")
-        return {"coupons": coupons, "total": total_count, "pages": total_pages, "current_page": page}
+    except asyncpg.UniqueViolationError:
+        return {"status": "already_used", "amount": None}
+    except Exception as e:
+        logger.error(f"Ошибка при активации купона {coupon_code} пользователем {user_id}: {e}")
+        raise
+
+    if record["status"] == "activated":
+        user_snapshot_cache.pop(user_id, None)
+        logger.info(f"Купон {coupon_code} активирован пользователем {user_id}, начислено {record['amount']}")
+    return dict(record)
+
+
+async def get_all_coupons(
+    session: Any, after_id: int = 0, per_page: int = 10, before_id: int | None = None
+) -> dict[str, Any]:
+    """
+    Получает страницу купонов с keyset-пагинацией по id.
+
+    Страница выбирается диапазоном по первичному ключу, поэтому стоимость запроса не
+    зависит от номера страницы и общего числа купонов.
+
+    Args:
+        session (Any): Сессия базы данных для выполнения запроса
+        after_id (int): Вернуть купоны с id больше указанного (страница вперед)
+        per_page (int): Количество купонов на странице (по умолчанию 10)
+        before_id (int, optional): Вернуть купоны с id меньше указанного (страница назад)
+
+    Returns:
+        dict: Словарь с информацией о купонах и пагинации:
+            - coupons (list): Список записей купонов в порядке id
+            - has_prev (bool): Есть ли предыдущая страница
+            - has_next (bool): Есть ли следующая страница
+    """
+    try:
+        if before_id is None:
+            rows = await session.fetch(
+                """
+                SELECT id, code, amount, usage_limit, usage_count, days, is_used
+                FROM coupons
+                WHERE id > $1
+                ORDER BY id
+                LIMIT $2
+                """,
+                after_id,
+                per_page + 1,
+            )
+            coupons, has_prev, has_next = rows[:per_page], after_id > 0, len(rows) > per_page
+        else:
+            rows = await session.fetch(
+                """
+                SELECT id, code, amount, usage_limit, usage_count, days, is_used
+                FROM coupons
+                WHERE id < $1
+                ORDER BY id DESC
+                LIMIT $2
+                """,
+                before_id,
+                per_page + 1,
+            )
+            coupons, has_prev, has_next = list(reversed(rows[:per_page])), len(rows) > per_page, True
+        logger.info(f"Успешно получено {len(coupons)} купонов из базы данных")
+        return {"coupons": coupons, "has_prev": has_prev, "has_next": has_next}
     except Exception as e:
         logger.error(f"Критическая ошибка при получении списка купонов: {e}")
         logger.exception("Трассировка стека ошибки получения купонов")
-        return {"coupons": [], "total": 0, "pages": 0, "current_page": page}
+        return {"coupons": [], "has_prev": False, "has_next": False}
 
 
 async def delete_coupon(coupon_code: str, session: Any):
@@ -302,6 +565,7 @@ async def update_trial(tg_id: int, status: int, session: Any):
             tg_id,
             status,
         )
+        user_snapshot_cache.pop(tg_id, None)
         status_text = "восстановлен" if status == 0 else "использован"
         logger.info(f"Триальный период успешно {status_text} для пользователя {tg_id}")
         return True
@@ -355,7 +619,7 @@ async def check_connection_exists(tg_id: int):
         Exception: В случае ошибки при подключении к базе данных.
     """
     try:
-        conn = await asyncpg.connect(DATABASE_URL)
+        conn = await asyncpg.connect(DATABASE_URL, connection_class=InstrumentedConnection)
         exists = await conn.fetchval(
             """
             SELECT EXISTS(SELECT 1 FROM connections WHERE tg_id = $1)
@@ -411,6 +675,7 @@ async def store_key(
             key,
             server_id,
         )
+        user_snapshot_cache.pop(tg_id, None)
         logger.info(f"Ключ успешно сохранен для пользователя {tg_id} на сервере {server_id}")
     except Exception as e:
         logger.error(f"Ошибка при сохранении ключа для пользователя {tg_id}: {e}")
@@ -534,7 +799,7 @@ async def get_balance(tg_id: int) -> float:
     """
     conn = None
     try:
-        conn = await asyncpg.connect(DATABASE_URL)
+        conn = await asyncpg.connect(DATABASE_URL, connection_class=InstrumentedConnection)
         balance = await conn.fetchval("SELECT balance FROM connections WHERE tg_id = $1", tg_id)
         return round(balance, 1) if balance is not None else 0.0
     except Exception as e:
@@ -557,11 +822,12 @@ async def update_balance(
     Обновляет баланс пользователя в базе данных.
     - Кэшбек применяется только для положительных сумм, если пополнение НЕ через админку и не пропущен явно.
     - Реферальный бонус тоже не срабатывает, если явно попросили пропустить (например, при начислении за купон).
+    - Сумма прибавляется одним UPDATE, поэтому начисление не затирает одновременное списание.
     """
     conn = None
     try:
         if session is None:
-            conn = await asyncpg.connect(DATABASE_URL)
+            conn = await asyncpg.connect(DATABASE_URL, connection_class=InstrumentedConnection)
             session = conn
 
         if CASHBACK > 0 and amount > 0 and not is_admin and not skip_cashback:
@@ -571,26 +837,24 @@ async def update_balance(
 
         total_amount = int(amount + extra)
 
-        current_balance = await session.fetchval("SELECT balance FROM connections WHERE tg_id = $1", tg_id) or 0
-
-        new_balance = current_balance + total_amount
-
-        await session.execute(
+        new_balance = await session.fetchval(
             """
             UPDATE connections
-            SET balance = $1
+            SET balance = balance + $1
             WHERE tg_id = $2
+            RETURNING balance
             """,
-            new_balance,
+            total_amount,
             tg_id,
         )
+        user_snapshot_cache.pop(tg_id, None)
         logger.info(
-            f"Баланс пользователя {tg_id} обновлен. Было: {int(current_balance)}, пополнение: {amount} "
+            f"Баланс пользователя {tg_id} обновлен. Пополнение: {amount} "
             f"({'+ кешбэк' if extra > 0 else 'без кешбэка'}), стало: {new_balance}"
         )
 
         if not is_admin and not skip_referral:
-            await handle_referral_on_balance_update(tg_id, int(amount))
+            await handle_referral_on_balance_update(tg_id, int(amount), session)
 
     except Exception as e:
         logger.error(f"Ошибка при обновлении баланса для пользователя {tg_id}: {e}")
@@ -620,6 +884,63 @@ async def get_trial(tg_id: int, session: Any) -> int:
         return 0
 
 
+async def get_user_snapshot(tg_id: int, session: Any = None) -> dict[str, Any]:
+    """
+    Получает сводку пользователя одним запросом: баланс, статус триала, ключи и рефералы.
+
+    Результат кэшируется на USER_SNAPSHOT_TTL секунд. Функции, меняющие баланс, триал, ключи
+    и рефералов, сразу вытесняют сводку из кэша своей реплики, а изменения на других репликах
+    доходят через invalidation_bus.
+
+    Args:
+        tg_id (int): Telegram ID пользователя
+        session (Any): Сессия базы данных (если не передана, открывается отдельное подключение)
+
+    Returns:
+        dict: balance, trial, key_count, active_keys, frozen_keys, referral_count
+    """
+    snapshot = user_snapshot_cache.get(tg_id)
+    if snapshot is not None:
+        return snapshot
+
+    conn = None
+    try:
+        if session is None:
+            conn = await asyncpg.connect(DATABASE_URL, connection_class=InstrumentedConnection)
+            session = conn
+
+        record = await session.fetchrow(
+            """
+            SELECT
+                COALESCE(c.balance, 0) AS balance,
+                COALESCE(c.trial, 0) AS trial,
+                k.key_count,
+                k.active_keys,
+                k.frozen_keys,
+                (SELECT COUNT(*) FROM referrals r WHERE r.referrer_tg_id = $1) AS referral_count
+            FROM (SELECT $1::bigint AS tg_id) u
+            LEFT JOIN connections c ON c.tg_id = u.tg_id
+            CROSS JOIN LATERAL (
+                SELECT
+                    COUNT(*) AS key_count,
+                    COUNT(*) FILTER (WHERE NOT COALESCE(is_frozen, FALSE) AND expiry_time > $2) AS active_keys,
+                    COUNT(*) FILTER (WHERE is_frozen) AS frozen_keys
+                FROM keys
+                WHERE tg_id = $1
+            ) k
+            """,
+            tg_id,
+            int(datetime.now(pytz.utc).timestamp() * 1000),
+        )
+        snapshot = dict(record)
+        snapshot["balance"] = round(snapshot["balance"], 1)
+        user_snapshot_cache[tg_id] = snapshot
+        return snapshot
+    finally:
+        if conn:
+            await conn.close()
+
+
 async def get_key_count(tg_id: int) -> int:
     """
     Получает количество ключей для указанного пользователя.
@@ -635,7 +956,7 @@ async def get_key_count(tg_id: int) -> int:
     """
     conn = None
     try:
-        conn = await asyncpg.connect(DATABASE_URL)
+        conn = await asyncpg.connect(DATABASE_URL, connection_class=InstrumentedConnection)
         count = await conn.fetchval("SELECT COUNT(*) FROM keys WHERE tg_id = $1", tg_id)
         logger.info(f"Получено количество ключей для пользователя {tg_id}: {count}")
         return count if count is not None else 0
@@ -661,13 +982,14 @@ async def add_referral(referred_tg_id: int, referrer_tg_id: int, session: Any):
             referred_tg_id,
             referrer_tg_id,
         )
+        user_snapshot_cache.pop(referrer_tg_id, None)
         logger.info(f"Добавлена реферальная связь: приглашенный {referred_tg_id}, пригласивший {referrer_tg_id}")
     except Exception as e:
         logger.error(f"Ошибка при добавлении реферала: {e}")
         raise
 
 
-async def handle_referral_on_balance_update(tg_id: int, amount: float):
+async def handle_referral_on_balance_update(tg_id: int, amount: float, session: Any = None):
     """
     Обработка многоуровневой реферальной системы при обновлении баланса пользователя.
 
@@ -677,13 +999,16 @@ async def handle_referral_on_balance_update(tg_id: int, amount: float):
     Args:
         tg_id (int): Идентификатор Telegram пользователя, пополнившего баланс
         amount (float): Сумма пополнения баланса
+        session (Any, optional): Соединение вызывающего; бонусы начисляются в его транзакции
     """
 
     if amount <= 0:
         return
     conn = None
     try:
-        conn = await asyncpg.connect(DATABASE_URL)
+        if session is None:
+            conn = await asyncpg.connect(DATABASE_URL, connection_class=InstrumentedConnection)
+            session = conn
         logger.info(f"Начало обработки реферальной системы для пользователя {tg_id}")
 
         MAX_REFERRAL_LEVELS = len(REFERRAL_BONUS_PERCENTAGES.keys())
@@ -702,7 +1027,7 @@ async def handle_referral_on_balance_update(tg_id: int, amount: float):
 
             visited_tg_ids.add(current_tg_id)
 
-            referral = await conn.fetchrow(
+            referral = await session.fetchrow(
                 """
                 SELECT referrer_tg_id, reward_issued
                 FROM referrals 
@@ -743,10 +1068,10 @@ async def handle_referral_on_balance_update(tg_id: int, amount: float):
                 bonus_amount = bonus_val
 
             logger.info(f"Начисление бонуса {bonus_amount} рублей рефереру {referrer_tg_id} на уровне {level}.")
-            await update_balance(referrer_tg_id, bonus_amount, skip_referral=True, skip_cashback=True)
+            await update_balance(referrer_tg_id, bonus_amount, session, skip_referral=True, skip_cashback=True)
 
             if CHECK_REFERRAL_REWARD_ISSUED:
-                await conn.execute(
+                await session.execute(
                     """
                     UPDATE referrals
                     SET reward_issued = TRUE
@@ -925,7 +1250,7 @@ async def get_total_referral_bonus(conn, referrer_tg_id: int, max_levels: int) -
 async def get_referral_stats(referrer_tg_id: int):
     conn = None
     try:
-        conn = await asyncpg.connect(DATABASE_URL)
+        conn = await asyncpg.connect(DATABASE_URL, connection_class=InstrumentedConnection)
         logger.info(
             f"Установлено подключение к базе данных для получения статистики рефералов пользователя {referrer_tg_id}"
         )
@@ -979,6 +1304,79 @@ async def update_key_expiry(client_id: str, new_expiry_time: int, session: Any):
         raise
 
 
+async def renew_key_with_balance(tg_id: int, client_id: str, days: int, cost: float, session: Any) -> dict[str, Any]:
+    """
+    Продлевает ключ за счет баланса в одной транзакции.
+
+    Строки баланса и ключа блокируются (SELECT ... FOR UPDATE), поэтому проверка баланса,
+    списание, новый срок действия и очистка уведомлений о ключе выполняются атомарно:
+    параллельные нажатия ждут друг друга и не могут потратить один и тот же баланс дважды.
+    Новый срок считается от заблокированной строки ключа, а не от значения, прочитанного
+    до нажатия.
+
+    Args:
+        tg_id (int): ID пользователя Telegram
+        client_id (str): Идентификатор клиента
+        days (int): На сколько дней продлить
+        cost (float): Стоимость продления
+        session (Any): Соединение с базой данных (не пул: транзакция должна идти в одном соединении)
+
+    Returns:
+        dict[str, Any]: status ("renewed", "insufficient_funds" или "not_found"), а для найденного
+            ключа также email, server_id, cluster_name, expiry_time (новый срок), balance и required_amount
+    """
+    async with session.transaction():
+        record = await session.fetchrow(
+            """
+            SELECT c.balance, k.email, k.expiry_time, k.server_id, s.cluster_name
+            FROM connections c
+            JOIN keys k ON k.tg_id = c.tg_id AND k.client_id = $2
+            LEFT JOIN servers s ON s.server_name = k.server_id
+            WHERE c.tg_id = $1
+            FOR UPDATE OF c, k
+            """,
+            tg_id,
+            client_id,
+        )
+        if not record:
+            return {"status": "not_found"}
+
+        now_ms = int(datetime.now(pytz.utc).timestamp() * 1000)
+        new_expiry_time = max(record["expiry_time"], now_ms) + days * 86_400_000
+        result = {
+            "email": record["email"],
+            "server_id": record["server_id"],
+            "cluster_name": record["cluster_name"],
+            "expiry_time": new_expiry_time,
+            "balance": record["balance"],
+            "required_amount": max(cost - record["balance"], 0),
+        }
+        if record["balance"] < cost:
+            return {"status": "insufficient_funds", **result}
+
+        await session.execute(
+            """
+            WITH debit AS (
+                UPDATE connections SET balance = balance - $3 WHERE tg_id = $1
+            ), cleared AS (
+                DELETE FROM notifications WHERE tg_id = $1 AND notification_type = ANY($5::text[])
+            )
+            UPDATE keys
+            SET expiry_time = $4, notified = FALSE, notified_24h = FALSE
+            WHERE tg_id = $1 AND client_id = $2
+            """,
+            tg_id,
+            client_id,
+            cost,
+            new_expiry_time,
+            [f"{record['email']}_{suffix}" for suffix in RENEWAL_NOTIFICATION_SUFFIXES],
+        )
+
+    user_snapshot_cache.pop(tg_id, None)
+    logger.info(f"Ключ {client_id} пользователя {tg_id} продлен на {days} дн., списано {cost}")
+    return {"status": "renewed", **result, "balance": record["balance"] - cost}
+
+
 async def add_balance_to_client(client_id: str, amount: float):
     """
     Добавление баланса клиенту по его идентификатору Telegram.
@@ -992,7 +1390,7 @@ async def add_balance_to_client(client_id: str, amount: float):
     """
     conn = None
     try:
-        conn = await asyncpg.connect(DATABASE_URL)
+        conn = await asyncpg.connect(DATABASE_URL, connection_class=InstrumentedConnection)
         logger.info(f"Установлено подключение к базе данных для пополнения баланса клиента {client_id}")
 
         await conn.execute(
@@ -1030,7 +1428,7 @@ async def get_client_id_by_email(email: str):
     """
     conn = None
     try:
-        conn = await asyncpg.connect(DATABASE_URL)
+        conn = await asyncpg.connect(DATABASE_URL, connection_class=InstrumentedConnection)
         logger.info(f"Установлено подключение к базе данных для поиска client_id по email: {email}")
 
         client_id = await conn.fetchval(
@@ -1071,7 +1469,7 @@ async def get_tg_id_by_client_id(client_id: str):
     """
     conn = None
     try:
-        conn = await asyncpg.connect(DATABASE_URL)
+        conn = await asyncpg.connect(DATABASE_URL, connection_class=InstrumentedConnection)
         logger.info(f"Установлено подключение к базе данных для поиска Telegram ID по client_id: {client_id}")
 
         result = await conn.fetchrow("SELECT tg_id FROM keys WHERE client_id = $1", client_id)
@@ -1128,7 +1526,7 @@ async def upsert_user(
             conn = session
             logger.debug(f"Используем существующую сессию для обновления пользователя {tg_id}")
         else:
-            conn = await asyncpg.connect(DATABASE_URL)
+            conn = await asyncpg.connect(DATABASE_URL, connection_class=InstrumentedConnection)
             close_conn = True
             logger.info(f"Установлено новое подключение к базе данных для обновления пользователя {tg_id}")
 
@@ -1169,7 +1567,7 @@ async def upsert_user(
             logger.debug("Закрытие подключения к базе данных")
 
 
-async def add_payment(tg_id: int, amount: float, payment_system: str):
+async def add_payment(tg_id: int, amount: float, payment_system: str, session: Any = None):
     """
     Добавляет информацию о платеже в базу данных.
 
@@ -1177,16 +1575,20 @@ async def add_payment(tg_id: int, amount: float, payment_system: str):
         tg_id (int): Идентификатор пользователя в Telegram
         amount (float): Сумма платежа
         payment_system (str): Система оплаты
+        session (Any, optional): Соединение вызывающего; по умолчанию открывается новое
 
     Raises:
         Exception: В случае ошибки при добавлении платежа
     """
     conn = None
     try:
-        conn = await asyncpg.connect(DATABASE_URL)
-        logger.info(f"Установлено подключение к базе данных для добавления платежа пользователя {tg_id}")
+        if session is None:
+            conn = await asyncpg.connect(DATABASE_URL, connection_class=InstrumentedConnection)
+            session = conn
+            logger.info(f"Установлено подключение к базе данных для добавления платежа пользователя {tg_id}")
 
-        await conn.execute(
+        await _ensure_payments_partition()
+        await session.execute(
             """
             INSERT INTO payments (tg_id, amount, payment_system, status)
             VALUES ($1, $2, $3, 'success')
@@ -1205,6 +1607,35 @@ async def add_payment(tg_id: int, amount: float, payment_system: str):
             logger.info("Закрытие подключения к базе данных после добавления платежа")
 
 
+def _current_month() -> str:
+    return datetime.now(pytz.utc).strftime("%Y-%m")
+
+
+async def _ensure_payments_partition():
+    """
+    Создает секцию payments текущего и следующего месяца при первом платеже месяца в процессе.
+
+    Секции создаются в отдельном коротком соединении, чтобы транзакция вызывающего не держала
+    блокировки DDL. Если создать секцию не удалось, платеж попадает в payments_default и
+    переносится в секцию при следующем создании. С началом месяца в фоне также запускается
+    архивирование устаревших секций.
+    """
+    month = _current_month()
+    if month in _payments_partition_months:
+        return
+    conn = None
+    try:
+        conn = await asyncpg.connect(DATABASE_URL, connection_class=InstrumentedConnection)
+        await ensure_payments_partitions(conn, months_ahead=1)
+        _payments_partition_months.add(month)
+        ensure_payments_maintenance()
+    except Exception as e:
+        logger.warning(f"Не удалось создать секцию payments за {month}: {e}")
+    finally:
+        if conn:
+            await conn.close()
+
+
 async def add_notification(tg_id: int, notification_type: str, session: Any):
     """
     Добавляет запись о notification в базу данных.
@@ -1267,7 +1698,11 @@ async def check_notification_time(tg_id: int, notification_type: str, hours: int
     """
     conn = None
     try:
-        conn = session if session is not None else await asyncpg.connect(DATABASE_URL)
+        conn = (
+            session
+            if session is not None
+            else await asyncpg.connect(DATABASE_URL, connection_class=InstrumentedConnection)
+        )
 
         result = await conn.fetchval(
             """
@@ -1316,7 +1751,11 @@ async def get_last_notification_time(tg_id: int, notification_type: str, session
     """
     conn = None
     try:
-        conn = session if session is not None else await asyncpg.connect(DATABASE_URL)
+        conn = (
+            session
+            if session is not None
+            else await asyncpg.connect(DATABASE_URL, connection_class=InstrumentedConnection)
+        )
 
         last_notification_time = await conn.fetchval(
             """
@@ -1342,7 +1781,11 @@ async def get_last_notification_time(tg_id: int, notification_type: str, session
 async def get_servers(session: Any = None):
     conn = None
     try:
-        conn = session if session is not None else await asyncpg.connect(DATABASE_URL)
+        conn = (
+            session
+            if session is not None
+            else await asyncpg.connect(DATABASE_URL, connection_class=InstrumentedConnection)
+        )
 
         result = await conn.fetch(
             """
@@ -1409,7 +1852,11 @@ async def store_gift_link(
     """
     conn = None
     try:
-        conn = session if session is not None else await asyncpg.connect(DATABASE_URL)
+        conn = (
+            session
+            if session is not None
+            else await asyncpg.connect(DATABASE_URL, connection_class=InstrumentedConnection)
+        )
 
         result = await conn.execute(
             """
@@ -1499,11 +1946,12 @@ async def delete_key(identifier, session):
         identifier_str = str(identifier)
 
         if identifier_str.isdigit():
-            query = "DELETE FROM keys WHERE tg_id = $1"
+            query = "DELETE FROM keys WHERE tg_id = $1 RETURNING tg_id"
         else:
-            query = "DELETE FROM keys WHERE client_id = $1"
+            query = "DELETE FROM keys WHERE client_id = $1 RETURNING tg_id"
 
-        await session.execute(query, identifier)
+        for row in await session.fetch(query, identifier):
+            user_snapshot_cache.pop(row["tg_id"], None)
         logger.info(f"Ключ с идентификатором {identifier} успешно удалён")
     except Exception as e:
         logger.error(f"Ошибка при удалении ключа с идентификатором {identifier} из базы данных: {e}")
@@ -1767,7 +2215,11 @@ async def get_all_keys(session: Any = None):
     """
     conn = None
     try:
-        conn = session if session is not None else await asyncpg.connect(DATABASE_URL)
+        conn = (
+            session
+            if session is not None
+            else await asyncpg.connect(DATABASE_URL, connection_class=InstrumentedConnection)
+        )
         keys = await conn.fetch("SELECT * FROM keys")
         logger.info(f"Успешно получены все записи из таблицы keys. Количество: {len(keys)}")
         return keys
@@ -1,14 +1,17 @@
 import asyncio
 import time
 
+from collections.abc import AsyncIterator, Awaitable, Callable
 from typing import Any
 
 import asyncpg
 
 from aiogram import F, Router, types
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import CallbackQuery, Message
+from cachetools import TTLCache
 from py3xui import AsyncApi
 
 from backup import create_backup_and_send_to_admins
@@ -17,6 +20,7 @@ from database import check_unique_server_name, get_servers, update_key_expiry
 from filters.admin import IsAdminFilter
 from handlers.keys.key_utils import create_client_on_server, create_key_on_cluster, renew_key_in_cluster
 from logger import logger
+from utils.db_metrics import InstrumentedConnection
 
 from ..panel.keyboard import AdminPanelCallback, build_admin_back_kb
 from .keyboard import (
@@ -31,6 +35,13 @@ from .keyboard import (
 
 router = Router()
 
+PANEL_REQUEST_TIMEOUT = 15
+PANEL_BACKUP_TIMEOUT = 60
+PROGRESS_EDIT_INTERVAL = 1.5
+ONLINE_CACHE_TTL = 30
+
+online_cache = TTLCache(maxsize=256, ttl=ONLINE_CACHE_TTL)
+
 
 class AdminClusterStates(StatesGroup):
     waiting_for_cluster_name = State()
@@ -232,7 +243,7 @@ async def handle_inbound_id_input(message: Message, state: FSMContext):
     api_url = user_data.get("api_url")
     subscription_url = user_data.get("subscription_url")
 
-    conn = await asyncpg.connect(DATABASE_URL)
+    conn = await asyncpg.connect(DATABASE_URL, connection_class=InstrumentedConnection)
     await conn.execute(
         """
         INSERT INTO servers (cluster_name, server_name, api_url, subscription_url, inbound_id) 
@@ -269,6 +280,58 @@ async def handle_clusters_manage(
     )
 
 
+async def _fan_out_servers(
+    servers: list[dict], operation: Callable[[dict], Awaitable[Any]], timeout: float  # noqa: ASYNC109
+) -> AsyncIterator[tuple[dict, Any, Exception | None]]:
+    """
+    Выполняет операцию на всех серверах одновременно и отдает результаты по мере готовности.
+
+    Каждый сервер ограничен своим таймаутом, поэтому недоступный сервер не задерживает остальные.
+    """
+
+    async def run(server: dict) -> tuple[dict, Any, Exception | None]:
+        try:
+            return server, await asyncio.wait_for(operation(server), timeout), None
+        except TimeoutError:
+            return server, None, TimeoutError(f"нет ответа за {timeout} с")
+        except Exception as e:
+            return server, None, e
+
+    for next_result in asyncio.as_completed([run(server) for server in servers]):
+        yield await next_result
+
+
+async def _edit_progress(message: Message, text: str, last_edit: float, force: bool = False) -> float:
+    """Обновляет сообщение с результатами не чаще PROGRESS_EDIT_INTERVAL секунд."""
+    now = time.monotonic()
+    if not force and now - last_edit < PROGRESS_EDIT_INTERVAL:
+        return last_edit
+    try:
+        await message.edit_text(text=text, reply_markup=build_admin_back_kb("clusters") if force else None)
+    except TelegramBadRequest as e:
+        if "message is not modified" not in str(e):
+            logger.warning(f"Не удалось обновить прогресс: {e}")
+    return now
+
+
+async def _get_online_count(server: dict) -> int:
+    """Число клиентов онлайн на сервере с кэшированием на ONLINE_CACHE_TTL секунд."""
+    cached = online_cache.get(server["api_url"])
+    if cached is not None:
+        return cached
+
+    xui = AsyncApi(server["api_url"], username=ADMIN_USERNAME, password=ADMIN_PASSWORD, logger=logger)
+    await xui.login()
+    online_users = len(await xui.client.online())
+    online_cache[server["api_url"]] = online_users
+    return online_users
+
+
+async def _backup_server(server: dict) -> None:
+    xui = AsyncApi(server["api_url"], username=ADMIN_USERNAME, password=ADMIN_PASSWORD, logger=logger)
+    await create_backup_and_send_to_admins(xui)
+
+
 @router.callback_query(AdminClusterCallback.filter(F.action == "availability"), IsAdminFilter())
 async def handle_cluster_availability(
     callback_query: types.CallbackQuery, callback_data: AdminClusterCallback, session: Any
@@ -282,30 +345,28 @@ async def handle_cluster_availability(
         await callback_query.message.edit_text(text=f"Кластер '{cluster_name}' не содержит серверов.")
         return
 
-    text = (
-        f"🖥️ Проверка доступности серверов для кластера {cluster_name}.\n\n"
-        "Это может занять до 1 минуты, пожалуйста, подождите..."
-    )
-
-    await callback_query.message.edit_text(text=text)
+    header = f"<b>🖥️ Проверка доступности серверов</b>\n\n⚙️ Кластер: <b>{cluster_name}</b>\n\n"
+    await callback_query.message.edit_text(text=f"{header}⏳ Опрашиваем серверы: {len(cluster_servers)}...")
 
     total_online_users = 0
-    result_text = f"<b>🖥️ Проверка доступности серверов</b>\n\n⚙️ Кластер: <b>{cluster_name}</b>\n\n"
-
-    for server in cluster_servers:
-        xui = AsyncApi(server["api_url"], username=ADMIN_USERNAME, password=ADMIN_PASSWORD, logger=logger)
-
-        try:
-            await xui.login()
-            online_users = len(await xui.client.online())
+    lines = []
+    last_edit = time.monotonic()
+
+    async for server, online_users, error in _fan_out_servers(
+        cluster_servers, _get_online_count, PANEL_REQUEST_TIMEOUT
+    ):
+        if error:
+            lines.append(f"❌ <b>{server['server_name']}</b> - ошибка: {error}")
+        else:
             total_online_users += online_users
-            result_text += f"🌍 <b>{server['server_name']}</b> - онлайн: {online_users}\n"
-        except Exception as e:
-            result_text += f"❌ <b>{server['server_name']}</b> - ошибка: {e}\n"
+            lines.append(f"🌍 <b>{server['server_name']}</b> - онлайн: {online_users}")
 
-    result_text += f"\n👥 Всего пользователей онлайн: {total_online_users}"
+        pending = len(cluster_servers) - len(lines)
+        footer = f"\n\n⏳ Ожидаем ответа: {pending}" if pending else ""
+        last_edit = await _edit_progress(callback_query.message, header + "\n".join(lines) + footer, last_edit)
 
-    await callback_query.message.edit_text(text=result_text, reply_markup=build_admin_back_kb("clusters"))
+    result_text = header + "\n".join(lines) + f"\n\n👥 Всего пользователей онлайн: {total_online_users}"
+    await _edit_progress(callback_query.message, result_text, last_edit, force=True)
 
 
 @router.callback_query(AdminClusterCallback.filter(F.action == "backup"), IsAdminFilter())
@@ -317,24 +378,28 @@ async def handle_clusters_backup(
     servers = await get_servers(session)
     cluster_servers = servers.get(cluster_name, [])
 
-    for server in cluster_servers:
-        xui = AsyncApi(
-            server["api_url"],
-            username=ADMIN_USERNAME,
-            password=ADMIN_PASSWORD,
-            logger=logger,
-        )
-        await create_backup_and_send_to_admins(xui)
+    header = f"<b>💾 Бэкап кластера {cluster_name}</b>\n\n"
+    await callback_query.message.edit_text(text=f"{header}⏳ Запускаем бэкап на серверах: {len(cluster_servers)}...")
 
-    text = (
-        f"<b>Бэкап для кластера {cluster_name} был успешно создан и отправлен администраторам!</b>\n\n"
-        f"🔔 <i>Бэкапы отправлены в боты панелей.</i>"
-    )
+    lines = []
+    failed = 0
+    last_edit = time.monotonic()
 
-    await callback_query.message.edit_text(
-        text=text,
-        reply_markup=build_admin_back_kb("clusters"),
-    )
+    async for server, _, error in _fan_out_servers(cluster_servers, _backup_server, PANEL_BACKUP_TIMEOUT):
+        if error:
+            failed += 1
+            logger.error(f"Ошибка при создании бэкапа панели {server['server_name']}: {error}")
+            lines.append(f"❌ <b>{server['server_name']}</b> - ошибка: {error}")
+        else:
+            lines.append(f"✅ <b>{server['server_name']}</b> - бэкап отправлен")
+        last_edit = await _edit_progress(callback_query.message, header + "\n".join(lines), last_edit)
+
+    if failed:
+        summary = f"⚠️ Бэкап создан на {len(cluster_servers) - failed} из {len(cluster_servers)} серверов."
+    else:
+        summary = "🔔 <i>Бэкапы отправлены в боты панелей.</i>"
+
+    await _edit_progress(callback_query.message, header + "\n".join(lines) + f"\n\n{summary}", last_edit, force=True)
 
 
 @router.callback_query(AdminClusterCallback.filter(F.action == "sync"), IsAdminFilter())
@@ -583,7 +648,7 @@ async def handle_new_cluster_name_input(message: Message, state: FSMContext, ses
     user_data = await state.get_data()
     old_cluster_name = user_data.get("old_cluster_name")
 
-    conn = await asyncpg.connect(DATABASE_URL)
+    conn = await asyncpg.connect(DATABASE_URL, connection_class=InstrumentedConnection)
     try:
         existing_cluster = await conn.fetchval(
             "SELECT cluster_name FROM servers WHERE cluster_name = $1 LIMIT 1",
@@ -688,7 +753,7 @@ async def handle_new_server_name_input(message: Message, state: FSMContext, sess
     old_server_name = user_data.get("old_server_name")
     cluster_name = user_data.get("cluster_name")
 
-    conn = await asyncpg.connect(DATABASE_URL)
+    conn = await asyncpg.connect(DATABASE_URL, connection_class=InstrumentedConnection)
     try:
         existing_server = await conn.fetchval(
             "SELECT server_name FROM servers WHERE cluster_name = $1 AND server_name = $2 LIMIT 1",
@@ -748,7 +813,7 @@ async def handle_server_transfer(callback_query: CallbackQuery, state: FSMContex
     user_data = await state.get_data()
     cluster_name = user_data.get("cluster_name")
 
-    conn = await asyncpg.connect(DATABASE_URL)
+    conn = await asyncpg.connect(DATABASE_URL, connection_class=InstrumentedConnection)
     try:
         async with conn.transaction():
             await conn.execute(
@@ -792,7 +857,7 @@ async def handle_cluster_transfer(callback_query: CallbackQuery, state: FSMConte
     user_data = await state.get_data()
     cluster_name = user_data.get("cluster_name")
 
-    conn = await asyncpg.connect(DATABASE_URL)
+    conn = await asyncpg.connect(DATABASE_URL, connection_class=InstrumentedConnection)
     try:
         async with conn.transaction():
             await conn.execute(
@@ -18,11 +18,14 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 from config import INLINE_MODE, USERNAME_BOT
 from database import (
+    activate_coupon_atomically,
     add_connection,
     check_connection_exists,
     create_coupon,
     create_coupon_usage,
+    create_coupons_bulk,
     delete_coupon,
+    find_coupon,
     get_all_coupons,
     get_keys,
     update_key_expiry,
@@ -33,18 +36,30 @@ from handlers.keys.key_utils import renew_key_in_cluster
 from handlers.profile import process_callback_view_profile
 from handlers.utils import format_days
 from logger import logger
+from utils.csv_export import export_coupons_csv
 
 from ..panel.keyboard import AdminPanelCallback, build_admin_back_kb
-from .keyboard import AdminCouponDeleteCallback, build_coupons_kb, build_coupons_list_kb, format_coupons_list
+from ..stats.stats_handler import send_csv_export
+from .keyboard import (
+    AdminCouponDeleteCallback,
+    AdminCouponsPageCallback,
+    build_coupons_kb,
+    build_coupons_list_kb,
+    format_coupons_list,
+)
 
 
 router = Router()
 
+COUPONS_PER_PAGE = 10
+MAX_BULK_COUPONS = 10_000
+
 
 class AdminCouponsState(StatesGroup):
     waiting_for_coupon_type = State()
     waiting_for_balance_data = State()
     waiting_for_days_data = State()
+    waiting_for_bulk_data = State()
     waiting_for_key_selection = State()
 
 
@@ -206,15 +221,110 @@ async def handle_days_coupon_input(message: Message, state: FSMContext, session:
         await message.answer("❌ Произошла ошибка при создании купона.", reply_markup=kb.as_markup())
 
 
+@router.callback_query(
+    AdminPanelCallback.filter(F.action == "coupons_bulk"),
+    IsAdminFilter(),
+)
+async def handle_coupons_bulk(callback_query: CallbackQuery, state: FSMContext):
+    text = (
+        "📦 <b>Введите данные для создания пачки купонов в формате:</b>\n\n"
+        "🔢 <i>количество</i> 💰 <i>сумма</i> ⏳ <i>дни</i> 🔢 <i>лимит</i>\n\n"
+        "Укажите либо сумму, либо дни, второе значение — 0.\n"
+        f"Не более {MAX_BULK_COUPONS} купонов за раз.\n\n"
+        "Пример: <b>'500 100 0 1'</b> 👈\n\n"
+    )
+    kb = InlineKeyboardBuilder()
+    kb.button(text=BACK, callback_data=AdminPanelCallback(action="coupons").pack())
+
+    await callback_query.message.edit_text(text=text, reply_markup=kb.as_markup())
+    await state.set_state(AdminCouponsState.waiting_for_bulk_data)
+
+
+@router.message(AdminCouponsState.waiting_for_bulk_data, IsAdminFilter())
+async def handle_bulk_coupon_input(message: Message, state: FSMContext, session: Any):
+    parts = message.text.strip().split()
+
+    kb = InlineKeyboardBuilder()
+    kb.button(text=BACK, callback_data=AdminPanelCallback(action="coupons").pack())
+
+    try:
+        if len(parts) != 4:
+            raise ValueError("Неверное количество параметров")
+        count, amount, days, usage_limit = map(int, parts)
+        if not 0 < count <= MAX_BULK_COUPONS or usage_limit <= 0:
+            raise ValueError("Количество или лимит вне допустимого диапазона")
+        if (amount > 0) == (days > 0) or amount < 0 or days < 0:
+            raise ValueError("Нужно указать либо сумму, либо дни")
+    except ValueError:
+        text = (
+            "❌ <b>Некорректный формат!</b> 📝 Пожалуйста, введите данные в формате:\n"
+            "🔢 <b>количество</b> 💰 <b>сумма</b> ⏳ <b>дни</b> 🔢 <b>лимит</b>\n"
+            f"Количество — от 1 до {MAX_BULK_COUPONS}, ровно одно из значений суммы и дней больше 0.\n"
+            "Пример: <b>'500 100 0 1'</b> 👈"
+        )
+        await message.answer(text=text, reply_markup=kb.as_markup())
+        return
+
+    try:
+        batch_id = await create_coupons_bulk(count, amount, usage_limit, session, days=days or None)
+        export = await export_coupons_csv(session, USERNAME_BOT, batch_id=batch_id)
+        try:
+            bonus = f"💰 Сумма: <b>{amount} рублей</b>" if amount else f"⏳ <b>{format_days(days)}</b>"
+            caption = (
+                f"✅ Создана пачка <b>#{batch_id}</b>: <b>{count}</b> купонов\n"
+                f"{bonus}\n"
+                f"🔢 Лимит использования: <b>{usage_limit} раз</b>"
+            )
+            await message.answer_document(document=export.as_input_file(), caption=caption)
+        finally:
+            export.cleanup()
+
+        await message.answer("🛠 Меню управления купонами:", reply_markup=build_coupons_kb())
+        await state.clear()
+
+    except Exception as e:
+        logger.error(f"Ошибка при создании пачки купонов: {e}")
+        await message.answer("❌ Произошла ошибка при создании пачки купонов.", reply_markup=kb.as_markup())
+
+
+@router.callback_query(
+    AdminPanelCallback.filter(F.action == "coupons_export"),
+    IsAdminFilter(),
+)
+async def handle_coupons_export(callback_query: CallbackQuery, session: Any):
+    try:
+        await send_csv_export(
+            callback_query,
+            session,
+            lambda session, progress: export_coupons_csv(session, USERNAME_BOT, progress),
+            "📥 Экспорт купонов в CSV",
+        )
+    except Exception as e:
+        logger.error(f"Ошибка при экспорте купонов в CSV: {e}")
+        await callback_query.message.answer(
+            f"❗ Произошла ошибка при экспорте: {e}", reply_markup=build_admin_back_kb("coupons")
+        )
+
+
 @router.callback_query(
     AdminPanelCallback.filter(F.action == "coupons_list"),
     IsAdminFilter(),
 )
 async def handle_coupons_list(callback_query: CallbackQuery, session: Any):
     try:
-        data = AdminPanelCallback.unpack(callback_query.data)
-        page = data.page if data.page is not None else 1
-        await update_coupons_list(callback_query.message, session, page)
+        await update_coupons_list(callback_query.message, session)
+    except Exception as e:
+        logger.error(f"Ошибка при получении списка купонов: {e}")
+        await callback_query.message.edit_text("Произошла ошибка при получении списка купонов.")
+
+
+@router.callback_query(AdminCouponsPageCallback.filter(), IsAdminFilter())
+async def handle_coupons_page(callback_query: CallbackQuery, callback_data: AdminCouponsPageCallback, session: Any):
+    try:
+        if callback_data.backward:
+            await update_coupons_list(callback_query.message, session, before_id=callback_data.cursor)
+        else:
+            await update_coupons_list(callback_query.message, session, after_id=callback_data.cursor)
     except Exception as e:
         logger.error(f"Ошибка при получении списка купонов: {e}")
         await callback_query.message.edit_text("Произошла ошибка при получении списка купонов.")
@@ -265,11 +375,14 @@ async def confirm_coupon_delete(callback_query: CallbackQuery, callback_data: Ad
     await update_coupons_list(callback_query.message, session)
 
 
-async def update_coupons_list(message, session: Any, page: int = 1):
-    per_page = 10
-    result = await get_all_coupons(session, page, per_page)
+async def update_coupons_list(message, session: Any, after_id: int = 0, before_id: int | None = None):
+    result = await get_all_coupons(session, after_id, COUPONS_PER_PAGE, before_id)
     coupons = result["coupons"]
 
+    if not coupons and (after_id or before_id is not None):
+        result = await get_all_coupons(session, per_page=COUPONS_PER_PAGE)
+        coupons = result["coupons"]
+
     if not coupons:
         await message.edit_text(
             text="❌ На данный момент нет доступных купонов!",
@@ -277,7 +390,7 @@ async def update_coupons_list(message, session: Any, page: int = 1):
         )
         return
 
-    kb = build_coupons_list_kb(coupons, result["current_page"], result["pages"])
+    kb = build_coupons_list_kb(coupons, result["has_prev"], result["has_next"])
     text = format_coupons_list(coupons, USERNAME_BOT)
     await message.edit_text(text=text, reply_markup=kb)
 
@@ -290,8 +403,7 @@ async def inline_coupon_handler(inline_query: InlineQuery, session: Any):
     coupon_code = inline_query.query.split("coupon_")[1]
     coupon_link = f"https://t.me/{USERNAME_BOT}?start=coupons_{coupon_code}"
 
-    coupons = await get_all_coupons(session, page=1, per_page=10)
-    coupon = next((c for c in coupons["coupons"] if c["code"] == coupon_code), None)
+    coupon = await find_coupon(coupon_code, session)
 
     if not coupon:
         await inline_query.answer(
@@ -334,8 +446,7 @@ async def inline_coupon_handler(inline_query: InlineQuery, session: Any):
 async def handle_coupon_activation(message: Message, state: FSMContext, session: Any, admin: bool = False):
     coupon_code = message.text.split("coupons_")[1]
 
-    coupons = await get_all_coupons(session, page=1, per_page=10)
-    coupon = next((c for c in coupons["coupons"] if c["code"] == coupon_code), None)
+    coupon = await find_coupon(coupon_code, session)
 
     if not coupon:
         await message.answer("❌ Купон не найден.")
@@ -359,17 +470,13 @@ async def handle_coupon_activation(message: Message, state: FSMContext, session:
         await add_connection(tg_id=message.from_user.id, session=session)
 
     if coupon["amount"] > 0:
-        await session.execute(
-            "UPDATE connections SET balance = balance + $1 WHERE tg_id = $2",
-            coupon["amount"],
-            message.from_user.id
-        )
-        await session.execute(
-            "UPDATE coupons SET usage_count = usage_count + 1, is_used = $1 WHERE id = $2",
-            coupon["usage_count"] + 1 >= coupon["usage_limit"],
-            coupon["id"]
-        )
-        await create_coupon_usage(coupon["id"], message.from_user.id, session)
+        result = await activate_coupon_atomically(coupon_code, message.from_user.id, session)
+        if result["status"] == "already_used":
+            await message.answer("❌ Вы уже активировали этот купон.")
+            return
+        if result["status"] != "activated":
+            await message.answer("❌ Лимит активаций купона исчерпан.")
+            return
         await message.answer(f"✅ Купон активирован, на баланс начислено {coupon['amount']} рублей.")
         await process_callback_view_profile(message, state, admin)
         return
@@ -467,7 +574,7 @@ async def handle_key_extension(callback_query: CallbackQuery, state: FSMContext,
         text = f"✅ Купон активирован, подписка <b>{alias}</b> продлена на {format_days(coupon['days'])}⏳ до {expiry_date}📆."
 
         await callback_query.message.answer(text)
-        await process_callback_view_profile(callback_query.message, state, admin)
+        await process_callback_view_profile(callback_query.message, state, admin, session)
         await state.clear()
 
     except Exception as e:
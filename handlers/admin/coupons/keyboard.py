@@ -15,15 +15,23 @@ class AdminCouponDeleteCallback(CallbackData, prefix="admin_coupon_delete"):
     confirm: Optional[bool] = None
 
 
+class AdminCouponsPageCallback(CallbackData, prefix="admin_coupons_page"):
+    cursor: int
+    backward: bool = False
+
+
 def build_coupons_kb() -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.button(text="➕ Создать купон", callback_data=AdminPanelCallback(action="coupons_create").pack())
+    builder.button(text="📦 Создать пачку", callback_data=AdminPanelCallback(action="coupons_bulk").pack())
     builder.button(text="Купоны", callback_data=AdminPanelCallback(action="coupons_list").pack())
+    builder.button(text="📥 Экспорт в CSV", callback_data=AdminPanelCallback(action="coupons_export").pack())
+    builder.adjust(1)
     builder.row(build_admin_back_btn())
     return builder.as_markup()
 
 
-def build_coupons_list_kb(coupons: list, current_page: int, total_pages: int) -> InlineKeyboardMarkup:
+def build_coupons_list_kb(coupons: list, has_prev: bool, has_next: bool) -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
 
     for coupon in coupons:
@@ -32,27 +40,27 @@ def build_coupons_list_kb(coupons: list, current_page: int, total_pages: int) ->
             text=f"❌{coupon_code}",
             callback_data=AdminCouponDeleteCallback(coupon_code=coupon_code).pack(),
         )
+    builder.adjust(2)
 
     pagination_buttons = []
-    if current_page > 1:
+    if has_prev:
         pagination_buttons.append(
             InlineKeyboardButton(
                 text=BACK,
-                callback_data=AdminPanelCallback(action="coupons_list", page=current_page - 1).pack(),
+                callback_data=AdminCouponsPageCallback(cursor=coupons[0]["id"], backward=True).pack(),
             )
         )
-    if current_page < total_pages:
+    if has_next:
         pagination_buttons.append(
             InlineKeyboardButton(
                 text="Вперед ➡️",
-                callback_data=AdminPanelCallback(action="coupons_list", page=current_page + 1).pack(),
+                callback_data=AdminCouponsPageCallback(cursor=coupons[-1]["id"]).pack(),
             )
         )
     if pagination_buttons:
         builder.row(*pagination_buttons)
 
     builder.row(build_admin_back_btn("coupons"))
-    builder.adjust(2)
     return builder.as_markup()
 
 
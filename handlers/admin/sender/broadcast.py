@@ -0,0 +1,302 @@
+import asyncio
+import time
+
+from typing import Any
+
+import asyncpg
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+
+from bot import bot, dp
+from config import DATABASE_URL
+from logger import logger
+from utils.db_metrics import InstrumentedConnection
+from utils.leader import lease_key
+from utils.rate_governor import mark_bulk_traffic
+
+from .keyboard import build_broadcast_kb
+
+
+BROADCAST_CONCURRENCY = 20
+BROADCAST_BATCH_SIZE = 200
+BROADCAST_PROGRESS_INTERVAL = 5
+
+# $1 — курсор (последний обработанный tg_id), $2 — размер пачки, $3 — параметр аудитории.
+AUDIENCE_QUERIES = {
+    "all": """
+        SELECT c.tg_id FROM connections c
+        WHERE c.tg_id > $1 AND NOT EXISTS (SELECT 1 FROM blocked_users b WHERE b.tg_id = c.tg_id)
+        ORDER BY c.tg_id LIMIT $2
+    """,
+    "subscribed": """
+        SELECT c.tg_id FROM connections c
+        WHERE c.tg_id > $1 AND NOT EXISTS (SELECT 1 FROM blocked_users b WHERE b.tg_id = c.tg_id)
+          AND EXISTS (SELECT 1 FROM keys k WHERE k.tg_id = c.tg_id AND k.expiry_time > $3)
+        ORDER BY c.tg_id LIMIT $2
+    """,
+    "unsubscribed": """
+        SELECT c.tg_id FROM connections c
+        WHERE c.tg_id > $1 AND NOT EXISTS (SELECT 1 FROM blocked_users b WHERE b.tg_id = c.tg_id)
+          AND NOT EXISTS (SELECT 1 FROM keys k WHERE k.tg_id = c.tg_id AND k.expiry_time > $3)
+        ORDER BY c.tg_id LIMIT $2
+    """,
+    "untrial": """
+        SELECT c.tg_id FROM connections c
+        WHERE c.tg_id > $1 AND NOT EXISTS (SELECT 1 FROM blocked_users b WHERE b.tg_id = c.tg_id) AND c.trial = 0
+        ORDER BY c.tg_id LIMIT $2
+    """,
+    "cluster": """
+        SELECT c.tg_id FROM connections c
+        WHERE c.tg_id > $1 AND NOT EXISTS (SELECT 1 FROM blocked_users b WHERE b.tg_id = c.tg_id)
+          AND EXISTS (SELECT 1 FROM keys k WHERE k.tg_id = c.tg_id AND k.server_id = $3)
+        ORDER BY c.tg_id LIMIT $2
+    """,
+}
+
+_running: dict[int, asyncio.Task] = {}
+
+
+def _audience_args(job: asyncpg.Record) -> list[Any]:
+    if job["audience"] in ("subscribed", "unsubscribed"):
+        return [int(job["created_at"].timestamp() * 1000)]
+    if job["audience"] == "cluster":
+        return [job["cluster_name"]]
+    return []
+
+
+async def create_broadcast(
+    conn: Any, admin_chat_id: int, from_chat_id: int, message_id: int, audience: str, cluster_name: str | None
+) -> asyncpg.Record:
+    """
+    Создает задание рассылки и считает число получателей.
+
+    Сообщение рассылается через copy_message из чата администратора, поэтому медиа не
+    загружается заново для каждого получателя, а исходное сообщение нельзя удалять до конца рассылки.
+    """
+    if audience not in AUDIENCE_QUERIES:
+        audience = "all"
+
+    job = await conn.fetchrow(
+        """
+        INSERT INTO broadcasts (admin_chat_id, from_chat_id, message_id, audience, cluster_name)
+        VALUES ($1, $2, $3, $4, $5)
+        RETURNING *
+        """,
+        admin_chat_id,
+        from_chat_id,
+        message_id,
+        audience,
+        cluster_name,
+    )
+    total = await conn.fetchval(
+        f"SELECT COUNT(*) FROM ({AUDIENCE_QUERIES[audience]}) AS audience",  # noqa: S608
+        0,
+        None,
+        *_audience_args(job),
+    )
+    return await conn.fetchrow("UPDATE broadcasts SET total = $2 WHERE id = $1 RETURNING *", job["id"], total)
+
+
+def start_broadcast(job_id: int) -> None:
+    """Запускает отправку задания в фоне, если она еще не идет в этом процессе."""
+    task = _running.get(job_id)
+    if task is None or task.done():
+        _running[job_id] = asyncio.create_task(_run_broadcast(job_id))
+
+
+async def set_broadcast_status(conn: Any, job_id: int, status: str) -> asyncpg.Record | None:
+    """
+    Ставит рассылку на паузу, возобновляет или отменяет ее.
+
+    Отправка проверяет статус перед каждой пачкой, поэтому пауза срабатывает на любой реплике.
+    """
+    job = await conn.fetchrow(
+        """
+        UPDATE broadcasts SET status = $2, updated_at = CURRENT_TIMESTAMP
+        WHERE id = $1 AND status IN ('running', 'paused')
+        RETURNING *
+        """,
+        job_id,
+        status,
+    )
+    if job and status == "running":
+        start_broadcast(job_id)
+    return job
+
+
+async def resume_broadcasts() -> None:
+    """
+    Возобновляет рассылки, прерванные перезапуском бота.
+
+    Зарегистрирована в dp.startup, поэтому вызывается при запуске polling и воркеров webhook.
+    """
+    conn = None
+    try:
+        conn = await asyncpg.connect(DATABASE_URL, connection_class=InstrumentedConnection)
+        job_ids = await conn.fetch("SELECT id FROM broadcasts WHERE status = 'running'")
+    except Exception as e:
+        logger.error(f"Ошибка при возобновлении рассылок: {e}")
+        return
+    finally:
+        if conn:
+            await conn.close()
+
+    for record in job_ids:
+        logger.info(f"📤 Возобновление рассылки #{record['id']}")
+        start_broadcast(record["id"])
+
+
+dp.startup.register(resume_broadcasts)
+
+
+async def _deliver(job: asyncpg.Record, tg_id: int, semaphore: asyncio.Semaphore) -> str:
+    async with semaphore:
+        try:
+            await bot.copy_message(chat_id=tg_id, from_chat_id=job["from_chat_id"], message_id=job["message_id"])
+            return "sent"
+        except TelegramForbiddenError:
+            return "blocked"
+        except TelegramBadRequest as e:
+            if "chat not found" in str(e).lower():
+                return "blocked"
+            logger.error(f"❌ Ошибка отправки пользователю {tg_id}: {e}")
+            return "failed"
+        except Exception as e:
+            logger.error(f"❌ Ошибка отправки пользователю {tg_id}: {e}")
+            return "failed"
+
+
+def render_broadcast_progress(job: asyncpg.Record, rate: float | None = None) -> str:
+    processed = job["sent"] + job["failed"] + job["blocked"]
+    percent = processed / job["total"] * 100 if job["total"] else 100
+    titles = {
+        "running": "📤 <b>Рассылка идет</b>",
+        "paused": "⏸ <b>Рассылка на паузе</b>",
+        "finished": "📤 <b>Рассылка завершена!</b>",
+        "cancelled": "⏹ <b>Рассылка отменена</b>",
+    }
+
+    text = (
+        f"{titles[job['status']]} #{job['id']}\n\n"
+        f"👥 <b>Количество получателей:</b> {job['total']}\n"
+        f"📊 <b>Обработано:</b> {processed} ({percent:.1f}%)\n"
+        f"✅ <b>Доставлено:</b> {job['sent']}\n"
+        f"🚫 <b>Заблокировали бота:</b> {job['blocked']}\n"
+        f"❌ <b>Не доставлено:</b> {job['failed']}"
+    )
+    if job["status"] == "running" and rate:
+        eta = max(job["total"] - processed, 0) / rate
+        text += f"\n\n⚡ {rate:.1f} сообщ./с, осталось ~{int(eta // 60)} мин {int(eta % 60)} с"
+    return text
+
+
+async def _report_progress(job: asyncpg.Record, rate: float | None = None) -> None:
+    if not job["status_message_id"]:
+        return
+    try:
+        await bot.edit_message_text(
+            chat_id=job["admin_chat_id"],
+            message_id=job["status_message_id"],
+            text=render_broadcast_progress(job, rate),
+            reply_markup=build_broadcast_kb(job["id"], job["status"]),
+        )
+    except TelegramBadRequest as e:
+        if "message is not modified" not in str(e):
+            logger.warning(f"Не удалось обновить прогресс рассылки #{job['id']}: {e}")
+
+
+async def _run_broadcast(job_id: int) -> None:
+    """
+    Отправляет рассылку пачками по курсору tg_id.
+
+    После каждой пачки курсор и счетчики сохраняются в broadcasts, поэтому после перезапуска
+    отправка продолжается с места остановки (повторно может уйти не больше одной пачки).
+    Задание выполняет только держатель advisory lock, так что реплики не дублируют отправку.
+    Если рассылку возобновили, пока держатель еще не отпустил блокировку после паузы,
+    держатель перезапускает ее сам после освобождения блокировки.
+    """
+    mark_bulk_traffic()
+    stopped = False
+    conn = await asyncpg.connect(DATABASE_URL, connection_class=InstrumentedConnection)
+    try:
+        if not await conn.fetchval("SELECT pg_try_advisory_lock($1)", lease_key(f"broadcast:{job_id}")):
+            return
+
+        job = await conn.fetchrow("SELECT * FROM broadcasts WHERE id = $1", job_id)
+        query = AUDIENCE_QUERIES[job["audience"]]
+        args = _audience_args(job)
+        semaphore = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+        started = time.monotonic()
+        processed = 0
+        last_report = 0.0
+
+        while job["status"] == "running":
+            rows = await conn.fetch(query, job["cursor_tg_id"], BROADCAST_BATCH_SIZE, *args)
+            if not rows:
+                job = await conn.fetchrow(
+                    """
+                    UPDATE broadcasts SET status = 'finished', finished_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+                    WHERE id = $1 AND status = 'running'
+                    RETURNING *
+                    """,
+                    job_id,
+                ) or await conn.fetchrow("SELECT * FROM broadcasts WHERE id = $1", job_id)
+                break
+
+            results = await asyncio.gather(*(_deliver(job, row["tg_id"], semaphore) for row in rows))
+            blocked_ids = [row["tg_id"] for row, result in zip(rows, results, strict=True) if result == "blocked"]
+
+            async with conn.transaction():
+                if blocked_ids:
+                    await conn.execute(
+                        "INSERT INTO blocked_users (tg_id) SELECT unnest($1::bigint[]) ON CONFLICT (tg_id) DO NOTHING",
+                        blocked_ids,
+                    )
+                job = await conn.fetchrow(
+                    """
+                    UPDATE broadcasts
+                    SET cursor_tg_id = $2, sent = sent + $3, failed = failed + $4, blocked = blocked + $5,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE id = $1
+                    RETURNING *
+                    """,
+                    job_id,
+                    rows[-1]["tg_id"],
+                    results.count("sent"),
+                    results.count("failed"),
+                    len(blocked_ids),
+                )
+
+            processed += len(rows)
+            if time.monotonic() - last_report >= BROADCAST_PROGRESS_INTERVAL:
+                last_report = time.monotonic()
+                await _report_progress(job, processed / (last_report - started))
+
+        stopped = True
+        logger.info(f"📤 Рассылка #{job_id} остановлена со статусом {job['status']}")
+        await _report_progress(job)
+    except Exception as e:
+        logger.error(f"Ошибка при выполнении рассылки #{job_id}: {e}")
+    finally:
+        _running.pop(job_id, None)
+        await conn.close()
+
+    if stopped:
+        await _restart_if_resumed(job_id)
+
+
+async def _restart_if_resumed(job_id: int) -> None:
+    conn = None
+    try:
+        conn = await asyncpg.connect(DATABASE_URL, connection_class=InstrumentedConnection)
+        status = await conn.fetchval("SELECT status FROM broadcasts WHERE id = $1", job_id)
+    except Exception as e:
+        logger.error(f"Ошибка при проверке статуса рассылки #{job_id}: {e}")
+        return
+    finally:
+        if conn:
+            await conn.close()
+
+    if status == "running":
+        logger.info(f"📤 Рассылка #{job_id} возобновлена во время остановки, перезапуск")
+        start_broadcast(job_id)
@@ -42,3 +42,25 @@ def build_clusters_kb(clusters: list) -> InlineKeyboardMarkup:
     builder.row(build_admin_back_btn())
 
     return builder.as_markup()
+
+
+class AdminBroadcastCallback(CallbackData, prefix="admin_broadcast"):
+    action: str
+    job_id: int
+
+
+def build_broadcast_kb(job_id: int, status: str) -> InlineKeyboardMarkup:
+    builder = InlineKeyboardBuilder()
+
+    if status == "running":
+        builder.button(text="⏸ Пауза", callback_data=AdminBroadcastCallback(action="pause", job_id=job_id).pack())
+    elif status == "paused":
+        builder.button(text="▶️ Продолжить", callback_data=AdminBroadcastCallback(action="resume", job_id=job_id).pack())
+
+    if status in ("running", "paused"):
+        builder.button(text="⏹ Отменить", callback_data=AdminBroadcastCallback(action="cancel", job_id=job_id).pack())
+
+    builder.adjust(2)
+    builder.row(build_admin_back_btn("sender"))
+
+    return builder.as_markup()
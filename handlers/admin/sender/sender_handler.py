@@ -1,4 +1,3 @@
-from datetime import datetime
 from typing import Any
 
 from aiogram import F, Router
@@ -7,10 +6,16 @@ from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import CallbackQuery, Message
 
 from filters.admin import IsAdminFilter
-from logger import logger
 
 from ..panel.keyboard import AdminPanelCallback, build_admin_back_kb
-from .keyboard import AdminSenderCallback, build_clusters_kb, build_sender_kb
+from .broadcast import create_broadcast, render_broadcast_progress, set_broadcast_status, start_broadcast
+from .keyboard import (
+    AdminBroadcastCallback,
+    AdminSenderCallback,
+    build_broadcast_kb,
+    build_clusters_kb,
+    build_sender_kb,
+)
 
 
 router = Router()
@@ -61,87 +66,45 @@ async def handle_sender_callback(callback_query: CallbackQuery, session: Any):
 @router.message(AdminSender.waiting_for_message, IsAdminFilter())
 async def handle_message_input(message: Message, state: FSMContext, session: Any):
     """
-    Обрабатывает ввод сообщения для рассылки (поддержка текста + фото).
-    """
-    text_message = message.html_text if message.text else None
-    photo = message.photo[-1].file_id if message.photo else None
-    photo_url = message.caption if message.photo and message.caption and message.caption.startswith("http") else None
+    Создает задание рассылки из присланного сообщения и запускает отправку.
 
-    if not text_message and message.caption:
-        text_message = message.caption
-
-    if not text_message and not photo and not photo_url:
+    Сообщение копируется получателям как есть: текст, фото, видео, документы с форматированием.
+    Фото с подписью-ссылкой тоже уходит как есть: прежняя ветка photo_url срабатывала только для
+    сообщений с фото и отправляла то же фото с той же подписью, что теперь делает copy_message.
+    """
+    if not (message.text or message.caption or message.photo or message.video or message.document):
         await message.answer("⚠ Ошибка! Отправьте текст или изображение для рассылки.")
         return
 
     state_data = await state.get_data()
-    send_to = state_data.get("type", "all")
-
-    if send_to == "subscribed":
-        tg_ids = await session.fetch(
-            """
-            SELECT DISTINCT c.tg_id 
-            FROM connections c
-            JOIN keys k ON c.tg_id = k.tg_id
-            WHERE k.expiry_time > $1
-            """,
-            int(datetime.utcnow().timestamp() * 1000),
-        )
-    elif send_to == "unsubscribed":
-        tg_ids = await session.fetch(
-            """
-            SELECT c.tg_id 
-            FROM connections c
-            LEFT JOIN keys k ON c.tg_id = k.tg_id
-            GROUP BY c.tg_id
-            HAVING COUNT(k.tg_id) = 0 OR MAX(k.expiry_time) <= $1
-            """,
-            int(datetime.utcnow().timestamp() * 1000),
-        )
-    elif send_to == "untrial":
-        tg_ids = await session.fetch("SELECT DISTINCT tg_id FROM connections WHERE trial = 0")
-    elif send_to == "cluster":
-        cluster_name = state_data.get("cluster_name")
-        tg_ids = await session.fetch(
-            """
-            SELECT DISTINCT c.tg_id
-            FROM connections c
-            JOIN keys k ON c.tg_id = k.tg_id
-            JOIN servers s ON k.server_id = s.cluster_name
-            WHERE s.cluster_name = $1
-            """,
-            cluster_name,
-        )
-    else:
-        tg_ids = await session.fetch("SELECT DISTINCT tg_id FROM connections")
-
-    total_users = len(tg_ids)
-    success_count = 0
-
-    text = f"📤 <b>Рассылка начата!</b>\n👥 Количество получателей: {total_users}"
-
-    await message.answer(text=text)
-
-    for record in tg_ids:
-        tg_id = record["tg_id"]
-        try:
-            if photo or photo_url:
-                await message.bot.send_photo(
-                    chat_id=tg_id, photo=photo if photo else photo_url, caption=text_message, parse_mode="HTML"
-                )
-            else:
-                await message.bot.send_message(chat_id=tg_id, text=text_message, parse_mode="HTML")
-
-            success_count += 1
-        except Exception as e:
-            logger.error(f"❌ Ошибка отправки пользователю {tg_id}: {e}")
-
-    text = (
-        f"📤 <b>Рассылка завершена!</b>\n\n"
-        f"👥 <b>Количество получателей:</b> {total_users}\n"
-        f"✅ <b>Доставлено:</b> {success_count}\n"
-        f"❌ <b>Не доставлено:</b> {total_users - success_count}"
+    job = await create_broadcast(
+        session,
+        admin_chat_id=message.chat.id,
+        from_chat_id=message.chat.id,
+        message_id=message.message_id,
+        audience=state_data.get("type", "all"),
+        cluster_name=state_data.get("cluster_name"),
     )
-
-    await message.answer(text=text, reply_markup=build_admin_back_kb("sender"))
     await state.clear()
+
+    status_message = await message.answer(
+        text=render_broadcast_progress(job), reply_markup=build_broadcast_kb(job["id"], job["status"])
+    )
+    await session.execute(
+        "UPDATE broadcasts SET status_message_id = $2 WHERE id = $1", job["id"], status_message.message_id
+    )
+    start_broadcast(job["id"])
+
+
+@router.callback_query(AdminBroadcastCallback.filter(), IsAdminFilter())
+async def handle_broadcast_control(callback_query: CallbackQuery, callback_data: AdminBroadcastCallback, session: Any):
+    statuses = {"pause": "paused", "resume": "running", "cancel": "cancelled"}
+    job = await set_broadcast_status(session, callback_data.job_id, statuses[callback_data.action])
+
+    if not job:
+        await callback_query.answer("Рассылка уже завершена", show_alert=True)
+        return
+
+    await callback_query.message.edit_text(
+        text=render_broadcast_progress(job), reply_markup=build_broadcast_kb(job["id"], job["status"])
+    )
@@ -21,6 +21,31 @@ def build_stats_kb() -> InlineKeyboardMarkup:
     builder.button(
         text="📥 Выгрузить горящих лидов", callback_data=AdminPanelCallback(action="stats_export_hot_leads_csv").pack()
     )
+    builder.button(
+        text="📥 Выгрузить сводку по дням", callback_data=AdminPanelCallback(action="stats_export_daily_csv").pack()
+    )
+    builder.button(text="🐢 Топ запросов к БД", callback_data=AdminPanelCallback(action="stats_db_top").pack())
+    builder.button(text="⏱ Производительность", callback_data=AdminPanelCallback(action="stats_performance").pack())
     builder.row(build_admin_back_btn())
     builder.adjust(1)
     return builder.as_markup()
+
+
+def build_db_top_kb() -> InlineKeyboardMarkup:
+    builder = InlineKeyboardBuilder()
+    builder.button(text="🔄 Обновить", callback_data=AdminPanelCallback(action="stats_db_top").pack())
+    builder.button(text="🧹 Сбросить статистику", callback_data=AdminPanelCallback(action="stats_db_top_reset").pack())
+    builder.row(build_admin_back_btn("stats"))
+    builder.adjust(1)
+    return builder.as_markup()
+
+
+def build_performance_kb() -> InlineKeyboardMarkup:
+    builder = InlineKeyboardBuilder()
+    builder.button(text="🔄 Обновить", callback_data=AdminPanelCallback(action="stats_performance").pack())
+    builder.button(
+        text="🧹 Сбросить статистику", callback_data=AdminPanelCallback(action="stats_performance_reset").pack()
+    )
+    builder.row(build_admin_back_btn("stats"))
+    builder.adjust(1)
+    return builder.as_markup()
@@ -1,138 +1,218 @@
+import asyncio
+import html
+import time
+
+from collections.abc import Awaitable, Callable
+from contextlib import suppress
 from datetime import datetime
 from typing import Any
 
+import asyncpg
 import pytz
 
 from aiogram import F, Router
 from aiogram.exceptions import TelegramBadRequest
 from aiogram.types import CallbackQuery
 
+from config import DATABASE_URL
 from filters.admin import IsAdminFilter
 from logger import logger
-from utils.csv_export import export_hot_leads_csv, export_keys_csv, export_payments_csv, export_users_csv
+from utils.csv_export import (
+    CsvExport,
+    ExportProgress,
+    export_daily_stats_csv,
+    export_hot_leads_csv,
+    export_keys_csv,
+    export_payments_csv,
+    export_users_csv,
+)
+from utils.db_metrics import InstrumentedConnection, query_metrics
+from utils.handler_metrics import handler_metrics
 
 from ..panel.keyboard import AdminPanelCallback, build_admin_back_kb
-from .keyboard import build_stats_kb
+from .keyboard import build_db_top_kb, build_performance_kb, build_stats_kb
 
 
 router = Router()
 
 
+STATS_REFRESH_INTERVAL = 60
+STATS_IDLE_TIMEOUT = 600
+MESSAGE_LIMIT = 4096
+
+DASHBOARD_STATS_QUERY = """
+    WITH
+    rollup_watermark AS (
+        SELECT COALESCE(
+            (SELECT date_trunc('hour', processed_until) FROM stats_rollup_watermarks WHERE name = 'hourly'),
+            '-infinity'::timestamptz
+        ) AS since
+    ),
+    registrations AS (
+        SELECT bucket AS created_at, registrations AS cnt
+        FROM registrations_rollup_hourly, rollup_watermark
+        WHERE bucket < rollup_watermark.since
+        UNION ALL
+        SELECT created_at, 1
+        FROM users, rollup_watermark
+        WHERE created_at >= rollup_watermark.since
+    ),
+    revenue AS (
+        SELECT bucket AS created_at, amount_sum AS amount
+        FROM payments_rollup_hourly, rollup_watermark
+        WHERE bucket < rollup_watermark.since
+        UNION ALL
+        SELECT created_at, amount
+        FROM payments
+        WHERE created_at >= (SELECT since FROM rollup_watermark)
+    ),
+    user_stats AS (
+        SELECT
+            (SELECT COUNT(*) FROM users) AS total_users,
+            COALESCE(SUM(cnt) FILTER (WHERE created_at >= CURRENT_DATE), 0) AS registrations_today,
+            COALESCE(SUM(cnt) FILTER (WHERE created_at >= date_trunc('week', CURRENT_DATE)), 0) AS registrations_week,
+            COALESCE(SUM(cnt) FILTER (WHERE created_at >= date_trunc('month', CURRENT_DATE)), 0) AS registrations_month,
+            (SELECT COUNT(*) FROM users WHERE updated_at >= CURRENT_DATE) AS users_updated_today
+        FROM registrations
+    ),
+    key_stats AS (
+        SELECT
+            COUNT(*) AS total_keys,
+            COUNT(*) FILTER (WHERE expiry_time > $1) AS active_keys,
+            COUNT(*) FILTER (WHERE duration_days <= 29) AS subs_trial,
+            COUNT(*) FILTER (WHERE duration_days > 29 AND duration_days <= 89) AS subs_1,
+            COUNT(*) FILTER (WHERE duration_days > 89 AND duration_days <= 179) AS subs_3,
+            COUNT(*) FILTER (WHERE duration_days > 179 AND duration_days <= 359) AS subs_6,
+            COUNT(*) FILTER (WHERE duration_days > 359) AS subs_12
+        FROM (SELECT expiry_time, (expiry_time - created_at) / 86400000.0 AS duration_days FROM keys) k
+    ),
+    payment_stats AS (
+        SELECT
+            COALESCE(SUM(amount) FILTER (WHERE created_at >= CURRENT_DATE), 0) AS payments_today,
+            COALESCE(SUM(amount) FILTER (WHERE created_at >= date_trunc('week', CURRENT_DATE)), 0) AS payments_week,
+            COALESCE(SUM(amount) FILTER (WHERE created_at >= date_trunc('month', CURRENT_DATE)), 0) AS payments_month,
+            COALESCE(SUM(amount) FILTER (
+                WHERE created_at >= date_trunc('month', CURRENT_DATE - interval '1 month')
+                AND created_at < date_trunc('month', CURRENT_DATE)
+            ), 0) AS payments_last_month,
+            COALESCE(SUM(amount), 0) AS payments_all_time
+        FROM revenue
+    )
+    SELECT
+        user_stats.*,
+        key_stats.*,
+        payment_stats.*,
+        (SELECT COUNT(*) FROM referrals) AS total_referrals,
+        (
+            SELECT COUNT(DISTINCT p.tg_id)
+            FROM payments p
+            WHERE p.status = 'success'
+            AND NOT EXISTS (SELECT 1 FROM keys k WHERE k.tg_id = p.tg_id)
+        ) AS hot_leads_count
+    FROM user_stats, key_stats, payment_stats
+"""
+
+
+class StatsSnapshot:
+    """
+    Снимок статистики для админского дашборда.
+
+    Вся статистика считается одним агрегирующим запросом: регистрации и выручка берутся
+    из почасовых агрегатов (utils/stats_rollups.py) и досчитываются по сырым строкам только
+    с последнего прохода агрегатора. Пока админы открывают дашборд,
+    фоновая задача обновляет снимок раз в STATS_REFRESH_INTERVAL секунд, поэтому повторные
+    нажатия не нагружают базу. Если дашборд не открывали STATS_IDLE_TIMEOUT секунд,
+    обновление останавливается до следующего запроса. Снимок старше STATS_REFRESH_INTERVAL
+    (первый запрос после простоя или отставшая фоновая задача) пересчитывается сразу.
+    """
+
+    def __init__(self) -> None:
+        self.data: dict | None = None
+        self.updated_at: datetime | None = None
+        self._refreshed_at = 0.0
+        self._last_requested = 0.0
+        self._task: asyncio.Task | None = None
+        self._lock = asyncio.Lock()
+
+    def is_stale(self) -> bool:
+        return self.data is None or time.monotonic() - self._refreshed_at > STATS_REFRESH_INTERVAL
+
+    async def get(self, session: Any) -> dict:
+        self._last_requested = time.monotonic()
+        if self.is_stale():
+            async with self._lock:
+                if self.is_stale():
+                    await self._refresh(session)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._refresh_loop())
+        return self.data
+
+    async def _refresh(self, session: Any) -> None:
+        now = datetime.now(pytz.utc)
+        record = await session.fetchrow(DASHBOARD_STATS_QUERY, int(now.timestamp() * 1000))
+        self.data = dict(record)
+        self.updated_at = now.astimezone(pytz.timezone("Europe/Moscow"))
+        self._refreshed_at = time.monotonic()
+
+    async def _refresh_loop(self) -> None:
+        while time.monotonic() - self._last_requested < STATS_IDLE_TIMEOUT:
+            await asyncio.sleep(max(0.0, STATS_REFRESH_INTERVAL - (time.monotonic() - self._refreshed_at)))
+            if time.monotonic() - self._refreshed_at < STATS_REFRESH_INTERVAL:
+                continue
+            conn = None
+            try:
+                conn = await asyncpg.connect(DATABASE_URL, connection_class=InstrumentedConnection)
+                async with self._lock:
+                    await self._refresh(conn)
+            except Exception as e:
+                logger.error(f"Ошибка при фоновом обновлении статистики: {e}")
+                await asyncio.sleep(STATS_REFRESH_INTERVAL)
+            finally:
+                if conn:
+                    await conn.close()
+
+
+stats_snapshot = StatsSnapshot()
+
+
 @router.callback_query(
     AdminPanelCallback.filter(F.action == "stats"),
     IsAdminFilter(),
 )
 async def handle_stats(callback_query: CallbackQuery, session: Any):
     try:
-        total_users = await session.fetchval("SELECT COUNT(*) FROM users")
-        total_keys = await session.fetchval("SELECT COUNT(*) FROM keys")
-        total_referrals = await session.fetchval("SELECT COUNT(*) FROM referrals")
-
-        total_payments_today = int(
-            await session.fetchval("SELECT COALESCE(SUM(amount), 0) FROM payments WHERE created_at >= CURRENT_DATE")
-        )
-        total_payments_week = int(
-            await session.fetchval(
-                "SELECT COALESCE(SUM(amount), 0) FROM payments WHERE created_at >= date_trunc('week', CURRENT_DATE)"
-            )
-        )
-        total_payments_month = int(
-            await session.fetchval(
-                "SELECT COALESCE(SUM(amount), 0) FROM payments WHERE created_at >= date_trunc('month', CURRENT_DATE)"
-            )
-        )
-        total_payments_last_month = int(
-            await session.fetchval(
-                """
-                SELECT COALESCE(SUM(amount), 0)
-                FROM payments
-                WHERE created_at >= date_trunc('month', CURRENT_DATE - interval '1 month')
-                AND created_at < date_trunc('month', CURRENT_DATE)
-                """
-            )
-        )
-        total_payments_all_time = int(await session.fetchval("SELECT COALESCE(SUM(amount), 0) FROM payments"))
-
-        all_keys = await session.fetch("SELECT created_at, expiry_time FROM keys")
-
-        def count_subscriptions_by_duration(keys):
-            periods = {"trial": 0, "1": 0, "3": 0, "6": 0, "12": 0}
-            for key in keys:
-                try:
-                    duration_days = (key["expiry_time"] - key["created_at"]) / (1000 * 60 * 60 * 24)
-
-                    if duration_days <= 29:
-                        periods["trial"] += 1
-                    elif duration_days <= 89:
-                        periods["1"] += 1
-                    elif duration_days <= 179:
-                        periods["3"] += 1
-                    elif duration_days <= 359:
-                        periods["6"] += 1
-                    else:
-                        periods["12"] += 1
-                except Exception as e:
-                    logger.error(f"Error processing key duration: {e}")
-                    continue
-            return periods
-
-        subs_all_time = count_subscriptions_by_duration(all_keys)
-
-        registrations_today = await session.fetchval("SELECT COUNT(*) FROM users WHERE created_at >= CURRENT_DATE")
-        registrations_week = await session.fetchval(
-            "SELECT COUNT(*) FROM users WHERE created_at >= date_trunc('week', CURRENT_DATE)"
-        )
-        registrations_month = await session.fetchval(
-            "SELECT COUNT(*) FROM users WHERE created_at >= date_trunc('month', CURRENT_DATE)"
-        )
-
-        users_updated_today = await session.fetchval("SELECT COUNT(*) FROM users WHERE updated_at >= CURRENT_DATE")
-
-        active_keys = await session.fetchval(
-            "SELECT COUNT(*) FROM keys WHERE expiry_time > $1",
-            int(datetime.utcnow().timestamp() * 1000),
-        )
-        expired_keys = total_keys - active_keys
-        moscow_tz = pytz.timezone("Europe/Moscow")
-        update_time = datetime.now(moscow_tz).strftime("%d.%m.%y %H:%M:%S")
-
-        hot_leads_count = await session.fetchval("""
-            SELECT COUNT(DISTINCT u.tg_id)
-            FROM users u
-            JOIN payments p ON u.tg_id = p.tg_id
-            LEFT JOIN keys k ON u.tg_id = k.tg_id
-            WHERE p.status = 'success'
-            AND k.tg_id IS NULL
-        """)
+        stats = await stats_snapshot.get(session)
+        expired_keys = stats["total_keys"] - stats["active_keys"]
+        update_time = stats_snapshot.updated_at.strftime("%d.%m.%y %H:%M:%S")
 
         stats_message = (
             "📊 <b>Статистика проекта</b>\n\n"
             "👤 <b>Пользователи:</b>\n"
-            f"├ 🗓️ За день: <b>{registrations_today}</b>\n"
-            f"├ 📆 За неделю: <b>{registrations_week}</b>\n"
-            f"├ 🗓️ За месяц: <b>{registrations_month}</b>\n"
-            f"└ 🌐 Всего: <b>{total_users}</b>\n\n"
+            f"├ 🗓️ За день: <b>{stats['registrations_today']}</b>\n"
+            f"├ 📆 За неделю: <b>{stats['registrations_week']}</b>\n"
+            f"├ 🗓️ За месяц: <b>{stats['registrations_month']}</b>\n"
+            f"└ 🌐 Всего: <b>{stats['total_users']}</b>\n\n"
             "💡 <b>Активность:</b>\n"
-            f"└ 👥 Сегодня были активны: <b>{users_updated_today}</b>\n\n"
+            f"└ 👥 Сегодня были активны: <b>{stats['users_updated_today']}</b>\n\n"
             "🤝 <b>Реферальная система:</b>\n"
-            f"└ 👥 Всего привлечено: <b>{total_referrals}</b>\n\n"
+            f"└ 👥 Всего привлечено: <b>{stats['total_referrals']}</b>\n\n"
             "🔐 <b>Подписки:</b>\n"
-            f"├ 📦 Всего сгенерировано: <b>{total_keys}</b>\n"
-            f"├ ✅ Активных: <b>{active_keys}</b>\n"
+            f"├ 📦 Всего сгенерировано: <b>{stats['total_keys']}</b>\n"
+            f"├ ✅ Активных: <b>{stats['active_keys']}</b>\n"
             f"├ ❌ Просроченных: <b>{expired_keys}</b>\n"
             f"└ 📋 По срокам:\n"
-            f"     • 🎁 Триал: <b>{subs_all_time['trial']}</b>\n"
-            f"     • 🗓️ 1 мес: <b>{subs_all_time['1']}</b>\n"
-            f"     • 🗓️ 3 мес: <b>{subs_all_time['3']}</b>\n"
-            f"     • 🗓️ 6 мес: <b>{subs_all_time['6']}</b>\n"
-            f"     • 🗓️ 12 мес: <b>{subs_all_time['12']}</b>\n\n"
+            f"     • 🎁 Триал: <b>{stats['subs_trial']}</b>\n"
+            f"     • 🗓️ 1 мес: <b>{stats['subs_1']}</b>\n"
+            f"     • 🗓️ 3 мес: <b>{stats['subs_3']}</b>\n"
+            f"     • 🗓️ 6 мес: <b>{stats['subs_6']}</b>\n"
+            f"     • 🗓️ 12 мес: <b>{stats['subs_12']}</b>\n\n"
             "💰 <b>Финансы:</b>\n"
-            f"├ 📅 За день: <b>{total_payments_today} ₽</b>\n"
-            f"├ 📆 За неделю: <b>{total_payments_week} ₽</b>\n"
-            f"├ 📆 За месяц: <b>{total_payments_month} ₽</b>\n"
-            f"├ 📆 За прошлый месяц: <b>{total_payments_last_month} ₽</b>\n"
-            f"└ 🏦 Всего: <b>{total_payments_all_time} ₽</b>\n\n"
-            f"🔥 <b>Горящие лиды</b>: <b>{hot_leads_count}</b> (платили, но не продлили)\n\n"
+            f"├ 📅 За день: <b>{int(stats['payments_today'])} ₽</b>\n"
+            f"├ 📆 За неделю: <b>{int(stats['payments_week'])} ₽</b>\n"
+            f"├ 📆 За месяц: <b>{int(stats['payments_month'])} ₽</b>\n"
+            f"├ 📆 За прошлый месяц: <b>{int(stats['payments_last_month'])} ₽</b>\n"
+            f"└ 🏦 Всего: <b>{int(stats['payments_all_time'])} ₽</b>\n\n"
+            f"🔥 <b>Горящие лиды</b>: <b>{stats['hot_leads_count']}</b> (платили, но не продлили)\n\n"
             f"⏱️ <i>Последнее обновление:</i> <code>{update_time}</code>"
         )
 
@@ -145,6 +225,32 @@ async def handle_stats(callback_query: CallbackQuery, session: Any):
         await callback_query.answer("Произошла ошибка при получении статистики", show_alert=True)
 
 
+async def send_csv_export(
+    callback_query: CallbackQuery,
+    session: Any,
+    exporter: Callable[[Any, ExportProgress], Awaitable[CsvExport]],
+    caption: str,
+) -> None:
+    """Формирует выгрузку с сообщением о прогрессе, отправляет архив и удаляет временный файл."""
+    status = await callback_query.message.answer("⏳ Подготовка выгрузки...")
+
+    async def report_progress(rows: int, estimated_rows: int) -> None:
+        with suppress(TelegramBadRequest):
+            await status.edit_text(f"⏳ Выгружено строк: {rows} из ~{estimated_rows}...")
+
+    try:
+        export = await exporter(session, report_progress)
+        try:
+            if export.truncated:
+                caption += f"\n⚠️ Выгружены первые {export.rows} строк: достигнут лимит выгрузки"
+            await callback_query.message.answer_document(document=export.as_input_file(), caption=caption)
+        finally:
+            export.cleanup()
+    finally:
+        with suppress(TelegramBadRequest):
+            await status.delete()
+
+
 @router.callback_query(
     AdminPanelCallback.filter(F.action == "stats_export_users_csv"),
     IsAdminFilter(),
@@ -152,8 +258,7 @@ async def handle_stats(callback_query: CallbackQuery, session: Any):
 async def handle_export_users_csv(callback_query: CallbackQuery, session: Any):
     kb = build_admin_back_kb("stats")
     try:
-        export = await export_users_csv(session)
-        await callback_query.message.answer_document(document=export, caption="📥 Экспорт пользователей в CSV")
+        await send_csv_export(callback_query, session, export_users_csv, "📥 Экспорт пользователей в CSV")
     except Exception as e:
         logger.error(f"Ошибка при экспорте пользователей в CSV: {e}")
         await callback_query.message.edit_text(text=f"❗ Произошла ошибка при экспорте: {e}", reply_markup=kb)
@@ -166,8 +271,7 @@ async def handle_export_users_csv(callback_query: CallbackQuery, session: Any):
 async def handle_export_payments_csv(callback_query: CallbackQuery, session: Any):
     kb = build_admin_back_kb("stats")
     try:
-        export = await export_payments_csv(session)
-        await callback_query.message.answer_document(document=export, caption="📥 Экспорт платежей в CSV")
+        await send_csv_export(callback_query, session, export_payments_csv, "📥 Экспорт платежей в CSV")
     except Exception as e:
         logger.error(f"Ошибка при экспорте платежей в CSV: {e}")
         await callback_query.message.edit_text(text=f"❗ Произошла ошибка при экспорте: {e}", reply_markup=kb)
@@ -180,8 +284,7 @@ async def handle_export_payments_csv(callback_query: CallbackQuery, session: Any
 async def handle_export_hot_leads_csv(callback_query: CallbackQuery, session: Any):
     kb = build_admin_back_kb("stats")
     try:
-        export = await export_hot_leads_csv(session)
-        await callback_query.message.answer_document(document=export, caption="📥 Экспорт горящих лидов")
+        await send_csv_export(callback_query, session, export_hot_leads_csv, "📥 Экспорт горящих лидов")
     except Exception as e:
         logger.error(f"Ошибка при экспорте 'горящих лидов': {e}")
         await callback_query.message.edit_text(text=f"❗ Произошла ошибка при экспорте: {e}", reply_markup=kb)
@@ -194,8 +297,130 @@ async def handle_export_hot_leads_csv(callback_query: CallbackQuery, session: An
 async def handle_export_keys_csv(callback_query: CallbackQuery, session: Any):
     kb = build_admin_back_kb("stats")
     try:
-        export = await export_keys_csv(session)
-        await callback_query.message.answer_document(document=export, caption="📥 Экспорт подписок в CSV")
+        await send_csv_export(callback_query, session, export_keys_csv, "📥 Экспорт подписок в CSV")
     except Exception as e:
         logger.error(f"Ошибка при экспорте подписок в CSV: {e}")
         await callback_query.message.edit_text(text=f"❗ Произошла ошибка при экспорте: {e}", reply_markup=kb)
+
+
+@router.callback_query(
+    AdminPanelCallback.filter(F.action == "stats_export_daily_csv"),
+    IsAdminFilter(),
+)
+async def handle_export_daily_csv(callback_query: CallbackQuery, session: Any):
+    kb = build_admin_back_kb("stats")
+    try:
+        export = await export_daily_stats_csv(session)
+        await callback_query.message.answer_document(document=export, caption="📥 Сводка по дням")
+    except Exception as e:
+        logger.error(f"Ошибка при экспорте сводки по дням в CSV: {e}")
+        await callback_query.message.edit_text(text=f"❗ Произошла ошибка при экспорте: {e}", reply_markup=kb)
+
+
+@router.callback_query(
+    AdminPanelCallback.filter(F.action == "stats_db_top_reset"),
+    IsAdminFilter(),
+)
+async def handle_db_top_reset(callback_query: CallbackQuery):
+    query_metrics.reset()
+    await callback_query.answer("Статистика запросов сброшена")
+    await handle_db_top(callback_query)
+
+
+def join_within_limit(lines: list[str], limit: int = MESSAGE_LIMIT) -> str:
+    """
+    Склеивает строки отчета, отбрасывая целые строки с конца, пока текст не уложится в лимит.
+
+    Каждая строка — законченный HTML-фрагмент, поэтому разметка не обрезается посередине тега.
+    """
+    while len(lines) > 1 and len("\n".join(lines)) > limit:
+        lines = lines[:-1]
+    return "\n".join(lines)
+
+
+@router.callback_query(
+    AdminPanelCallback.filter(F.action == "stats_db_top"),
+    IsAdminFilter(),
+)
+async def handle_db_top(callback_query: CallbackQuery):
+    top = query_metrics.top(limit=10)
+    if not top:
+        text = "🐢 <b>Топ запросов к БД</b>\n\nСтатистика пока пуста."
+    else:
+        lines = ["🐢 <b>Топ запросов к БД</b> (по суммарному времени)\n"]
+        for position, (statement, stats) in enumerate(top, start=1):
+            caller, _ = stats.callers.most_common(1)[0]
+            lines.append(
+                f"<b>{position}.</b> <code>{html.escape(statement[:120])}</code>\n"
+                f"├ Вызовов: <b>{stats.calls}</b>, ошибок: <b>{stats.errors}</b>\n"
+                f"├ Всего: <b>{stats.total_time:.2f} с</b>, среднее: <b>{stats.avg_time * 1000:.1f} мс</b>, "
+                f"макс: <b>{stats.max_time * 1000:.1f} мс</b>\n"
+                f"├ Строк: <b>{stats.rows}</b>\n"
+                f"└ Откуда: <code>{html.escape(caller)}</code>\n"
+            )
+        text = join_within_limit(lines)
+
+    try:
+        await callback_query.message.edit_text(text=text, reply_markup=build_db_top_kb())
+    except TelegramBadRequest as e:
+        if "message is not modified" not in str(e):
+            logger.error(f"Ошибка при отображении топа запросов к БД: {e}")
+
+
+@router.callback_query(
+    AdminPanelCallback.filter(F.action == "stats_performance"),
+    IsAdminFilter(),
+)
+async def handle_performance(callback_query: CallbackQuery):
+    handlers_top = handler_metrics.top(limit=8, kind="handler")
+    callbacks_top = handler_metrics.top(limit=5, kind="callback")
+    background_top = handler_metrics.top(limit=5, kind="background")
+
+    if not handlers_top:
+        text = "⏱ <b>Производительность обработчиков</b>\n\nСтатистика пока пуста."
+    else:
+        lines = ["⏱ <b>Производительность обработчиков</b> (по суммарному времени)\n"]
+        for position, (name, stats) in enumerate(handlers_top, start=1):
+            db_share = stats.db_time / stats.total_time * 100 if stats.total_time else 0
+            panel_share = stats.panel_time / stats.total_time * 100 if stats.total_time else 0
+            lines.append(
+                f"<b>{position}.</b> <code>{html.escape(name.removeprefix('handler:').removeprefix('handlers.'))}</code>\n"
+                f"├ Вызовов: <b>{stats.calls}</b>, ошибок: <b>{stats.errors}</b>, сейчас: <b>{stats.in_flight}</b>\n"
+                f"├ Среднее: <b>{stats.avg_time * 1000:.0f} мс</b>, p95: <b>≤{stats.quantile(0.95) * 1000:.0f} мс</b>, "
+                f"макс: <b>{stats.max_time * 1000:.0f} мс</b>\n"
+                f"└ БД: <b>{db_share:.0f}%</b>, панели: <b>{panel_share:.0f}%</b>\n"
+            )
+
+        if callbacks_top:
+            lines.append("🔘 <b>Кнопки (префикс callback_data)</b>")
+            for name, stats in callbacks_top:
+                lines.append(
+                    f"• <code>{html.escape(name.removeprefix('callback:'))}</code>: {stats.calls} выз., "
+                    f"среднее {stats.avg_time * 1000:.0f} мс, p95 ≤{stats.quantile(0.95) * 1000:.0f} мс"
+                )
+
+        if background_top:
+            lines.append("\n⚙️ <b>Фоновые операции</b>")
+            for name, stats in background_top:
+                lines.append(
+                    f"• <code>{html.escape(name.removeprefix('background:'))}</code>: {stats.calls} выз., "
+                    f"ошибок {stats.errors}, среднее {stats.avg_time * 1000:.0f} мс, "
+                    f"p95 ≤{stats.quantile(0.95) * 1000:.0f} мс"
+                )
+        text = join_within_limit(lines)
+
+    try:
+        await callback_query.message.edit_text(text=text, reply_markup=build_performance_kb())
+    except TelegramBadRequest as e:
+        if "message is not modified" not in str(e):
+            logger.error(f"Ошибка при отображении производительности обработчиков: {e}")
+
+
+@router.callback_query(
+    AdminPanelCallback.filter(F.action == "stats_performance_reset"),
+    IsAdminFilter(),
+)
+async def handle_performance_reset(callback_query: CallbackQuery):
+    handler_metrics.reset()
+    await callback_query.answer("Статистика обработчиков сброшена")
+    await handle_performance(callback_query)
@@ -34,9 +34,10 @@ from handlers.keys.key_utils import (
     reset_traffic_in_cluster,
     update_subscription,
 )
-from handlers.utils import generate_random_email, sanitize_key_name
+from handlers.utils import sanitize_key_name
 from logger import logger
 from utils.csv_export import export_referrals_csv
+from utils.key_names import key_name_allocator
 
 from ..panel.keyboard import AdminPanelCallback, build_admin_back_btn, build_admin_back_kb
 from .keyboard import (
@@ -869,7 +870,7 @@ async def handle_create_key_duration(callback_query: CallbackQuery, session: Any
         months = int(parts[3])
 
         client_id = str(uuid.uuid4())
-        email = generate_random_email()
+        email = await key_name_allocator.allocate(session)
         expiry = datetime.now(tz=timezone.utc) + timedelta(days=30 * months)
         expiry_ms = int(expiry.timestamp() * 1000)
 
@@ -6,13 +6,7 @@ from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import CallbackQuery, InlineKeyboardButton, Message
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
-from database import (
-    check_coupon_usage,
-    create_coupon_usage,
-    get_coupon_by_code,
-    update_balance,
-    update_coupon_usage_count,
-)
+from database import activate_coupon_atomically
 from handlers.buttons import MAIN_MENU
 from handlers.texts import (
     COUPON_ACTIVATED_SUCCESS_MSG,
@@ -66,20 +60,12 @@ async def process_coupon_code(message: Message, state: FSMContext, session: Any)
 
 
 async def activate_coupon(user_id: int, coupon_code: str, session: Any):
-    coupon_record = await get_coupon_by_code(coupon_code, session)
-
-    if not coupon_record:
-        return COUPON_NOT_FOUND_MSG
-
-    usage_exists = await check_coupon_usage(coupon_record["id"], user_id, session)
+    result = await activate_coupon_atomically(coupon_code, user_id, session)
 
-    if usage_exists:
+    if result["status"] == "activated":
+        return COUPON_ACTIVATED_SUCCESS_MSG.format(coupon_amount=result["amount"])
+    if result["status"] == "already_used":
         return COUPON_ALREADY_USED_MSG
-
-    coupon_amount = coupon_record["amount"]
-
-    await update_coupon_usage_count(coupon_record["id"], session)
-    await create_coupon_usage(coupon_record["id"], user_id, session)
-
-    await update_balance(user_id, coupon_amount, session)
-    return COUPON_ACTIVATED_SUCCESS_MSG.format(coupon_amount=coupon_amount)
+    if result["status"] == "not_balance":
+        return "❌ Этот купон продлевает подписку. Активируйте его по ссылке, которую вы получили."
+    return COUPON_NOT_FOUND_MSG
@@ -47,7 +47,8 @@ from handlers.buttons import (
     SUPPORT,
     TV_BUTTON,
 )
-from handlers.keys.key_utils import create_client_on_server, create_key_on_cluster
+from handlers.keys.key_utils import create_client_on_server, provision_key_in_background
+from handlers.keys.trial_pool import activate_trial_client, claim_trial_client
 from handlers.payments.robokassa_pay import handle_custom_amount_input
 from handlers.payments.yookassa_pay import process_custom_amount_input
 from handlers.texts import (
@@ -58,9 +59,10 @@ from handlers.texts import (
     SELECT_TARIFF_PLAN_MSG,
     key_message_success,
 )
-from handlers.utils import edit_or_send_message, generate_random_email, get_least_loaded_cluster
+from handlers.utils import edit_or_send_message, get_least_loaded_cluster
 from logger import logger
 from panels.three_xui import delete_client
+from utils.key_names import key_name_allocator
 
 
 router = Router()
@@ -106,7 +108,7 @@ async def handle_key_creation(
                     reply_markup=None,
                 )
 
-                await create_key(tg_id, expiry_time, state, session, message_or_query)
+                await create_key(tg_id, expiry_time, state, session, message_or_query, trial=True)
                 return
             else:
                 logger.error(f"Не удалось обновить статус триального периода для пользователя {tg_id}.")
@@ -203,8 +205,9 @@ async def create_key(
     message_or_query: Message | CallbackQuery | None = None,
     old_key_name: str = None,
     plan: int = None,
+    trial: bool = False,
 ):
-    """Создаёт ключ с заданным сроком действия."""
+    """Создаёт ключ с заданным сроком действия. Пробный ключ по возможности берётся из пула."""
 
     target_message = message_or_query.message if isinstance(message_or_query, CallbackQuery) else message_or_query
     if not await check_connection_exists(tg_id):
@@ -249,39 +252,43 @@ async def create_key(
             )
         return
 
-    while True:
-        key_name = generate_random_email()
-        logger.info(f"[Key Generation] Сгенерировано имя ключа: {key_name} для пользователя {tg_id}")
-        existing_key = await get_key_details(key_name, session)
-        if not existing_key:
-            break
-        logger.warning(f"[Key Generation] Имя ключа {key_name} уже существует. Генерация нового.")
+    pooled = await claim_trial_client(session) if trial else None
+    if pooled:
+        key_name = pooled["email"]
+        client_id = pooled["client_id"]
+        logger.info(f"[Key Generation] Из пула получен ключ {key_name} для пользователя {tg_id}")
+    else:
+        key_name = await key_name_allocator.allocate(session)
+        client_id = str(uuid.uuid4())
+        logger.info(f"[Key Generation] Выделено имя ключа: {key_name} для пользователя {tg_id}")
 
-    client_id = str(uuid.uuid4())
     email = key_name.lower()
     expiry_timestamp = int(expiry_time.timestamp() * 1000)
     public_link = f"{PUBLIC_LINK}{email}/{tg_id}"
 
     try:
-        least_loaded_cluster = await get_least_loaded_cluster()
-        tasks = [
-            asyncio.create_task(
-                create_key_on_cluster(least_loaded_cluster, tg_id, client_id, email, expiry_timestamp, plan)
-            )
-        ]
-        await asyncio.gather(*tasks, return_exceptions=True)
-        logger.info(f"[Key Creation] Ключ создан на кластере {least_loaded_cluster} для пользователя {tg_id}")
+        if pooled:
+            cluster_name = pooled["cluster_name"]
+            await activate_trial_client(session, pooled, tg_id, expiry_timestamp)
+        else:
+            cluster_name = await get_least_loaded_cluster()
         await store_key(
             tg_id,
             client_id,
             email,
             expiry_timestamp,
             public_link,
-            least_loaded_cluster,
+            cluster_name,
             session,
         )
         await update_trial(tg_id, 1, session)
         logger.info(f"[Database] Ключ сохранён в базе данных для пользователя {tg_id}")
+        if not pooled:
+            # Ссылка подписки не зависит от панелей, поэтому ответ не ждёт создания клиентов
+            provision_key_in_background(cluster_name, tg_id, client_id, email, expiry_timestamp, plan)
+            logger.info(f"[Key Creation] Запущено создание ключа на кластере {cluster_name} для пользователя {tg_id}")
+        else:
+            logger.info(f"[Key Creation] Ключ из пула активирован на кластере {cluster_name} для пользователя {tg_id}")
     except Exception as e:
         logger.error(f"[Error] Ошибка при создании ключа для пользователя {tg_id}: {e}")
         error_message = "❌ Произошла ошибка при создании подписки. Пожалуйста, попробуйте снова."
@@ -425,12 +432,7 @@ async def finalize_key_creation(
     if old_key_name:
         key_name = old_key_name
     else:
-        while True:
-            key_name = generate_random_email()
-            existing_key = await get_key_details(key_name, session)
-            if not existing_key:
-                break
-            logger.warning(f"Key name '{key_name}' already exists for user {tg_id}. Generating a new one.")
+        key_name = await key_name_allocator.allocate(session)
 
     client_id = str(uuid.uuid4())
     email = key_name.lower()
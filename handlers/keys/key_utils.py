@@ -1,4 +1,5 @@
 import asyncio
+import time
 
 from typing import Any
 
@@ -6,7 +7,8 @@ import asyncpg
 
 from py3xui import AsyncApi
 
-from config import ADMIN_PASSWORD, ADMIN_USERNAME, DATABASE_URL, LIMIT_IP, PUBLIC_LINK, SUPERNODE, TOTAL_GB
+from bot import bot
+from config import ADMIN_ID, ADMIN_PASSWORD, ADMIN_USERNAME, DATABASE_URL, LIMIT_IP, PUBLIC_LINK, SUPERNODE, TOTAL_GB
 from database import get_servers, store_key, delete_notification
 from handlers.utils import get_least_loaded_cluster
 from logger import logger
@@ -18,13 +20,24 @@ from panels.three_xui import (
     get_client_traffic,
     toggle_client,
 )
+from utils.db_metrics import InstrumentedConnection
+from utils.handler_metrics import begin_request, handler_metrics, track_panel_time
 
 
+KEY_PROVISION_ATTEMPTS = 3
+KEY_PROVISION_RETRY_DELAY = 5
+
+_provisioning_tasks: set[asyncio.Task] = set()
+
+
+@track_panel_time
 async def create_key_on_cluster(
     cluster_id: str, tg_id: int, client_id: str, email: str, expiry_timestamp: int, plan: int = None
 ):
     """
     Создает ключ на всех серверах указанного кластера (или на конкретном сервере, если cluster_id — это имя сервера).
+
+    Возвращает результаты add_client по серверам (исключения — как элементы списка).
     """
     try:
         servers = await get_servers()
@@ -44,12 +57,19 @@ async def create_key_on_cluster(
         semaphore = asyncio.Semaphore(2)
 
         if SUPERNODE:
+            results = []
             for server_info in cluster:
-                await create_client_on_server(
-                    server_info, tg_id, client_id, email, expiry_timestamp, semaphore, plan=plan
-                )
+                try:
+                    results.append(
+                        await create_client_on_server(
+                            server_info, tg_id, client_id, email, expiry_timestamp, semaphore, plan=plan
+                        )
+                    )
+                except Exception as e:
+                    results.append(e)
+            return results
         else:
-            await asyncio.gather(
+            return await asyncio.gather(
                 *(
                     create_client_on_server(server, tg_id, client_id, email, expiry_timestamp, semaphore, plan=plan)
                     for server in cluster
@@ -62,6 +82,7 @@ async def create_key_on_cluster(
         raise e
 
 
+@track_panel_time
 async def create_client_on_server(
     server_info: dict,
     tg_id: int,
@@ -73,6 +94,8 @@ async def create_client_on_server(
 ):
     """
     Создает клиента на указанном сервере.
+
+    Возвращает результат add_client или None, если у сервера не задан inbound.
     """
     async with semaphore:
         xui = AsyncApi(
@@ -98,7 +121,7 @@ async def create_client_on_server(
 
         total_gb_value = int(TOTAL_GB) if plan is None else int(plan) * int(TOTAL_GB)
 
-        await add_client(
+        result = await add_client(
             xui,
             ClientConfig(
                 client_id=client_id,
@@ -116,9 +139,176 @@ async def create_client_on_server(
 
         if SUPERNODE:
             await asyncio.sleep(0.7)
+        return result
+
 
+def _is_provisioned(result: Any) -> bool:
+    """Клиент есть на сервере: создан сейчас или уже существовал после прошлой попытки."""
+    return isinstance(result, dict) and not result.get("error")
 
-async def renew_key_in_cluster(cluster_id, email, client_id, new_expiry_time, total_gb):
+
+async def _provision_key(
+    cluster_id: str, tg_id: int, client_id: str, email: str, expiry_timestamp: int, plan: int | None
+) -> str | None:
+    """
+    Создает ключ на панелях, повторяя попытки и переключаясь на другие кластеры при отказе.
+
+    Returns:
+        str | None: Кластер, на котором создан ключ, или None, если создать не удалось нигде
+    """
+    servers = await get_servers()
+    candidates = [cluster_id] + [name for name in servers if name != cluster_id]
+
+    for candidate in candidates:
+        for attempt in range(1, KEY_PROVISION_ATTEMPTS + 1):
+            try:
+                results = await create_key_on_cluster(candidate, tg_id, client_id, email, expiry_timestamp, plan)
+            except Exception as e:
+                results = [e]
+            results = [result for result in results if result is not None]
+            if results and all(_is_provisioned(result) for result in results):
+                return candidate
+            if attempt < KEY_PROVISION_ATTEMPTS:
+                await asyncio.sleep(KEY_PROVISION_RETRY_DELAY * attempt)
+        if any(_is_provisioned(result) for result in results):
+            logger.warning(f"[Key Provisioning] Ключ {email} создан не на всех серверах кластера {candidate}")
+            return candidate
+        logger.error(f"[Key Provisioning] Не удалось создать ключ {email} на кластере {candidate}")
+    return None
+
+
+async def _run_key_provisioning(
+    cluster_id: str, tg_id: int, client_id: str, email: str, expiry_timestamp: int, plan: int | None
+) -> None:
+    timings = begin_request()
+    started = time.perf_counter()
+    provisioned_on = None
+    try:
+        provisioned_on = await _provision_key(cluster_id, tg_id, client_id, email, expiry_timestamp, plan)
+    except Exception as e:
+        logger.error(f"[Key Provisioning] Ошибка при создании ключа {email} для пользователя {tg_id}: {e}")
+    finally:
+        handler_metrics.record(
+            ["background:key_provisioning"], time.perf_counter() - started, timings, error=provisioned_on is None
+        )
+
+    if provisioned_on is None:
+        try:
+            await bot.send_message(
+                chat_id=tg_id,
+                text=(
+                    "⚠️ Не удалось активировать вашу подписку на серверах. "
+                    "Мы уже знаем о проблеме, пожалуйста, обратитесь в поддержку."
+                ),
+            )
+        except Exception as e:
+            logger.error(f"[Key Provisioning] Не удалось уведомить пользователя {tg_id}: {e}")
+        return
+
+    if provisioned_on != cluster_id:
+        conn = await asyncpg.connect(DATABASE_URL, connection_class=InstrumentedConnection)
+        try:
+            await conn.execute("UPDATE keys SET server_id = $1 WHERE client_id = $2", provisioned_on, client_id)
+        finally:
+            await conn.close()
+        logger.warning(f"[Key Provisioning] Ключ {email} перенесён с кластера {cluster_id} на {provisioned_on}")
+
+
+def provision_key_in_background(
+    cluster_id: str, tg_id: int, client_id: str, email: str, expiry_timestamp: int, plan: int | None = None
+) -> asyncio.Task:
+    """
+    Запускает создание ключа на панелях в фоне, не задерживая ответ пользователю.
+
+    Ключ уже должен быть сохранен в базе: ссылка подписки не зависит от кластера, поэтому
+    пользователь получает ее сразу. При отказе серверов создание повторяется до
+    KEY_PROVISION_ATTEMPTS раз, затем ключ переносится на другой кластер. Если создать ключ
+    не удалось нигде, пользователь получает уведомление. Время фонового создания учитывается
+    в метриках как background:key_provisioning.
+
+    Returns:
+        asyncio.Task: Фоновая задача создания ключа
+    """
+    task = asyncio.create_task(_run_key_provisioning(cluster_id, tg_id, client_id, email, expiry_timestamp, plan))
+    _provisioning_tasks.add(task)
+    task.add_done_callback(_provisioning_tasks.discard)
+    return task
+
+
+async def _run_key_renewal(
+    cluster_id: str, tg_id: int, client_id: str, email: str, expiry_time: int, total_gb: int
+) -> None:
+    timings = begin_request()
+    started = time.perf_counter()
+    renewed = False
+    for attempt in range(1, KEY_PROVISION_ATTEMPTS + 1):
+        try:
+            results = await renew_key_in_cluster(cluster_id, email, client_id, expiry_time, total_gb, tg_id=tg_id)
+            renewed = bool(results) and all(result is True for result in results)
+        except Exception as e:
+            logger.error(f"[Key Renewal] Ошибка при продлении ключа {email} (попытка {attempt}): {e}")
+        if renewed:
+            break
+        if attempt < KEY_PROVISION_ATTEMPTS:
+            await asyncio.sleep(KEY_PROVISION_RETRY_DELAY * attempt)
+    handler_metrics.record(["background:key_renewal"], time.perf_counter() - started, timings, error=not renewed)
+    if renewed:
+        logger.info(f"[Key Renewal] Ключ {email} пользователя {tg_id} продлён на серверах кластера {cluster_id}")
+        return
+
+    logger.error(f"[Key Renewal] Не удалось продлить ключ {email} пользователя {tg_id} в кластере {cluster_id}")
+    try:
+        await bot.send_message(
+            chat_id=tg_id,
+            text=(
+                "⚠️ Подписка продлена, но серверы пока не приняли новый срок. "
+                "Мы уже знаем о проблеме, пожалуйста, обратитесь в поддержку, если ключ перестанет работать."
+            ),
+        )
+    except Exception as e:
+        logger.error(f"[Key Renewal] Не удалось уведомить пользователя {tg_id}: {e}")
+    for admin_id in ADMIN_ID:
+        try:
+            await bot.send_message(
+                chat_id=admin_id,
+                text=(
+                    f"⚠️ Ключ <code>{email}</code> пользователя <code>{tg_id}</code> оплачен, "
+                    f"но не продлён на серверах кластера {cluster_id} после {KEY_PROVISION_ATTEMPTS} попыток."
+                ),
+            )
+        except Exception as e:
+            logger.error(f"[Key Renewal] Не удалось уведомить администратора {admin_id}: {e}")
+
+
+def renew_key_in_background(
+    cluster_id: str, tg_id: int, client_id: str, email: str, expiry_time: int, total_gb: int
+) -> asyncio.Task:
+    """
+    Продлевает оплаченный ключ на панелях в фоне, не задерживая ответ пользователю.
+
+    Новый срок уже записан в базе. Если не все серверы приняли его, продление повторяется
+    до KEY_PROVISION_ATTEMPTS раз, затем пользователь и администраторы получают уведомление.
+    Время учитывается в метриках как background:key_renewal.
+
+    Returns:
+        asyncio.Task: Фоновая задача продления ключа
+    """
+    task = asyncio.create_task(_run_key_renewal(cluster_id, tg_id, client_id, email, expiry_time, total_gb))
+    _provisioning_tasks.add(task)
+    task.add_done_callback(_provisioning_tasks.discard)
+    return task
+
+
+@track_panel_time
+async def renew_key_in_cluster(cluster_id, email, client_id, new_expiry_time, total_gb, tg_id: int | None = None):
+    """
+    Продлевает ключ на всех серверах кластера (или на сервере, если cluster_id — имя сервера).
+
+    Если tg_id передан, вызывающий уже очистил уведомления о ключе (например, в транзакции
+    продления), и функция обращается только к панелям.
+
+    Возвращает результаты extend_client_key по серверам (исключения — как элементы списка).
+    """
     try:
         servers = await get_servers()
         cluster = servers.get(cluster_id)
@@ -134,22 +324,23 @@ async def renew_key_in_cluster(cluster_id, email, client_id, new_expiry_time, to
             else:
                 raise ValueError(f"Кластер или сервер с ID/именем {cluster_id} не найден.")
 
-        async with asyncpg.create_pool(DATABASE_URL) as pool:
-            async with pool.acquire() as conn:
-                tg_id_query = "SELECT tg_id FROM keys WHERE client_id = $1 LIMIT 1"
-                tg_id_record = await conn.fetchrow(tg_id_query, client_id)
+        if tg_id is None:
+            async with asyncpg.create_pool(DATABASE_URL) as pool:
+                async with pool.acquire() as conn:
+                    tg_id_query = "SELECT tg_id FROM keys WHERE client_id = $1 LIMIT 1"
+                    tg_id_record = await conn.fetchrow(tg_id_query, client_id)
 
-                if not tg_id_record:
-                    logger.error(f"Не найден пользователь с client_id={client_id} в таблице keys.")
-                    return False
+                    if not tg_id_record:
+                        logger.error(f"Не найден пользователь с client_id={client_id} в таблице keys.")
+                        return False
 
-                tg_id = tg_id_record["tg_id"]
+                    tg_id = tg_id_record["tg_id"]
 
-                notification_prefixes = ["key_24h", "key_10h", "key_expired", "renew"]
-                for notif in notification_prefixes:
-                    notification_id = f"{email}_{notif}"
-                    await delete_notification(tg_id, notification_id, session=conn)
-                logger.info(f"🧹 Уведомления для ключа {email} очищены при продлении.")
+                    notification_prefixes = ["key_24h", "key_10h", "key_expired", "renew"]
+                    for notif in notification_prefixes:
+                        notification_id = f"{email}_{notif}"
+                        await delete_notification(tg_id, notification_id, session=conn)
+                    logger.info(f"🧹 Уведомления для ключа {email} очищены при продлении.")
         tasks = []
         for server_info in cluster:
             xui = AsyncApi(
@@ -179,13 +370,14 @@ async def renew_key_in_cluster(cluster_id, email, client_id, new_expiry_time, to
                 )
             )
 
-        await asyncio.gather(*tasks, return_exceptions=True)
+        return await asyncio.gather(*tasks, return_exceptions=True)
 
     except Exception as e:
         logger.error(f"Не удалось продлить ключ {client_id} в кластере/на сервере {cluster_id}: {e}")
         raise e
 
 
+@track_panel_time
 async def delete_key_from_cluster(cluster_id, email, client_id):
     """Удаление ключа с серверов в кластере или с конкретного сервера"""
     try:
@@ -236,6 +428,7 @@ async def delete_key_from_cluster(cluster_id, email, client_id):
         raise e
 
 
+@track_panel_time
 async def update_key_on_cluster(tg_id, client_id, email, expiry_time, cluster_id):
     """
     Обновляет ключ на всех серверах указанного кластера (или сервера, если передано имя).
@@ -343,6 +536,7 @@ async def update_subscription(tg_id: int, email: str, session: Any, cluster_over
     )
 
 
+@track_panel_time
 async def get_user_traffic(session: Any, tg_id: int, email: str) -> dict[str, Any]:
     """
     Получает трафик пользователя на всех серверах, где у него есть ключ.
@@ -413,6 +607,7 @@ async def get_user_traffic(session: Any, tg_id: int, email: str) -> dict[str, An
     return {"status": "success", "traffic": user_traffic_data}
 
 
+@track_panel_time
 async def toggle_client_on_cluster(cluster_id: str, email: str, client_id: str, enable: bool = True) -> dict[str, Any]:
     """
     Включает или отключает клиента на всех серверах указанного кластера.
@@ -488,6 +683,7 @@ async def toggle_client_on_cluster(cluster_id: str, email: str, client_id: str,
         return {"status": "error", "error": str(e)}
 
 
+@track_panel_time
 async def reset_traffic_in_cluster(cluster_id: str, email: str) -> None:
     """
     Сбрасывает трафик клиента на всех серверах указанного кластера (или конкретного сервера).
@@ -5,7 +5,7 @@ import os
 import time
 import re
 
-from datetime import datetime, timedelta
+from datetime import datetime
 from io import BytesIO
 from typing import Any
 
@@ -39,16 +39,13 @@ from config import (
     USE_NEW_PAYMENT_FLOW,
 )
 from database import (
-    check_server_name_by_cluster,
     create_temporary_data,
     delete_key,
     get_balance,
-    get_key_by_server,
     get_key_details,
     get_keys,
     get_servers,
-    update_balance,
-    update_key_expiry,
+    renew_key_with_balance,
 )
 from handlers.buttons import (
     ADD_SUB,
@@ -81,6 +78,7 @@ from handlers.buttons import (
 )
 from handlers.keys.key_utils import (
     delete_key_from_cluster,
+    renew_key_in_background,
     renew_key_in_cluster,
     toggle_client_on_cluster,
     update_subscription,
@@ -109,6 +107,7 @@ from handlers.texts import (
 )
 from handlers.utils import edit_or_send_message, handle_error
 from logger import logger
+from utils.db_metrics import InstrumentedConnection
 
 
 locale.setlocale(locale.LC_TIME, "ru_RU.UTF-8")
@@ -627,7 +626,7 @@ async def process_callback_connect_phone(callback_query: CallbackQuery):
 
     conn = None
     try:
-        conn = await asyncpg.connect(DATABASE_URL)
+        conn = await asyncpg.connect(DATABASE_URL, connection_class=InstrumentedConnection)
         key_data = await conn.fetchrow(
             """
             SELECT key FROM keys WHERE email = $1
@@ -673,7 +672,7 @@ async def process_callback_connect_ios(callback_query: CallbackQuery):
 
     conn = None
     try:
-        conn = await asyncpg.connect(DATABASE_URL)
+        conn = await asyncpg.connect(DATABASE_URL, connection_class=InstrumentedConnection)
         key_data = await conn.fetchrow("SELECT key FROM keys WHERE email = $1", email)
         if not key_data:
             await callback_query.message.answer("❌ Ошибка: ключ не найден.")
@@ -712,7 +711,7 @@ async def process_callback_connect_android(callback_query: CallbackQuery):
 
     conn = None
     try:
-        conn = await asyncpg.connect(DATABASE_URL)
+        conn = await asyncpg.connect(DATABASE_URL, connection_class=InstrumentedConnection)
         key_data = await conn.fetchrow("SELECT key FROM keys WHERE email = $1", email)
         if not key_data:
             await callback_query.message.answer("❌ Ошибка: ключ не найден.")
@@ -894,74 +893,71 @@ async def process_callback_renew_plan(callback_query: CallbackQuery, session: An
     total_gb = TOTAL_GB * gb_multiplier.get(plan, 1) if TOTAL_GB > 0 else 0
 
     try:
-        record = await get_key_by_server(tg_id, client_id, session)
+        cost = RENEWAL_PLANS[plan]["price"]
+        renewal = await renew_key_with_balance(tg_id, client_id, days_to_extend, cost, session)
 
-        if record:
-            email = record["email"]
-            expiry_time = record["expiry_time"]
-            current_time = datetime.utcnow().timestamp() * 1000
+        if renewal["status"] == "not_found":
+            await callback_query.message.answer(KEY_NOT_FOUND_MSG)
+            logger.error(f"[RENEW] Ключ с client_id={client_id} не найден.")
+            return
 
-            if expiry_time <= current_time:
-                new_expiry_time = int(current_time + timedelta(days=days_to_extend).total_seconds() * 1000)
-            else:
-                new_expiry_time = int(expiry_time + timedelta(days=days_to_extend).total_seconds() * 1000)
+        if renewal["status"] == "insufficient_funds":
+            required_amount = renewal["required_amount"]
 
-            cost = RENEWAL_PLANS[plan]["price"]
-            balance = await get_balance(tg_id)
+            logger.info(
+                f"[RENEW] Пользователю {tg_id} не хватает {required_amount}₽. Запуск доплаты через {USE_NEW_PAYMENT_FLOW}"
+            )
 
-            if balance < cost:
-                required_amount = cost - balance
+            await create_temporary_data(
+                session,
+                tg_id,
+                "waiting_for_renewal_payment",
+                {
+                    "plan": plan,
+                    "client_id": client_id,
+                    "cost": cost,
+                    "required_amount": required_amount,
+                    "new_expiry_time": renewal["expiry_time"],
+                    "total_gb": total_gb,
+                    "email": renewal["email"],
+                },
+            )
 
-                logger.info(
-                    f"[RENEW] Пользователю {tg_id} не хватает {required_amount}₽. Запуск доплаты через {USE_NEW_PAYMENT_FLOW}"
-                )
+            if USE_NEW_PAYMENT_FLOW == "YOOKASSA":
+                logger.info(f"[RENEW] Запуск оплаты через Юкассу для пользователя {tg_id}")
+                await process_custom_amount_input(callback_query, session)
+            elif USE_NEW_PAYMENT_FLOW == "ROBOKASSA":
+                logger.info(f"[RENEW] Запуск оплаты через Робокассу для пользователя {tg_id}")
+                await handle_custom_amount_input(callback_query, session)
+            else:
+                logger.info(f"[RENEW] Отправка сообщения о доплате пользователю {tg_id}")
+                builder = InlineKeyboardBuilder()
+                builder.row(InlineKeyboardButton(text=PAYMENT, callback_data="pay"))
+                builder.row(InlineKeyboardButton(text=MAIN_MENU, callback_data="profile"))
 
-                await create_temporary_data(
-                    session,
-                    tg_id,
-                    "waiting_for_renewal_payment",
-                    {
-                        "plan": plan,
-                        "client_id": client_id,
-                        "cost": cost,
-                        "required_amount": required_amount,
-                        "new_expiry_time": new_expiry_time,
-                        "total_gb": total_gb,
-                        "email": email,
-                    },
+                await edit_or_send_message(
+                    target_message=callback_query.message,
+                    text=INSUFFICIENT_FUNDS_RENEWAL_MSG.format(required_amount=required_amount),
+                    reply_markup=builder.as_markup(),
+                    media_path=None,
                 )
+            return
 
-                if USE_NEW_PAYMENT_FLOW == "YOOKASSA":
-                    logger.info(f"[RENEW] Запуск оплаты через Юкассу для пользователя {tg_id}")
-                    await process_custom_amount_input(callback_query, session)
-                elif USE_NEW_PAYMENT_FLOW == "ROBOKASSA":
-                    logger.info(f"[RENEW] Запуск оплаты через Робокассу для пользователя {tg_id}")
-                    await handle_custom_amount_input(callback_query, session)
-                else:
-                    logger.info(f"[RENEW] Отправка сообщения о доплате пользователю {tg_id}")
-                    builder = InlineKeyboardBuilder()
-                    builder.row(InlineKeyboardButton(text=PAYMENT, callback_data="pay"))
-                    builder.row(InlineKeyboardButton(text=MAIN_MENU, callback_data="profile"))
-
-                    await edit_or_send_message(
-                        target_message=callback_query.message,
-                        text=INSUFFICIENT_FUNDS_RENEWAL_MSG.format(required_amount=required_amount),
-                        reply_markup=builder.as_markup(),
-                        media_path=None,
-                    )
-                return
-
-            logger.info(f"[RENEW] Средств достаточно. Продление ключа для пользователя {tg_id}")
-            await complete_key_renewal(tg_id, client_id, email, new_expiry_time, total_gb, cost, callback_query, plan)
-
-        else:
-            await callback_query.message.answer(KEY_NOT_FOUND_MSG)
-            logger.error(f"[RENEW] Ключ с client_id={client_id} не найден.")
+        logger.info(f"[RENEW] Средства списаны. Продление ключа на серверах для пользователя {tg_id}")
+        await finish_key_renewal(tg_id, client_id, renewal, total_gb, callback_query, plan)
     except Exception as e:
         logger.error(f"[RENEW] Ошибка при продлении ключа для пользователя {tg_id}: {e}")
 
 
-async def complete_key_renewal(tg_id, client_id, email, new_expiry_time, total_gb, cost, callback_query, plan):
+async def complete_key_renewal(
+    tg_id, client_id, email, new_expiry_time, total_gb, cost, callback_query, plan, session: Any = None
+):
+    """
+    Продлевает ключ после доплаты: списывает баланс и продлевает ключ в одной транзакции.
+
+    email и new_expiry_time сохранены для совместимости с платежными модулями: email
+    и новый срок берутся из заблокированной строки ключа.
+    """
     logger.info(
         f"[RENEW] Начинаю процесс продления ключа с параметрами: "
         f"tg_id={tg_id}, client_id={client_id}, email={email}, "
@@ -969,6 +965,27 @@ async def complete_key_renewal(tg_id, client_id, email, new_expiry_time, total_g
         f"callback_query={'есть' if callback_query else 'отсутствует'}, plan={plan}"
     )
 
+    conn = session or await asyncpg.connect(DATABASE_URL, connection_class=InstrumentedConnection)
+    try:
+        renewal = await renew_key_with_balance(tg_id, client_id, 30 * int(plan), cost, conn)
+    finally:
+        if session is None:
+            await conn.close()
+
+    if renewal["status"] != "renewed":
+        logger.error(f"[RENEW] Ключ {client_id} пользователя {tg_id} не продлён: {renewal['status']}")
+        return
+
+    await finish_key_renewal(tg_id, client_id, renewal, total_gb, callback_query, plan)
+
+
+async def finish_key_renewal(tg_id, client_id, renewal: dict[str, Any], total_gb, callback_query, plan):
+    """
+    Сообщает об успешном продлении и продлевает ключ на серверах кластера в фоне.
+
+    Если серверы не приняли новый срок, продление повторяется, а затем пользователь и
+    администраторы получают уведомление (см. renew_key_in_background).
+    """
     response_message = SUCCESS_RENEWAL_MSG.format(months=plan)
 
     builder = InlineKeyboardBuilder()
@@ -988,47 +1005,15 @@ async def complete_key_renewal(tg_id, client_id, email, new_expiry_time, total_g
     else:
         await bot.send_message(tg_id, response_message, reply_markup=builder.as_markup())
 
-    conn = await asyncpg.connect(DATABASE_URL)
-
-    logger.info(f"[RENEW] Получение данных о ключе для email: {email}")
-    key_info = await get_key_details(email, conn)
-    if not key_info:
-        logger.error(f"[RENEW] Ключ с client_id {client_id} для пользователя {tg_id} не найден.")
-        await conn.close()
-        return
-
-    server_id = key_info["server_id"]
-
+    email = renewal["email"]
+    server_id = renewal["server_id"]
     if USE_COUNTRY_SELECTION:
-        logger.info(f"[RENEW] USE_COUNTRY_SELECTION включён. Проверяю информацию о сервере {server_id}")
-        cluster_info = await check_server_name_by_cluster(server_id, conn)
-        if not cluster_info:
+        cluster_id = renewal["cluster_name"]
+        if not cluster_id:
             logger.error(f"[RENEW] Сервер {server_id} не найден в таблице servers.")
-            await conn.close()
             return
-        cluster_id = cluster_info["cluster_name"]
-        logger.info(f"[RENEW] Информация о сервере получена: {cluster_info}. Использую cluster_id: {cluster_id}")
     else:
         cluster_id = server_id
-        logger.info(f"[RENEW] USE_COUNTRY_SELECTION выключен. Использую server_id в качестве cluster_id: {cluster_id}")
 
-    logger.info(f"[RENEW] Запуск продления ключа для пользователя {tg_id} на {plan} мес. в кластере {cluster_id}.")
-
-    async def renew_key_on_cluster():
-        logger.info(
-            f"[RENEW] Запуск renew_key_on_cluster с параметрами: "
-            f"cluster_id={cluster_id}, email={email}, client_id={client_id}, "
-            f"new_expiry_time={new_expiry_time}, total_gb={total_gb}"
-        )
-        await renew_key_in_cluster(cluster_id, email, client_id, new_expiry_time, total_gb)
-        logger.info("[RENEW] Продление ключа на сервере завершено. Обновляю срок действия в базе данных.")
-        await update_key_expiry(client_id, new_expiry_time, conn)
-        logger.info("[RENEW] Срок действия ключа обновлён. Обновляю баланс пользователя.")
-        await update_balance(tg_id, -cost, conn)
-        logger.info(f"[RENEW] Ключ {client_id} успешно продлён на {plan} мес. для пользователя {tg_id}.")
-
-    logger.info("[RENEW] Инициализация процесса продления ключа в кластере.")
-    await renew_key_on_cluster()
-
-    logger.info("[RENEW] Процесс продления ключа завершён. Закрываю соединение с базой данных.")
-    await conn.close()
+    logger.info(f"[RENEW] Продление ключа {email} пользователя {tg_id} на {plan} мес. в кластере {cluster_id}.")
+    renew_key_in_background(cluster_id, tg_id, client_id, email, renewal["expiry_time"], total_gb)
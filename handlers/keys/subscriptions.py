@@ -26,6 +26,7 @@ from config import (
 from database import get_key_details, get_servers
 from handlers.utils import convert_to_bytes
 from logger import logger
+from utils.db_metrics import InstrumentedConnection
 
 
 async def fetch_url_content(url: str, identifier: str) -> list[str]:
@@ -317,7 +318,7 @@ async def handle_subscription(request: web.Request, old_subscription: bool = Fal
         f"Обработка запроса для {'старого' if old_subscription else 'нового'} клиента: email={email}, tg_id={tg_id}"
     )
 
-    conn = await asyncpg.connect(DATABASE_URL)
+    conn = await asyncpg.connect(DATABASE_URL, connection_class=InstrumentedConnection)
     try:
         client_data = await get_key_details(email, conn)
         if not client_data:
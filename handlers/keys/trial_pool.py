@@ -0,0 +1,238 @@
+"""
+Пул заранее созданных клиентов для пробных ключей.
+
+Реплика-лидер держит в каждом кластере TRIAL_POOL_SIZE отключённых клиентов, уже созданных
+на всех серверах кластера. При активации пробного периода клиент забирается из пула одним
+запросом к базе и включается на серверах одним обновлением на сервер, без выбора наименее
+загруженного кластера и последовательного создания клиентов. Пул пополняется в фоне:
+первый вызов claim_trial_client запускает periodic_trial_pool_refill(), а пустой пул будит
+пополнение, не дожидаясь TRIAL_POOL_REFILL_INTERVAL.
+"""
+
+import asyncio
+import uuid
+
+from typing import Any
+
+import asyncpg
+
+from py3xui import AsyncApi
+
+from config import ADMIN_PASSWORD, ADMIN_USERNAME, DATABASE_URL, LIMIT_IP, SUPERNODE, TOTAL_GB
+from database import get_servers
+from logger import logger
+from panels.three_xui import ClientConfig, activate_client, add_client, delete_client
+from utils.db_metrics import InstrumentedConnection
+from utils.handler_metrics import track_panel_time
+from utils.key_names import key_name_allocator
+from utils.leader import leader_election
+
+
+TRIAL_POOL_SIZE = 20
+TRIAL_POOL_REFILL_INTERVAL = 15
+
+_refill_requested = asyncio.Event()
+_refill_task: asyncio.Task | None = None
+
+
+def _panel(server_info: dict) -> AsyncApi:
+    return AsyncApi(server_info["api_url"], username=ADMIN_USERNAME, password=ADMIN_PASSWORD, logger=logger)
+
+
+def _client_config(
+    server_info: dict, client_id: str, email: str, tg_id: int, expiry_timestamp: int, enable: bool
+) -> ClientConfig:
+    return ClientConfig(
+        client_id=client_id,
+        email=f"{email}_{server_info['server_name'].lower()}" if SUPERNODE else email,
+        tg_id=tg_id,
+        limit_ip=LIMIT_IP,
+        total_gb=int(TOTAL_GB),
+        expiry_time=expiry_timestamp,
+        enable=enable,
+        flow="xtls-rprx-vision",
+        inbound_id=int(server_info["inbound_id"]),
+        sub_id=email,
+    )
+
+
+async def claim_trial_client(session: Any) -> dict | None:
+    """
+    Забирает из пула самого старого готового клиента.
+
+    Строка удаляется из пула в том же запросе, поэтому одновременные активации не получат
+    одного и того же клиента. Клиенты удалённых кластеров пропускаются.
+
+    Args:
+        session: Соединение или пул asyncpg
+
+    Returns:
+        dict | None: cluster_name, client_id, email и servers или None, если пул пуст
+    """
+    record = await session.fetchrow(
+        """
+        DELETE FROM trial_pool
+        WHERE id = (
+            SELECT p.id FROM trial_pool p
+            WHERE EXISTS (SELECT 1 FROM servers s WHERE s.cluster_name = p.cluster_name)
+            ORDER BY p.id
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING cluster_name, client_id, email, servers
+        """
+    )
+    _ensure_refill()
+    if record is None:
+        _refill_requested.set()
+    return dict(record) if record else None
+
+
+def _ensure_refill() -> None:
+    global _refill_task
+    if TRIAL_POOL_SIZE > 0 and (_refill_task is None or _refill_task.done()):
+        _refill_task = asyncio.create_task(periodic_trial_pool_refill())
+
+
+@track_panel_time
+async def activate_trial_client(session: Any, pooled: dict, tg_id: int, expiry_timestamp: int) -> None:
+    """
+    Включает клиента из пула на всех серверах его кластера и назначает ему владельца и срок.
+
+    На серверах, добавленных в кластер после создания клиента или не принявших обновление,
+    клиент создаётся заново.
+
+    Args:
+        session: Соединение или пул asyncpg
+        pooled: Клиент, полученный из claim_trial_client
+        tg_id: ID пользователя Telegram
+        expiry_timestamp: Время окончания в миллисекундах
+
+    Raises:
+        ValueError: Если кластер удалён или клиент не удалось включить ни на одном сервере
+    """
+    servers = (await get_servers(session)).get(pooled["cluster_name"])
+    if not servers:
+        raise ValueError(f"Кластер {pooled['cluster_name']} не найден.")
+
+    async def activate_on_server(server_info: dict) -> bool:
+        config = _client_config(server_info, pooled["client_id"], pooled["email"], tg_id, expiry_timestamp, True)
+        xui = _panel(server_info)
+        if server_info["server_name"] in pooled["servers"] and await activate_client(xui, config):
+            return True
+        result = await add_client(xui, config)
+        return not result.get("error") and result.get("status") != "duplicate"
+
+    servers = [server for server in servers if server.get("inbound_id")]
+    results = await asyncio.gather(*(activate_on_server(server) for server in servers))
+    if not any(results):
+        raise ValueError(f"Не удалось включить клиента {pooled['email']} в кластере {pooled['cluster_name']}.")
+    failed = [server["server_name"] for server, ok in zip(servers, results, strict=True) if not ok]
+    if failed:
+        logger.warning(f"[Trial Pool] Клиент {pooled['email']} не включён на серверах: {', '.join(failed)}")
+
+
+async def _provision_client(cluster_name: str, servers: list[dict], email: str) -> dict | None:
+    """Создаёт отключённого клиента на всех серверах кластера."""
+    client_id = str(uuid.uuid4())
+    configs = [(server, _client_config(server, client_id, email, 0, 0, False)) for server in servers]
+    results = await asyncio.gather(*(add_client(_panel(server), config) for server, config in configs))
+
+    if any(result.get("error") or result.get("status") == "duplicate" for result in results):
+        await asyncio.gather(
+            *(delete_client(_panel(server), config.inbound_id, config.email, client_id) for server, config in configs),
+            return_exceptions=True,
+        )
+        return None
+    return {
+        "cluster_name": cluster_name,
+        "client_id": client_id,
+        "email": email,
+        "servers": [server["server_name"] for server in servers],
+    }
+
+
+async def refill_trial_pool(conn: asyncpg.Connection, size: int = TRIAL_POOL_SIZE) -> int:
+    """
+    Досоздаёт клиентов в кластерах, где в пуле меньше `size` готовых клиентов.
+
+    Кластеры пополняются параллельно. Если сервер кластера не принял клиента, пополнение
+    этого кластера прекращается до следующего прохода.
+
+    Args:
+        conn: Соединение с базой данных
+        size: Целевой размер пула на кластер
+
+    Returns:
+        int: Количество созданных клиентов
+    """
+    clusters = await get_servers(conn)
+    rows = await conn.fetch("SELECT cluster_name, COUNT(*) AS ready FROM trial_pool GROUP BY cluster_name")
+    ready = {row["cluster_name"]: row["ready"] for row in rows}
+    deficits = {
+        cluster_name: size - ready.get(cluster_name, 0)
+        for cluster_name, servers in clusters.items()
+        if ready.get(cluster_name, 0) < size and any(server.get("inbound_id") for server in servers)
+    }
+    if not deficits:
+        return 0
+
+    names = await key_name_allocator.allocate_many(conn, sum(deficits.values()))
+    conn_lock = asyncio.Lock()
+
+    async def fill(cluster_name: str, emails: list[str]) -> int:
+        servers = [server for server in clusters[cluster_name] if server.get("inbound_id")]
+        created = 0
+        for email in emails:
+            pooled = await _provision_client(cluster_name, servers, email)
+            if pooled is None:
+                logger.warning(f"[Trial Pool] Не удалось пополнить пул кластера {cluster_name}")
+                break
+            async with conn_lock:
+                await conn.execute(
+                    "INSERT INTO trial_pool (cluster_name, client_id, email, servers) VALUES ($1, $2, $3, $4)",
+                    pooled["cluster_name"],
+                    pooled["client_id"],
+                    pooled["email"],
+                    pooled["servers"],
+                )
+            created += 1
+        return created
+
+    tasks = []
+    offset = 0
+    for cluster_name, deficit in deficits.items():
+        tasks.append(fill(cluster_name, names[offset : offset + deficit]))
+        offset += deficit
+    return sum(await asyncio.gather(*tasks))
+
+
+async def periodic_trial_pool_refill():
+    """
+    Периодически пополняет пул пробных клиентов. Выполняется только на реплике-лидере.
+
+    Запускается из claim_trial_client при первой активации пробного периода.
+    """
+    if TRIAL_POOL_SIZE <= 0:
+        return
+
+    while True:
+        await leader_election.wait_for_leadership("trial_pool")
+        _refill_requested.clear()
+
+        conn = None
+        try:
+            conn = await asyncpg.connect(DATABASE_URL, connection_class=InstrumentedConnection)
+            created = await refill_trial_pool(conn)
+            if created:
+                logger.info(f"[Trial Pool] В пул добавлено клиентов: {created}")
+        except Exception as e:
+            logger.error(f"Ошибка при пополнении пула пробных клиентов: {e}")
+        finally:
+            if conn:
+                await conn.close()
+
+        try:
+            await asyncio.wait_for(_refill_requested.wait(), timeout=TRIAL_POOL_REFILL_INTERVAL)
+        except TimeoutError:
+            pass
@@ -45,6 +45,9 @@ from handlers.texts import (
     KEY_RENEWED_TEMP_MSG,
 )
 from logger import logger
+from utils.db_metrics import InstrumentedConnection
+from utils.leader import leader_election
+from utils.rate_governor import mark_bulk_traffic
 
 from .notify_utils import send_notification
 from .special_notifications import notify_inactive_trial_users, notify_users_no_traffic
@@ -61,9 +64,13 @@ notification_lock = asyncio.Lock()
 async def periodic_notifications(bot: Bot):
     """
     Периодическая проверка и отправка уведомлений.
-    Защищена от одновременного запуска с помощью asyncio.Lock.
+    Защищена от одновременного запуска с помощью asyncio.Lock,
+    а между репликами выполняется только на лидере.
     """
+    mark_bulk_traffic()
     while True:
+        await leader_election.wait_for_leadership("periodic_notifications")
+
         if notification_lock.locked():
             logger.warning("⛔ Предыдущая задача уведомлений ещё выполняется. Пропуск итерации.")
             await asyncio.sleep(NOTIFICATION_TIME)
@@ -72,7 +79,7 @@ async def periodic_notifications(bot: Bot):
         async with notification_lock:
             conn = None
             try:
-                conn = await asyncpg.connect(DATABASE_URL)
+                conn = await asyncpg.connect(DATABASE_URL, connection_class=InstrumentedConnection)
                 current_time = int(datetime.now(moscow_tz).timestamp() * 1000)
 
                 threshold_time_10h = int((datetime.now(moscow_tz) + timedelta(hours=10)).timestamp() * 1000)
@@ -1,32 +1,33 @@
-import asyncio
 import os
 
 import aiofiles
 
 from aiogram import Bot
-from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+from aiogram.exceptions import TelegramForbiddenError
 from aiogram.types import BufferedInputFile, InlineKeyboardMarkup
 
 from logger import logger
 
 
 def rate_limited_send(func):
+    """
+    Перехватывает ошибки отправки уведомления.
+
+    Flood control обрабатывается глобально в utils.rate_governor: сюда TelegramRetryAfter
+    доходит, только если повторы исчерпаны.
+    """
+
     async def wrapper(*args, **kwargs):
-        while True:
-            try:
-                return await func(*args, **kwargs)
-            except TelegramRetryAfter as e:
-                retry_in = int(e.retry_after) + 1
-                logger.warning(f"⚠️ Flood control: повтор через {retry_in} сек.")
-                await asyncio.sleep(retry_in)
-            except TelegramForbiddenError:
-                tg_id = kwargs.get("tg_id") or args[1]
-                logger.warning(f"Пользователь {tg_id} заблокировал бота.")
-                return False
-            except Exception as e:
-                tg_id = kwargs.get("tg_id") or args[1]
-                logger.error(f"❌ Ошибка отправки сообщения пользователю {tg_id}: {e}")
-                return False
+        try:
+            return await func(*args, **kwargs)
+        except TelegramForbiddenError:
+            tg_id = kwargs.get("tg_id") or args[1]
+            logger.warning(f"Пользователь {tg_id} заблокировал бота.")
+            return False
+        except Exception as e:
+            tg_id = kwargs.get("tg_id") or args[1]
+            logger.error(f"❌ Ошибка отправки сообщения пользователю {tg_id}: {e}")
+            return False
 
     return wrapper
 
@@ -0,0 +1,211 @@
+"""
+Очередь входящих платежных уведомлений.
+
+Вебхук платежной системы проверяет подпись и вызывает enqueue_payment_event, который только
+сохраняет событие и сразу возвращает управление: ответ платежной системе не ждет начисления.
+Повторная доставка того же платежа упирается в уникальный ключ (provider, external_id) и ничего
+не меняет.
+
+События применяет process_payment_events_forever(), который enqueue_payment_event запускает при
+первом вызове и будит при каждом новом событии. Под FOR UPDATE SKIP LOCKED в одной транзакции
+начисляется баланс с кешбэком и реферальными бонусами, записывается платеж и событие
+помечается обработанным, поэтому деньги начисляются ровно один раз даже при нескольких
+репликах. Уведомление пользователю отправляется после фиксации транзакции. Событие, которое
+не удалось применить, повторяется с задержкой.
+"""
+
+import asyncio
+import json
+import time
+
+from typing import Any
+
+import asyncpg
+
+from config import DATABASE_URL
+from database import add_payment, update_balance
+from handlers.payments.utils import send_payment_success_notification
+from logger import logger
+from utils.db_metrics import InstrumentedConnection
+from utils.handler_metrics import begin_request, handler_metrics
+
+
+PAYMENT_EVENTS_POLL_INTERVAL = 5
+PAYMENT_EVENTS_BATCH = 50
+PAYMENT_EVENTS_MAX_ATTEMPTS = 10
+PAYMENT_EVENTS_RETRY_DELAY = 60
+
+_new_events = asyncio.Event()
+_worker_task: asyncio.Task | None = None
+
+
+async def enqueue_payment_event(
+    session: Any, provider: str, external_id: str, tg_id: int, amount: float, payload: dict | None = None
+) -> bool:
+    """
+    Сохраняет уведомление о платеже и будит обработчик очереди.
+
+    Событие применяется вне запроса вебхука, поэтому платежная система сразу получает ответ.
+
+    Args:
+        session: Соединение asyncpg
+        provider: Платежная система, например "robokassa"
+        external_id: Идентификатор транзакции на стороне платежной системы
+        tg_id: ID пользователя Telegram
+        amount: Сумма платежа
+        payload: Исходные параметры уведомления для разбора инцидентов
+
+    Returns:
+        bool: True, если событие новое, и False для повторной доставки
+    """
+    _ensure_worker()
+    event_id = await session.fetchval(
+        """
+        INSERT INTO payment_events (provider, external_id, tg_id, amount, payload)
+        VALUES ($1, $2, $3, $4, $5::jsonb)
+        ON CONFLICT (provider, external_id) DO NOTHING
+        RETURNING id
+        """,
+        provider,
+        str(external_id),
+        tg_id,
+        amount,
+        json.dumps(payload, ensure_ascii=False, default=str) if payload is not None else None,
+    )
+    if event_id is None:
+        logger.info(f"[Payment Events] Повторное уведомление {provider}:{external_id} пропущено")
+        return False
+
+    _new_events.set()
+    return True
+
+
+def _ensure_worker() -> None:
+    global _worker_task
+    if _worker_task is None or _worker_task.done():
+        _worker_task = asyncio.create_task(process_payment_events_forever())
+
+
+async def _apply_next_event(conn: asyncpg.Connection) -> dict | None:
+    """
+    Применяет самое старое ожидающее событие.
+
+    Returns:
+        dict | None: Событие (с ключом error при неудаче) или None, если применять нечего
+    """
+    async with conn.transaction():
+        event = await conn.fetchrow(
+            """
+            SELECT id, provider, external_id, tg_id, amount
+            FROM payment_events
+            WHERE status = 'pending' AND available_at <= NOW()
+            ORDER BY id
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+            """
+        )
+        if event is None:
+            return None
+
+        try:
+            async with conn.transaction():
+                await update_balance(event["tg_id"], event["amount"], conn)
+                await add_payment(event["tg_id"], event["amount"], event["provider"], conn)
+                await conn.execute(
+                    "UPDATE payment_events SET status = 'processed', processed_at = NOW() WHERE id = $1",
+                    event["id"],
+                )
+        except Exception as e:
+            logger.error(f"[Payment Events] Ошибка обработки платежа {event['provider']}:{event['external_id']}: {e}")
+            await conn.execute(
+                """
+                UPDATE payment_events
+                SET attempts = attempts + 1,
+                    last_error = $2,
+                    status = CASE WHEN attempts + 1 >= $3 THEN 'failed' ELSE 'pending' END,
+                    available_at = NOW() + make_interval(secs => $4 * (attempts + 1))
+                WHERE id = $1
+                """,
+                event["id"],
+                str(e),
+                PAYMENT_EVENTS_MAX_ATTEMPTS,
+                PAYMENT_EVENTS_RETRY_DELAY,
+            )
+            return {**dict(event), "error": str(e)}
+
+    return dict(event)
+
+
+async def process_payment_events(conn: asyncpg.Connection, limit: int = PAYMENT_EVENTS_BATCH) -> int:
+    """
+    Обрабатывает до `limit` ожидающих событий.
+
+    Событие, которое не удалось применить, откладывается на PAYMENT_EVENTS_RETRY_DELAY секунд,
+    умноженных на номер попытки. После PAYMENT_EVENTS_MAX_ATTEMPTS попыток оно получает
+    статус failed и требует ручного разбора.
+
+    Args:
+        conn: Соединение с базой данных
+        limit: Максимальное количество событий за проход
+
+    Returns:
+        int: Количество успешно примененных событий
+    """
+    applied = 0
+    for _ in range(limit):
+        event = await _apply_and_notify(conn)
+        if event is None:
+            break
+        if "error" not in event:
+            applied += 1
+    return applied
+
+
+async def _apply_and_notify(conn: asyncpg.Connection) -> dict | None:
+    """Применяет событие, учитывает его в метриках и уведомляет пользователя о зачислении."""
+    timings = begin_request()
+    started = time.perf_counter()
+    event = await _apply_next_event(conn)
+    if event is None:
+        return None
+
+    failed = "error" in event
+    handler_metrics.record(["background:payment_events"], time.perf_counter() - started, timings, error=failed)
+    if failed:
+        return event
+
+    logger.info(
+        f"[Payment Events] Платеж {event['provider']}:{event['external_id']} на сумму {event['amount']} "
+        f"зачислен пользователю {event['tg_id']}"
+    )
+    try:
+        await send_payment_success_notification(event["tg_id"], event["amount"])
+    except Exception as e:
+        logger.error(f"[Payment Events] Не удалось уведомить пользователя {event['tg_id']} о платеже: {e}")
+    return event
+
+
+async def process_payment_events_forever():
+    """
+    Повторяет события, которые не удалось применить сразу, и подбирает события, оставшиеся
+    после перезапуска. Работает на каждой реплике, где приходили вебхуки: SKIP LOCKED не дает
+    двум обработчикам взять одно событие.
+    """
+    while True:
+        _new_events.clear()
+
+        conn = None
+        try:
+            conn = await asyncpg.connect(DATABASE_URL, connection_class=InstrumentedConnection)
+            while await process_payment_events(conn) == PAYMENT_EVENTS_BATCH:
+                pass
+        except Exception as e:
+            logger.error(f"Ошибка при обработке очереди платежей: {e}")
+        finally:
+            if conn:
+                await conn.close()
+
+        try:
+            await asyncio.wait_for(_new_events.wait(), timeout=PAYMENT_EVENTS_POLL_INTERVAL)
+        except TimeoutError:
+            pass
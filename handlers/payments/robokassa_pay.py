@@ -20,16 +20,15 @@ from robokassa import HashAlgorithm, Robokassa
 
 from database import (
     add_connection,
-    add_payment,
     check_connection_exists,
     get_key_count,
     get_temporary_data,
-    update_balance,
 )
-from handlers.payments.utils import send_payment_success_notification
+from handlers.payments.payment_events import enqueue_payment_event
 from handlers.texts import PAYMENT_OPTIONS, ENTER_SUM, DEFAULT_PAYMENT_MESSAGE
 from handlers.utils import edit_or_send_message
 from logger import logger
+from utils.db_metrics import InstrumentedConnection
 
 from handlers.buttons import BACK, PAY_2
 
@@ -168,7 +167,12 @@ async def process_amount_selection(callback_query: types.CallbackQuery, state: F
 
 
 async def robokassa_webhook(request):
-    """Обработка webhook-уведомлений от Robokassa с учетом shp_id."""
+    """
+    Обработка webhook-уведомлений от Robokassa с учетом shp_id.
+
+    Уведомление только сохраняется в очередь платежей, баланс начисляет обработчик очереди.
+    Повторное уведомление с тем же InvId подтверждается, но не начисляется второй раз.
+    """
     try:
         params = await request.post()
 
@@ -191,14 +195,13 @@ async def robokassa_webhook(request):
 
         tg_id = shp_id
 
-        logger.info(f"Processing payment for user {tg_id} with amount {amount}.")
-
-        await update_balance(int(tg_id), float(amount))
-        await send_payment_success_notification(tg_id, float(amount))
-
-        await add_payment(int(tg_id), float(amount), "robokassa")
+        logger.info(f"Queueing payment {inv_id} for user {tg_id} with amount {amount}.")
 
-        logger.info(f"Payment successful. Balance updated for user {tg_id}.")
+        conn = await asyncpg.connect(DATABASE_URL, connection_class=InstrumentedConnection)
+        try:
+            await enqueue_payment_event(conn, "robokassa", inv_id, int(tg_id), float(amount), dict(params))
+        finally:
+            await conn.close()
 
         return web.Response(text=f"OK{inv_id}")
 
@@ -259,7 +262,7 @@ async def handle_custom_amount_input(
     inv_id = 0
 
     try:
-        conn = await asyncpg.connect(DATABASE_URL)
+        conn = await asyncpg.connect(DATABASE_URL, connection_class=InstrumentedConnection)
         user_data = await get_temporary_data(conn, tg_id)
         await conn.close()
 
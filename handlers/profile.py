@@ -36,7 +36,7 @@ from config import (
     TRIAL_TIME,
     USERNAME_BOT,
 )
-from database import get_balance, get_key_count, get_last_payments, get_referral_stats, get_trial
+from database import get_last_payments, get_referral_stats, get_user_snapshot
 from handlers.buttons import (
     ABOUT_VPN,
     ADD_SUB,
@@ -55,6 +55,7 @@ from handlers.buttons import (
 )
 from handlers.texts import BALANCE_HISTORY_HEADER, BALANCE_MANAGEMENT_TEXT, INVITE_TEXT_NON_INLINE, TOP_REFERRALS_TEXT
 from logger import logger
+from utils.db_metrics import InstrumentedConnection
 
 from .admin.panel.keyboard import AdminPanelCallback
 from .texts import get_referral_link, invite_message_send, profile_message_send
@@ -70,6 +71,7 @@ async def process_callback_view_profile(
     callback_query_or_message: Message | CallbackQuery,
     state: FSMContext,
     admin: bool,
+    session: Any = None,
 ):
     if isinstance(callback_query_or_message, CallbackQuery):
         chat = callback_query_or_message.message.chat
@@ -96,70 +98,61 @@ async def process_callback_view_profile(
     image_path = os.path.join("img", "profile.jpg")
     logger.info(f"Переход в профиль. Используется изображение: {image_path}")
 
-    key_count = await get_key_count(chat_id)
-    balance = await get_balance(chat_id) or 0
+    snapshot = await get_user_snapshot(chat_id, session)
+    key_count = snapshot["key_count"]
+    balance = snapshot["balance"]
+    trial_status = snapshot["trial"]
 
-    conn = await asyncpg.connect(DATABASE_URL)
-    try:
-        trial_status = await get_trial(chat_id, conn)
-
-        profile_message = profile_message_send(username, chat_id, int(balance), key_count)
-        if key_count == 0:
-            profile_message += (
-                "\n<blockquote>🔧 <i>Нажмите кнопку ➕ Подписка, чтобы настроить VPN-подключение</i></blockquote>"
-            )
-        else:
-            profile_message += f"\n<blockquote> <i>{NEWS_MESSAGE}</i></blockquote>"
-
-        builder = InlineKeyboardBuilder()
-        if trial_status == 0 or key_count == 0:
-        if key_count > 0:
-            builder.row(InlineKeyboardButton(text=MY_SUBS, callback_data="view_keys"))
-        elif trial_status == 0:
-            builder.row(InlineKeyboardButton(text="🎁 Пробная подписка", callback_data="create_key"))
-        else:
-            builder.row(InlineKeyboardButton(text=ADD_SUB, callback_data="create_key"))
-        builder.row(InlineKeyboardButton(text=BALANCE, callback_data="balance"))
-
-        row_buttons = []
-        if REFERRAL_BUTTON:
-            row_buttons.append(InlineKeyboardButton(text=INVITE, callback_data="invite"))
-        if GIFT_BUTTON:
-            row_buttons.append(InlineKeyboardButton(text=GIFTS, callback_data="gifts"))
-        if row_buttons:
-            builder.row(*row_buttons)
-
-        if INSTRUCTIONS_BUTTON:
-            builder.row(InlineKeyboardButton(text=INSTRUCTIONS, callback_data="instructions"))
-        if admin:
-            builder.row(
-                InlineKeyboardButton(text="🔧 Администратор", callback_data=AdminPanelCallback(action="admin").pack())
-            )
-        if SHOW_START_MENU_ONCE:
-            builder.row(InlineKeyboardButton(text=ABOUT_VPN, callback_data="about_vpn"))
-        else:
-            builder.row(InlineKeyboardButton(text=BACK, callback_data="start"))
+    profile_message = profile_message_send(username, chat_id, int(balance), key_count)
+    if key_count == 0:
+        profile_message += (
+            "\n<blockquote>🔧 <i>Нажмите кнопку ➕ Подписка, чтобы настроить VPN-подключение</i></blockquote>"
+        )
+    else:
+        profile_message += f"\n<blockquote> <i>{NEWS_MESSAGE}</i></blockquote>"
 
-        await edit_or_send_message(
-            target_message=target_message,
-            text=profile_message,
-            reply_markup=builder.as_markup(),
-            media_path=image_path,
-            disable_web_page_preview=False,
-            force_text=True,
+    builder = InlineKeyboardBuilder()
+    if key_count > 0:
+        builder.row(InlineKeyboardButton(text=MY_SUBS, callback_data="view_keys"))
+    elif trial_status == 0:
+        builder.row(InlineKeyboardButton(text="🎁 Пробная подписка", callback_data="create_key"))
+    else:
+        builder.row(InlineKeyboardButton(text=ADD_SUB, callback_data="create_key"))
+    builder.row(InlineKeyboardButton(text=BALANCE, callback_data="balance"))
+
+    row_buttons = []
+    if REFERRAL_BUTTON:
+        row_buttons.append(InlineKeyboardButton(text=INVITE, callback_data="invite"))
+    if GIFT_BUTTON:
+        row_buttons.append(InlineKeyboardButton(text=GIFTS, callback_data="gifts"))
+    if row_buttons:
+        builder.row(*row_buttons)
+
+    if INSTRUCTIONS_BUTTON:
+        builder.row(InlineKeyboardButton(text=INSTRUCTIONS, callback_data="instructions"))
+    if admin:
+        builder.row(
+            InlineKeyboardButton(text="🔧 Администратор", callback_data=AdminPanelCallback(action="admin").pack())
         )
-    finally:
-        await conn.close()
+    if SHOW_START_MENU_ONCE:
+        builder.row(InlineKeyboardButton(text=ABOUT_VPN, callback_data="about_vpn"))
+    else:
+        builder.row(InlineKeyboardButton(text=BACK, callback_data="start"))
+
+    await edit_or_send_message(
+        target_message=target_message,
+        text=profile_message,
+        reply_markup=builder.as_markup(),
+        media_path=image_path,
+        disable_web_page_preview=False,
+        force_text=True,
+    )
 
 
 @router.callback_query(F.data == "balance")
 async def balance_handler(callback_query: CallbackQuery, session: Any):
-    result = await session.fetchrow(
-        "SELECT balance FROM connections WHERE tg_id = $1",
-        callback_query.from_user.id,
-    )
-    balance = result["balance"] if result else 0.0
-    balance = int(balance)
+    snapshot = await get_user_snapshot(callback_query.from_user.id, session)
+    balance = int(snapshot["balance"])
 
     builder = InlineKeyboardBuilder()
     builder.row(InlineKeyboardButton(text=PAYMENT, callback_data="pay"))
@@ -336,7 +329,7 @@ async def show_referral_qr(callback_query: CallbackQuery):
 
 @router.callback_query(F.data == "top_referrals")
 async def top_referrals_handler(callback_query: CallbackQuery):
-    conn = await asyncpg.connect(DATABASE_URL)
+    conn = await asyncpg.connect(DATABASE_URL, connection_class=InstrumentedConnection)
     try:
         user_referral_count = await conn.fetchval(
             "SELECT COUNT(*) FROM referrals WHERE referrer_tg_id = $1",
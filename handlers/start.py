@@ -28,7 +28,7 @@ from database import (
     add_referral,
     check_connection_exists,
     get_referral_by_referred_id,
-    get_trial,
+    get_user_snapshot,
     update_balance,
 )
 from handlers.admin.coupons.coupons_handler import handle_coupon_activation
@@ -127,7 +127,7 @@ async def process_start_logic(
                 parts = text.split("gift_")[1].split("_")
                 if len(parts) < 2:
                     await message.answer("❌ Неверный формат ссылки на подарок.")
-                    return await process_callback_view_profile(message, state, admin)
+                    return await process_callback_view_profile(message, state, admin, session)
                 gift_id = parts[0]
                 async with session.transaction():
                     gift_info = await session.fetchrow(
@@ -141,19 +141,19 @@ async def process_start_logic(
                     )
                 if not gift_info:
                     await message.answer(GIFT_ALREADY_USED_OR_NOT_EXISTS_MSG)
-                    return await process_callback_view_profile(message, state, admin)
+                    return await process_callback_view_profile(message, state, admin, session)
 
                 if gift_info["is_used"]:
                     await message.answer("Этот подарок уже был использован.")
-                    return await process_callback_view_profile(message, state, admin)
+                    return await process_callback_view_profile(message, state, admin, session)
 
                 if gift_info["sender_tg_id"] == message.chat.id:
                     await message.answer("❌ Вы не можете получить подарок от самого себя.")
-                    return await process_callback_view_profile(message, state, admin)
+                    return await process_callback_view_profile(message, state, admin, session)
 
                 if gift_info["recipient_tg_id"]:
                     await message.answer("❌ Этот подарок уже был активирован другим пользователем.")
-                    return await process_callback_view_profile(message, state, admin)
+                    return await process_callback_view_profile(message, state, admin, session)
 
                 existing_referral = await get_referral_by_referred_id(message.chat.id, session)
                 if not existing_referral:
@@ -189,13 +189,13 @@ async def process_start_logic(
                     connection_exists_now = await check_connection_exists(message.chat.id)
                     if connection_exists_now:
                         await message.answer("❌ Вы уже зарегистрированы и не можете использовать реферальную ссылку.")
-                        return await process_callback_view_profile(message, state, admin)
+                        return await process_callback_view_profile(message, state, admin, session)
                     if referrer_tg_id == message.chat.id:
                         await message.answer("❌ Вы не можете быть рефералом самого себя.")
-                        return await process_callback_view_profile(message, state, admin)
+                        return await process_callback_view_profile(message, state, admin, session)
                     existing_referral = await get_referral_by_referred_id(message.chat.id, session)
                     if existing_referral:
-                        return await process_callback_view_profile(message, state, admin)
+                        return await process_callback_view_profile(message, state, admin, session)
 
                     await add_referral(message.chat.id, referrer_tg_id, session)
                     await message.answer(REFERRAL_SUCCESS_MSG.format(referrer_tg_id=referrer_tg_id))
@@ -206,7 +206,7 @@ async def process_start_logic(
                         )
                     except Exception as e:
                         logger.error(f"Не удалось отправить уведомление пригласившему ({referrer_tg_id}): {e}")
-                    return await process_callback_view_profile(message, state, admin)
+                    return await process_callback_view_profile(message, state, admin, session)
                 except (ValueError, IndexError):
                     pass
 
@@ -220,7 +220,7 @@ async def process_start_logic(
     final_exists = await check_connection_exists(message.chat.id)
     if final_exists:
         if SHOW_START_MENU_ONCE:
-            return await process_callback_view_profile(message, state, admin)
+            return await process_callback_view_profile(message, state, admin, session)
         else:
             return await show_start_menu(message, admin, session)
     else:
@@ -266,7 +266,7 @@ async def show_start_menu(message: Message, admin: bool, session: Any):
     builder = InlineKeyboardBuilder()
 
     if session is not None:
-        trial_status = await get_trial(message.chat.id, session)
+        trial_status = (await get_user_snapshot(message.chat.id, session))["trial"]
         logger.info(f"Trial status для {message.chat.id}: {trial_status}")
         if trial_status == 0:
             builder.row(InlineKeyboardButton(text="🎁 Пробная подписка", callback_data="create_key"))
@@ -1,11 +1,7 @@
-import json
 import os
 import re
-import secrets
-import string
 
 import aiofiles
-import aiohttp
 import asyncpg
 
 from aiogram.types import BufferedInputFile, InlineKeyboardMarkup, InputMediaPhoto, Message
@@ -14,21 +10,12 @@ from bot import bot
 from config import DATABASE_URL
 from database import get_all_keys, get_servers
 from logger import logger
+from utils.fx_rates import fx_rates
 
 
-async def get_usd_rate():
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get("https://www.cbr-xml-daily.ru/daily_json.js") as response:
-                if response.status == 200:
-                    data = await response.text()
-                    usd = float(json.loads(data)["Valute"]["USD"]["Value"])
-                else:
-                    usd = float(100)
-    except Exception as e:
-        logger.exception(f"Error fetching USD rate: {e}")
-        usd = float(100)
-    return usd
+async def get_usd_rate() -> float:
+    """Курс доллара к рублю из кэша курсов (см. utils.fx_rates), без сетевого запроса."""
+    return await fx_rates.get("USD")
 
 
 def sanitize_key_name(key_name: str) -> str:
@@ -44,19 +31,6 @@ def sanitize_key_name(key_name: str) -> str:
     return re.sub(r"[^a-z0-9@._-]", "", key_name.lower())
 
 
-def generate_random_email(length: int = 6) -> str:
-    """
-    Генерирует случайный email с заданной длиной.
-
-    Args:
-        length (int, optional): Длина случайной строки. По умолчанию 6.
-
-    Returns:
-        str: Сгенерированная случайная строка.
-    """
-    return "".join(secrets.choice(string.ascii_lowercase + string.digits) for _ in range(length)) if length > 0 else ""
-
-
 async def get_least_loaded_cluster() -> str:
     """
     Определяет кластер с наименьшей загрузкой.
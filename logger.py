@@ -1,6 +1,9 @@
+import json
 import logging
 import os
+import random
 import sys
+import traceback
 
 from datetime import timedelta
 
@@ -9,6 +12,19 @@ from loguru import logger
 
 log_folder = "logs"
 
+LOG_ENQUEUE = True
+LOG_JSON = True
+LOG_COMPRESSION = "gz"
+
+# Доля сохраняемых DEBUG/INFO-сообщений для шумных модулей (по префиксу имени модуля).
+# WARNING и выше пишутся всегда.
+LOG_SAMPLE_RATES = {
+    "middlewares.loggings": 0.1,
+    "handlers.keys.subscriptions": 0.25,
+    "handlers.keys.key_utils": 0.25,
+    "handlers.notifications": 0.25,
+}
+
 if not os.path.exists(log_folder):
     os.makedirs(log_folder)
 
@@ -35,20 +51,59 @@ logging.basicConfig(handlers=[InterceptHandler()], level=0)
 logging.getLogger("httpcore").setLevel(logging.WARNING)
 logging.getLogger("httpx").setLevel(logging.WARNING)
 
+
+def sample_filter(record: dict) -> bool:
+    """Пропускает только долю DEBUG/INFO-сообщений модулей из LOG_SAMPLE_RATES."""
+    if record["level"].no >= logging.WARNING:
+        return True
+    name = record["name"] or ""
+    for prefix, rate in LOG_SAMPLE_RATES.items():
+        if name.startswith(prefix):
+            return random.random() < rate  # noqa: S311
+    return True
+
+
+def json_formatter(record: dict) -> str:
+    """Формирует одну JSON-строку на запись; поля из logger.bind() попадают в extra."""
+    entry = {
+        "time": record["time"].isoformat(),
+        "level": record["level"].name,
+        "module": record["name"],
+        "function": record["function"],
+        "line": record["line"],
+        "message": record["message"],
+    }
+    extra = {key: value for key, value in record["extra"].items() if key != "json"}
+    if extra:
+        entry["extra"] = extra
+    if record["exception"]:
+        exc_type, exc_value, exc_traceback = record["exception"]
+        entry["exception"] = "".join(traceback.format_exception(exc_type, exc_value, exc_traceback))
+    record["extra"]["json"] = json.dumps(entry, ensure_ascii=False, default=str)
+    return "{extra[json]}\n"
+
+
 logger.add(
     sys.stderr,
     level="INFO",
     format="<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level}</level> | <cyan>{module}:{function}:{line}</cyan> | <level>{message}</level>",
     colorize=True,
+    filter=sample_filter,
+    enqueue=LOG_ENQUEUE,
 )
 
-log_file_path = os.path.join(log_folder, "logging.log")
+log_file_path = os.path.join(log_folder, "logging.jsonl" if LOG_JSON else "logging.log")
 logger.add(
     log_file_path,
     level="DEBUG",
-    format="{time:YYYY-MM-DD HH:mm:ss} | {level} | {module}:{function}:{line} | {message}",
+    format=json_formatter
+    if LOG_JSON
+    else "{time:YYYY-MM-DD HH:mm:ss} | {level} | {module}:{function}:{line} | {message}",
     rotation=timedelta(minutes=60),
     retention=timedelta(days=3),
+    compression=LOG_COMPRESSION,
+    filter=sample_filter,
+    enqueue=LOG_ENQUEUE,
 )
 
 logger = logger
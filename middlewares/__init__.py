@@ -5,6 +5,7 @@ from aiogram.dispatcher.middlewares.base import BaseMiddleware
 
 from .admin import AdminMiddleware
 from .loggings import LoggingMiddleware
+from .metrics import MetricsMiddleware
 from .session import SessionMiddleware
 from .throttling import ThrottlingMiddleware
 from .user import UserMiddleware
@@ -22,7 +23,8 @@ def register_middleware(
         middlewares: Опциональный список middleware для регистрации.
                     Если не указан, регистрируются все стандартные middleware.
         exclude: Опциональный список имен middleware, которые нужно исключить из регистрации.
-                Применяется только если middlewares не указан.
+                Применяется только если middlewares не указан. Имя "metrics" отключает
+                замер задержки обработчиков в любом случае.
     """
     # Если middleware не указаны, используем стандартный набор
     if middlewares is None:
@@ -55,3 +57,9 @@ def register_middleware(
 
         for handler in handlers:
             handler.outer_middleware(middleware)
+
+    # Замер задержки регистрируется как inner middleware: ему нужен выбранный обработчик
+    if "metrics" not in set(exclude or []):
+        metrics_middleware = MetricsMiddleware()
+        for handler in handlers:
+            handler.middleware(metrics_middleware)
@@ -25,11 +25,11 @@ class LoggingMiddleware(BaseMiddleware):
         user_info = self._extract_user_info(event)
 
         if user_info["user_id"]:
-            logger.info(
-                f"Активность пользователя - "
-                f"ID пользователя: {user_info['user_id']}, "
-                f"Имя пользователя: {user_info['username'] or 'Не указано'}, "
-                f"Действие: {user_info['action'] or 'Неизвестно'}"
+            logger.bind(**user_info).debug(
+                "Активность пользователя - ID пользователя: {}, Имя пользователя: {}, Действие: {}",
+                user_info["user_id"],
+                user_info["username"] or "Не указано",
+                user_info["action"] or "Неизвестно",
             )
 
         return await handler(event, data)
@@ -0,0 +1,60 @@
+import re
+import time
+
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, TelegramObject
+
+from utils.handler_metrics import begin_request, handler_metrics
+from utils.metrics_server import ensure_metrics_server
+
+
+CALLBACK_PREFIX_PATTERN = re.compile(r"[|:]")
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """
+    Middleware для замера задержки обработчиков.
+
+    Регистрируется как inner middleware, поэтому видит выбранный обработчик в data["handler"].
+    Для каждого апдейта учитывается время обработчика целиком, время запросов к БД и операций
+    с панелями, а для callback-запросов — еще и префикс callback_data. Первый апдейт запускает
+    сервер метрик (см. ensure_metrics_server).
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        await ensure_metrics_server()
+        names = [f"handler:{self._handler_name(data)}"]
+        if isinstance(event, CallbackQuery) and event.data:
+            names.append(f"callback:{CALLBACK_PREFIX_PATTERN.split(event.data, 1)[0]}")
+
+        for name in names:
+            handler_metrics.get(name).in_flight += 1
+
+        timings = begin_request()
+        started = time.perf_counter()
+        error = False
+        try:
+            return await handler(event, data)
+        except Exception:
+            error = True
+            raise
+        finally:
+            handler_metrics.record(names, time.perf_counter() - started, timings, error)
+            for name in names:
+                handler_metrics.get(name).in_flight -= 1
+
+    @staticmethod
+    def _handler_name(data: dict[str, Any]) -> str:
+        handler_object = data.get("handler")
+        callback = getattr(handler_object, "callback", None)
+        if callback is None:
+            return "unknown"
+        return f"{callback.__module__}.{callback.__qualname__}"
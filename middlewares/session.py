@@ -7,6 +7,9 @@ from aiogram import BaseMiddleware
 from aiogram.types import TelegramObject
 
 from config import DATABASE_URL
+from utils.cache_bus import invalidation_bus
+from utils.db_metrics import InstrumentedConnection
+from utils.stats_rollups import ensure_stats_rollups
 
 
 class SessionMiddleware(BaseMiddleware):
@@ -19,7 +22,11 @@ class SessionMiddleware(BaseMiddleware):
         data: dict[str, Any],
     ) -> Any:
         if self.pool is None:
-            self.pool = await asyncpg.create_pool(DATABASE_URL, min_size=5, max_size=20)
+            self.pool = await asyncpg.create_pool(
+                DATABASE_URL, min_size=5, max_size=20, connection_class=InstrumentedConnection
+            )
+            await invalidation_bus.start()
+            ensure_stats_rollups()
 
         async with self.pool.acquire() as conn:
             data["session"] = conn
@@ -70,6 +70,49 @@ async def add_client(xui: py3xui.AsyncApi, config: ClientConfig) -> dict[str, An
         return {"status": "failed", "error": error_message}
 
 
+async def activate_client(xui: py3xui.AsyncApi, config: ClientConfig) -> bool:
+    """
+    Включает заранее созданного клиента и назначает ему срок действия и владельца.
+
+    В отличие от extend_client_key не ищет клиента по email: идентификатор уже известен,
+    поэтому на сервер уходит один запрос обновления.
+
+    Args:
+        xui: Экземпляр API клиента
+        config: Новая конфигурация клиента
+
+    Returns:
+        bool: True если успешно, False если ошибка
+    """
+    try:
+        await xui.login()
+
+        client = py3xui.Client(
+            id=config.client_id,
+            email=config.email.lower(),
+            limit_ip=config.limit_ip,
+            total_gb=config.total_gb,
+            expiry_time=config.expiry_time,
+            enable=config.enable,
+            tg_id=config.tg_id,
+            sub_id=config.sub_id,
+            flow=config.flow,
+            inbound_id=config.inbound_id,
+        )
+
+        await xui.client.update(config.client_id, client)
+        logger.info(f"Клиент {config.email} с ID {config.client_id} активирован")
+        return True
+
+    except httpx.ConnectTimeout as e:
+        logger.error(f"Ошибка при активации клиента {config.email}: {e}")
+        return False
+
+    except Exception as e:
+        logger.error(f"Ошибка при активации клиента {config.email}: {e}")
+        return False
+
+
 async def extend_client_key(
     xui: py3xui.AsyncApi,
     inbound_id: int,
@@ -12,6 +12,7 @@ from config import ADMIN_ID, PING_TIME
 from database import get_servers
 from handlers.admin.servers.keyboard import AdminServerCallback
 from logger import logger
+from utils.leader import leader_election
 
 
 last_ping_times = {}
@@ -71,8 +72,11 @@ async def check_servers():
     """
     Периодическая проверка серверов.
     Использует asyncio.gather() для ускорения.
+    Между репликами выполняется только на лидере.
     """
     while True:
+        await leader_election.wait_for_leadership("check_servers")
+
         servers = await get_servers()
         current_time = datetime.now()
 
@@ -0,0 +1,118 @@
+import asyncio
+import json
+
+from collections.abc import Callable, MutableMapping
+from typing import Any
+
+import asyncpg
+
+from config import DATABASE_URL
+from logger import logger
+
+
+CACHE_INVALIDATION_CHANNEL = "cache_invalidation"
+BUS_HEALTHCHECK_INTERVAL = 10
+BUS_RECONNECT_DELAY = 3
+
+InvalidationCallback = Callable[[str | None], None]
+
+
+class InvalidationBus:
+    """
+    Шина инвалидации in-process кэшей между репликами на LISTEN/NOTIFY PostgreSQL.
+
+    Уведомления шлют триггеры `notify_cache_invalidation` из assets/migrations на таблицах
+    keys, connections, servers и coupons, поэтому изменения из любого места — функций database.py,
+    inline-SQL в хендлерах, webhook платёжных систем — доходят до всех реплик без лишних запросов.
+    Полезная нагрузка: {"entity": <таблица>, "id": <tg_id | cluster_name | code>}.
+
+    Подписчик получает id изменённой записи и вытесняет её из кэша. После разрыва соединения
+    часть уведомлений могла потеряться, поэтому при переподключении подписчики получают None
+    и сбрасывают кэш целиком. Прослушивание запускает SessionMiddleware вместе с пулом.
+    """
+
+    def __init__(self, dsn: str = DATABASE_URL) -> None:
+        self.dsn = dsn
+        self._subscribers: dict[str, list[InvalidationCallback]] = {}
+        self._task: asyncio.Task | None = None
+
+    def subscribe(self, entity: str, callback: InvalidationCallback) -> None:
+        """Подписывает обработчик на изменения сущности (имя таблицы)."""
+        self._subscribers.setdefault(entity, []).append(callback)
+
+    def subscribe_cache(self, entity: str, cache: MutableMapping, key_type: Callable[[str], Any] = str) -> None:
+        """
+        Подписывает кэш-словарь (dict, TTLCache) на изменения сущности.
+
+        Args:
+            entity: Имя таблицы
+            cache: Кэш, ключи которого совпадают с id сущности
+            key_type: Приведение id из уведомления к типу ключа кэша (например, int для tg_id)
+        """
+
+        def evict(entity_id: str | None) -> None:
+            if entity_id is None:
+                cache.clear()
+            else:
+                cache.pop(key_type(entity_id), None)
+
+        self.subscribe(entity, evict)
+
+    async def start(self) -> None:
+        """Запускает прослушивание канала. Повторный вызов ничего не делает."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def _dispatch(self, entity: str, entity_id: str | None) -> None:
+        for callback in self._subscribers.get(entity, []):
+            try:
+                callback(entity_id)
+            except Exception as e:
+                logger.error(f"Ошибка в обработчике инвалидации {entity}: {e}")
+
+    def _resync(self) -> None:
+        for entity in self._subscribers:
+            self._dispatch(entity, None)
+
+    def _on_notification(self, _conn: asyncpg.Connection, _pid: int, _channel: str, payload: str) -> None:
+        try:
+            message = json.loads(payload)
+        except ValueError:
+            logger.warning(f"Некорректное уведомление инвалидации: {payload}")
+            return
+        if message.get("id") is None:
+            logger.warning(f"Уведомление инвалидации без id пропущено: {payload}")
+            return
+        self._dispatch(message.get("entity"), str(message["id"]))
+
+    async def _run(self) -> None:
+        connected_before = False
+        while True:
+            conn = None
+            try:
+                conn = await asyncpg.connect(self.dsn)
+                await conn.add_listener(CACHE_INVALIDATION_CHANNEL, self._on_notification)
+                if connected_before:
+                    logger.info("Шина инвалидации переподключена, полная ресинхронизация кэшей")
+                    self._resync()
+                connected_before = True
+
+                while not conn.is_closed():
+                    await asyncio.sleep(BUS_HEALTHCHECK_INTERVAL)
+                    await conn.fetchval("SELECT 1", timeout=BUS_HEALTHCHECK_INTERVAL)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Соединение шины инвалидации потеряно: {e}")
+            finally:
+                if conn is not None and not conn.is_closed():
+                    conn.terminate()
+            await asyncio.sleep(BUS_RECONNECT_DELAY)
+
+
+invalidation_bus = InvalidationBus()
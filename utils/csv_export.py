@@ -1,68 +1,164 @@
+import asyncio
 import csv
-
+import gzip
+import json
+import os
+import tempfile
+import time
+
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
 from io import StringIO
+from pathlib import Path
 from typing import Any
 
-from aiogram.types import BufferedInputFile
+from aiogram.types import BufferedInputFile, FSInputFile
+
+
+EXPORT_MAX_ROWS = 1_000_000
+EXPORT_CHUNK_SIZE = 1024 * 1024
+EXPORT_PROGRESS_INTERVAL = 3
+EXPORT_COMPRESS_LEVEL = 6
+
+ExportProgress = Callable[[int, int], Awaitable[None]]
+
+
+@dataclass
+class CsvExport:
+    """Сжатая выгрузка во временном файле. После отправки файл нужно удалить через cleanup()."""
+
+    path: Path
+    filename: str
+    rows: int
+    max_rows: int
 
+    @property
+    def truncated(self) -> bool:
+        """Выгрузка уперлась в лимит строк, и в запросе могли остаться невыгруженные строки."""
+        return self.rows >= self.max_rows
 
-async def export_users_csv(session: Any) -> BufferedInputFile:
+    def as_input_file(self) -> FSInputFile:
+        return FSInputFile(self.path, filename=self.filename)
+
+    def cleanup(self) -> None:
+        self.path.unlink(missing_ok=True)
+
+
+async def estimate_rows(session: Any, query: str, *args: Any) -> int:
+    """Оценивает число строк запроса по плану PostgreSQL, не выполняя сам запрос."""
+    plan = await session.fetchval(f"EXPLAIN (FORMAT JSON) {query}", *args)
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+async def stream_csv_export(
+    session: Any,
+    query: str,
+    filename: str,
+    *args: Any,
+    max_rows: int = EXPORT_MAX_ROWS,
+    progress: ExportProgress | None = None,
+) -> CsvExport:
+    """
+    Выгружает результат запроса через COPY ... TO STDOUT в gzip-файл, не держа его в памяти.
+
+    Данные приходят от PostgreSQL порциями и сжимаются в отдельном потоке блоками по
+    EXPORT_CHUNK_SIZE, поэтому память процесса не растёт вместе с таблицей, а цикл событий
+    не блокируется на сжатии. Выгрузка ограничена max_rows строками. Запрос выполняется один
+    раз: число выгруженных строк берется из ответа COPY, а для прогресса используется оценка
+    планировщика.
+
+    Args:
+        session: Соединение с базой данных
+        query: SELECT без завершающей точки с запятой
+        filename: Имя CSV-файла, к нему добавляется .gz
+        max_rows: Максимальное число строк в выгрузке
+        progress: Корутина progress(rows, estimated_rows), вызывается не чаще EXPORT_PROGRESS_INTERVAL секунд
+
+    Returns:
+        CsvExport: Временный файл выгрузки и число строк в нём
+    """
+    estimated_rows = min(await estimate_rows(session, query, *args), max_rows) if progress else 0
+
+    fd, tmp_path = tempfile.mkstemp(prefix="export_", suffix=".csv.gz")
+    path = Path(tmp_path)
+    archive = gzip.GzipFile(
+        filename=filename, mode="wb", fileobj=os.fdopen(fd, "wb"), compresslevel=EXPORT_COMPRESS_LEVEL
+    )
+    pending = bytearray(b"\xef\xbb\xbf")
+    written_lines = 0
+    last_report = time.monotonic()
+
+    async def sink(chunk: bytes) -> None:
+        nonlocal written_lines, last_report
+        pending.extend(chunk)
+        written_lines += chunk.count(b"\n")
+        if len(pending) >= EXPORT_CHUNK_SIZE:
+            data = bytes(pending)
+            pending.clear()
+            await asyncio.to_thread(archive.write, data)
+        if progress and time.monotonic() - last_report >= EXPORT_PROGRESS_INTERVAL:
+            last_report = time.monotonic()
+            rows = max(written_lines - 1, 0)
+            await progress(rows, max(estimated_rows, rows))
+
+    try:
+        status = await session.copy_from_query(
+            f"{query} LIMIT {int(max_rows)}", *args, output=sink, format="csv", header=True
+        )
+        await asyncio.to_thread(archive.write, bytes(pending))
+        await asyncio.to_thread(archive.close)
+        archive.fileobj.close()
+    except BaseException:
+        archive.fileobj.close()
+        path.unlink(missing_ok=True)
+        raise
+
+    return CsvExport(path=path, filename=f"{filename}.gz", rows=int(status.split()[-1]), max_rows=max_rows)
+
+
+async def export_users_csv(session: Any, progress: ExportProgress | None = None) -> CsvExport:
     """
     Экспорт пользователей в CSV с сортировкой от самого старого к новому.
     """
     query = """
-        SELECT 
-            u.tg_id, 
-            u.username, 
-            u.first_name, 
-            u.last_name, 
-            u.language_code, 
-            u.is_bot, 
-            c.balance, 
+        SELECT
+            u.tg_id,
+            u.username,
+            u.first_name,
+            u.last_name,
+            u.language_code,
+            u.is_bot,
+            c.balance,
             c.trial,
-            u.created_at  -- Добавляем дату регистрации
+            u.created_at
         FROM users u
         LEFT JOIN connections c ON u.tg_id = c.tg_id
-        ORDER BY u.created_at ASC  -- Сортировка от старых к новым
+        ORDER BY u.created_at ASC
     """
+    return await stream_csv_export(session, query, "users_export.csv", progress=progress)
 
-    users = await session.fetch(query)
-
-    buffer = StringIO()
-    buffer.write("tg_id,username,first_name,last_name,language_code,is_bot,balance,trial,created_at\n")
-
-    for user in users:
-        buffer.write(
-            f"{user['tg_id']},{user['username']},{user['first_name']},{user['last_name']},"
-            f"{user['language_code']},{user['is_bot']},{user['balance']},{user['trial']},"
-            f"{user['created_at']}\n"
-        )
-
-    buffer.seek(0)
-
-    return BufferedInputFile(file=buffer.getvalue().encode("utf-8-sig"), filename="users_export.csv")
 
-
-async def export_payments_csv(session: Any) -> BufferedInputFile:
+async def export_payments_csv(session: Any, progress: ExportProgress | None = None) -> CsvExport:
     """
     Экспорт платежей в CSV с сортировкой от самого старого к новому.
     """
     query = """
-        SELECT 
-            u.tg_id, 
-            u.username, 
-            u.first_name, 
-            u.last_name, 
-            p.amount, 
+        SELECT
+            u.tg_id,
+            u.username,
+            u.first_name,
+            u.last_name,
+            p.amount,
             p.payment_system,
             p.status,
-            p.created_at 
+            p.created_at
         FROM users u
         JOIN payments p ON u.tg_id = p.tg_id
-        ORDER BY p.created_at ASC  -- Сортировка по дате от старых к новым
+        ORDER BY p.created_at ASC
     """
-    payments = await session.fetch(query)
-    return _export_payments_csv(payments, "payments_export.csv")
+    return await stream_csv_export(session, query, "payments_export.csv", progress=progress)
 
 
 async def export_user_payments_csv(tg_id: int, session: Any) -> BufferedInputFile:
@@ -140,7 +236,7 @@ async def export_referrals_csv(referrer_tg_id: int, session: Any) -> BufferedInp
     return BufferedInputFile(file=csv_data, filename=filename)
 
 
-async def export_hot_leads_csv(session: Any) -> BufferedInputFile:
+async def export_hot_leads_csv(session: Any, progress: ExportProgress | None = None) -> CsvExport:
     """
     Экспорт пользователей, которые делали платежи, но сейчас не имеют ключей.
     Возвращает: tg_id, username, first_name, last_name, updated_at
@@ -154,42 +250,84 @@ async def export_hot_leads_csv(session: Any) -> BufferedInputFile:
         AND k.tg_id IS NULL
         ORDER BY u.updated_at DESC
     """
+    return await stream_csv_export(session, query, "hot_leads_export.csv", progress=progress)
 
-    users = await session.fetch(query)
-
-    buffer = StringIO()
-    buffer.write("tg_id,username,first_name,last_name,updated_at\n")
-
-    for user in users:
-        buffer.write(
-            f"{user['tg_id']},{user['username'] or ''},"
-            f"{user['first_name'] or ''},{user['last_name'] or ''},"
-            f"{user['updated_at']}\n"
-        )
-
-    buffer.seek(0)
-    return BufferedInputFile(file=buffer.getvalue().encode("utf-8-sig"), filename="hot_leads_export.csv")
 
-
-async def export_keys_csv(session) -> BufferedInputFile:
+async def export_keys_csv(session: Any, progress: ExportProgress | None = None) -> CsvExport:
     """
     Экспорт подписок в CSV.
     """
-    keys = await session.fetch("""
+    query = """
         SELECT tg_id, client_id, email, created_at, expiry_time, key, server_id, is_frozen, alias
         FROM keys
         ORDER BY created_at ASC
+    """
+    return await stream_csv_export(session, query, "keys_export.csv", progress=progress)
+
+
+async def export_coupons_csv(
+    session: Any, username_bot: str, progress: ExportProgress | None = None, batch_id: int | None = None
+) -> CsvExport:
+    """
+    Экспорт купонов со ссылками активации в CSV. Если передан batch_id — только купоны этой пачки.
+    """
+    query = """
+        SELECT code, amount, days, usage_limit, usage_count, is_used,
+               'https://t.me/' || $1 || '?start=coupons_' || code AS link
+        FROM coupons
+        WHERE $2::BIGINT IS NULL OR batch_id = $2
+        ORDER BY id
+    """
+    filename = f"coupons_batch_{batch_id}.csv" if batch_id else "coupons_export.csv"
+    return await stream_csv_export(session, query, filename, username_bot, batch_id, progress=progress)
+
+
+async def export_daily_stats_csv(session: Any) -> BufferedInputFile:
+    """
+    Экспорт дневной сводки из агрегатов статистики: регистрации, оплаты и выданные подписки.
+    """
+    rows = await session.fetch("""
+        WITH
+        payments_daily AS (
+            SELECT day, SUM(payments_count) AS payments_count, SUM(amount_sum) AS amount_sum
+            FROM payments_rollup_daily
+            GROUP BY day
+        ),
+        keys_daily AS (
+            SELECT
+                day,
+                SUM(keys_created) AS keys_created,
+                SUM(keys_created) FILTER (WHERE tariff_period = 'trial') AS trial_keys_created
+            FROM keys_rollup_daily
+            GROUP BY day
+        ),
+        days AS (
+            SELECT day FROM registrations_rollup_daily
+            UNION SELECT day FROM payments_daily
+            UNION SELECT day FROM keys_daily
+        )
+        SELECT
+            days.day,
+            COALESCE(r.registrations, 0) AS registrations,
+            COALESCE(p.payments_count, 0) AS payments_count,
+            COALESCE(p.amount_sum, 0) AS amount_sum,
+            COALESCE(k.keys_created, 0) AS keys_created,
+            COALESCE(k.trial_keys_created, 0) AS trial_keys_created
+        FROM days
+        LEFT JOIN registrations_rollup_daily r ON r.day = days.day
+        LEFT JOIN payments_daily p ON p.day = days.day
+        LEFT JOIN keys_daily k ON k.day = days.day
+        ORDER BY days.day ASC
     """)
 
     buffer = StringIO()
-    buffer.write("tg_id,client_id,email,created_at,expiry_time,key,server_id,is_frozen,alias\n")
+    buffer.write("day,registrations,payments_count,amount_sum,keys_created,trial_keys_created\n")
 
-    for row in keys:
+    for row in rows:
         buffer.write(
-            f"{row['tg_id']},{row['client_id']},{row['email']},"
-            f"{row['created_at']},{row['expiry_time']},{row['key']},"
-            f"{row['server_id']},{row['is_frozen']},{row['alias'] or ''}\n"
+            f"{row['day'].date()},{row['registrations']},{row['payments_count']},"
+            f"{row['amount_sum']},{row['keys_created']},{row['trial_keys_created']}\n"
         )
 
     buffer.seek(0)
-    return BufferedInputFile(file=buffer.getvalue().encode("utf-8-sig"), filename="keys_export.csv")
+    return BufferedInputFile(file=buffer.getvalue().encode("utf-8-sig"), filename="daily_stats_export.csv")
@@ -0,0 +1,193 @@
+import hashlib
+import re
+import sys
+import time
+
+from collections import Counter
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any
+
+import asyncpg
+
+from aiohttp import web
+
+from logger import logger
+from utils.handler_metrics import add_db_time
+
+
+SLOW_QUERY_THRESHOLD = 0.5
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+MAX_TRACKED_STATEMENTS = 500
+OTHER_STATEMENTS = "<other>"
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"(?<![\w$])\d+(?:\.\d+)?\b")
+_VALUE_LIST = re.compile(r"\((?:\s*(?:\?|\$\d+)\s*,)+\s*(?:\?|\$\d+)\s*\)")
+_REPEATED_LISTS = re.compile(r"\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+")
+
+
+@lru_cache(maxsize=4096)
+def fingerprint(query: str) -> tuple[str, str]:
+    """
+    Нормализует SQL-выражение для учета в метриках.
+
+    Литералы заменяются на `?`, списки параметров и значений сворачиваются в `(...)`, поэтому
+    запросы, собранные со значениями в тексте, попадают в одну запись.
+
+    Returns:
+        tuple[str, str]: Нормализованное выражение и его короткий идентификатор для меток Prometheus
+    """
+    statement = " ".join(query.split())
+    statement = _STRING_LITERAL.sub("?", statement)
+    statement = _NUMBER_LITERAL.sub("?", statement)
+    statement = _VALUE_LIST.sub("(...)", statement)
+    statement = _REPEATED_LISTS.sub("(...)", statement)
+    return statement, hashlib.blake2s(statement.encode(), digest_size=6).hexdigest()
+
+
+@dataclass
+class QueryStats:
+    """Накопленная статистика по одному SQL-выражению."""
+
+    calls: int = 0
+    errors: int = 0
+    rows: int = 0
+    total_time: float = 0.0
+    max_time: float = 0.0
+    buckets: list[int] = field(default_factory=lambda: [0] * len(LATENCY_BUCKETS))
+    callers: Counter = field(default_factory=Counter)
+
+    @property
+    def avg_time(self) -> float:
+        return self.total_time / self.calls if self.calls else 0.0
+
+
+class QueryMetrics:
+    """
+    Реестр статистики запросов к базе данных в пределах процесса.
+
+    Запросы учитываются по нормализованному тексту (см. fingerprint). Не больше
+    MAX_TRACKED_STATEMENTS разных выражений, остальные копятся в общей записи "<other>".
+    """
+
+    def __init__(self, slow_query_threshold: float = SLOW_QUERY_THRESHOLD) -> None:
+        self.slow_query_threshold = slow_query_threshold
+        self._stats: dict[str, QueryStats] = {}
+
+    def record(self, query: str, elapsed: float, rows: int, caller: str, args: tuple, error: bool = False) -> None:
+        statement, _ = fingerprint(query)
+        stats = self._stats.get(statement)
+        if stats is None:
+            if len(self._stats) >= MAX_TRACKED_STATEMENTS:
+                statement = OTHER_STATEMENTS
+                stats = self._stats.get(statement)
+            if stats is None:
+                stats = self._stats[statement] = QueryStats()
+
+        stats.calls += 1
+        stats.errors += int(error)
+        stats.rows += rows
+        stats.total_time += elapsed
+        stats.max_time = max(stats.max_time, elapsed)
+        stats.callers[caller] += 1
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if elapsed <= bound:
+                stats.buckets[index] += 1
+                break
+
+        if elapsed >= self.slow_query_threshold:
+            redacted = ", ".join(f"<{type(arg).__name__}>" for arg in args)
+            logger.warning(
+                f"🐢 Медленный запрос {elapsed * 1000:.0f} мс из {caller}: {statement[:500]} | параметры: ({redacted})"
+            )
+
+    def top(self, limit: int = 10, sort_by: str = "total_time") -> list[tuple[str, QueryStats]]:
+        """Возвращает самые тяжёлые выражения по выбранной метрике QueryStats."""
+        return sorted(self._stats.items(), key=lambda item: getattr(item[1], sort_by), reverse=True)[:limit]
+
+    def reset(self) -> None:
+        self._stats.clear()
+
+    def render_prometheus(self) -> str:
+        """Формирует метрики в текстовом формате Prometheus."""
+        lines = [
+            "# TYPE db_query_duration_seconds histogram",
+            "# TYPE db_query_rows_total counter",
+            "# TYPE db_query_errors_total counter",
+            "# TYPE db_query_info gauge",
+        ]
+        for statement, stats in self._stats.items():
+            label = statement if statement == OTHER_STATEMENTS else fingerprint(statement)[1]
+            text = statement[:200].replace("\\", "\\\\").replace('"', '\\"')
+            lines.append(f'db_query_info{{query="{label}",statement="{text}"}} 1')
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, stats.buckets, strict=True):
+                cumulative += count
+                lines.append(f'db_query_duration_seconds_bucket{{query="{label}",le="{bound}"}} {cumulative}')
+            lines.append(f'db_query_duration_seconds_bucket{{query="{label}",le="+Inf"}} {stats.calls}')
+            lines.append(f'db_query_duration_seconds_sum{{query="{label}"}} {stats.total_time}')
+            lines.append(f'db_query_duration_seconds_count{{query="{label}"}} {stats.calls}')
+            lines.append(f'db_query_rows_total{{query="{label}"}} {stats.rows}')
+            lines.append(f'db_query_errors_total{{query="{label}"}} {stats.errors}')
+        return "\n".join(lines) + "\n"
+
+
+query_metrics = QueryMetrics()
+
+
+def _count_rows(result: object) -> int:
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, str):
+        count = result.rsplit(" ", 1)[-1]
+        return int(count) if count.isdigit() else 0
+    return int(result is not None)
+
+
+class InstrumentedConnection(asyncpg.Connection):
+    """
+    Соединение asyncpg, замеряющее каждый запрос.
+
+    Подключается через `connection_class` в asyncpg.connect/asyncpg.create_pool. Для каждого
+    выражения копится гистограмма задержек, число строк и вызывающие функции в query_metrics.
+    """
+
+    async def _instrumented(self, method: Callable, query: str, args: tuple, **kwargs: Any) -> Any:
+        frame = sys._getframe(2)
+        while frame.f_back is not None and frame.f_globals.get("__name__", "").startswith("asyncpg"):
+            frame = frame.f_back
+        caller = f"{frame.f_globals.get('__name__', '?')}.{frame.f_code.co_name}"
+        started = time.perf_counter()
+        try:
+            result = await method(query, *args, **kwargs)
+        except Exception:
+            elapsed = time.perf_counter() - started
+            add_db_time(elapsed)
+            query_metrics.record(query, elapsed, 0, caller, args, error=True)
+            raise
+        elapsed = time.perf_counter() - started
+        add_db_time(elapsed)
+        query_metrics.record(query, elapsed, _count_rows(result), caller, args)
+        return result
+
+    async def execute(self, query: str, *args: Any, timeout: float | None = None) -> str:  # noqa: ASYNC109
+        return await self._instrumented(super().execute, query, args, timeout=timeout)
+
+    async def executemany(self, command: str, args: Any, *, timeout: float | None = None):  # noqa: ASYNC109
+        return await self._instrumented(super().executemany, command, (args,), timeout=timeout)
+
+    async def fetch(self, query: str, *args: Any, timeout: float | None = None, record_class=None) -> list:  # noqa: ASYNC109
+        return await self._instrumented(super().fetch, query, args, timeout=timeout, record_class=record_class)
+
+    async def fetchval(self, query: str, *args: Any, column: int = 0, timeout: float | None = None):  # noqa: ASYNC109
+        return await self._instrumented(super().fetchval, query, args, column=column, timeout=timeout)
+
+    async def fetchrow(self, query: str, *args: Any, timeout: float | None = None, record_class=None):  # noqa: ASYNC109
+        return await self._instrumented(super().fetchrow, query, args, timeout=timeout, record_class=record_class)
+
+
+async def handle_db_metrics(request: web.Request) -> web.Response:
+    """aiohttp-обработчик, отдающий статистику запросов в формате Prometheus."""
+    return web.Response(text=query_metrics.render_prometheus(), content_type="text/plain")
@@ -0,0 +1,127 @@
+import asyncio
+import hashlib
+import html
+import time
+import traceback
+
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from logger import logger
+
+
+ERROR_WINDOW = 600
+ERROR_DIGEST_INTERVAL = 300
+ERROR_SAMPLE_UPDATES = 5
+ERROR_DIGEST_LIMIT = 20
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+
+@dataclass
+class ErrorGroup:
+    """Повторы одной ошибки с момента последнего дайджеста."""
+
+    title: str
+    location: str
+    count: int = 0
+    update_ids: list[int] = field(default_factory=list)
+
+
+def fingerprint(exception: BaseException) -> tuple[str, str]:
+    """
+    Отпечаток исключения: тип и место возникновения в коде проекта.
+
+    Берется самый глубокий кадр трассировки из файлов проекта, а не из библиотек, поэтому
+    одна и та же ошибка asyncpg или aiohttp в разных хендлерах дает разные отпечатки.
+
+    Returns:
+        tuple[str, str]: Короткий хэш отпечатка и место в виде path:line in function
+    """
+    location = "?"
+    for frame in reversed(traceback.extract_tb(exception.__traceback__)):
+        path = Path(frame.filename).resolve()
+        if path.is_relative_to(PROJECT_ROOT) and ".venv" not in path.parts and "site-packages" not in path.parts:
+            location = f"{path.relative_to(PROJECT_ROOT)}:{frame.lineno} in {frame.name}"
+            break
+
+    key = f"{type(exception).__module__}.{type(exception).__qualname__}@{location}"
+    return hashlib.blake2b(key.encode(), digest_size=4).hexdigest(), location
+
+
+class ErrorDigest:
+    """
+    Дедупликация ошибок для уведомлений администраторов.
+
+    О новой ошибке (отпечаток не встречался ERROR_WINDOW секунд) администраторы узнают сразу
+    с полной трассировкой. Повторы только подсчитываются и раз в ERROR_DIGEST_INTERVAL
+    уходят одним сообщением с числом повторов и примерами update_id.
+    """
+
+    def __init__(self) -> None:
+        self._last_reported: dict[str, float] = {}
+        self._pending: dict[str, ErrorGroup] = {}
+        self._flush_task: asyncio.Task | None = None
+
+    def record(self, exception: BaseException, update_id: int | None) -> tuple[str, bool]:
+        """
+        Учитывает ошибку.
+
+        Returns:
+            tuple[str, bool]: Отпечаток и признак того, что ошибку нужно отправить администраторам сразу
+        """
+        key, location = fingerprint(exception)
+        now = time.monotonic()
+
+        if now - self._last_reported.get(key, float("-inf")) >= ERROR_WINDOW:
+            self._last_reported[key] = now
+            return key, True
+
+        group = self._pending.get(key)
+        if group is None:
+            title = f"{type(exception).__name__}: {str(exception)[:200]}"
+            group = self._pending[key] = ErrorGroup(title=title, location=location)
+        group.count += 1
+        if update_id is not None and len(group.update_ids) < ERROR_SAMPLE_UPDATES:
+            group.update_ids.append(update_id)
+        return key, False
+
+    def schedule_flush(self, send: Callable[[str], Awaitable[None]]) -> None:
+        """Планирует отправку дайджеста через ERROR_DIGEST_INTERVAL, если она еще не запланирована."""
+        if self._pending and (self._flush_task is None or self._flush_task.done()):
+            self._flush_task = asyncio.create_task(self._flush_later(send))
+
+    def render(self) -> str | None:
+        """Формирует дайджест накопленных повторов и очищает их."""
+        if not self._pending:
+            return None
+
+        groups = sorted(self._pending.items(), key=lambda item: item[1].count, reverse=True)
+        self._pending = {}
+        total = sum(group.count for _, group in groups)
+
+        lines = [f"🧯 <b>Повторяющиеся ошибки</b> за {ERROR_DIGEST_INTERVAL // 60} мин: {total}\n"]
+        for key, group in groups[:ERROR_DIGEST_LIMIT]:
+            samples = ", ".join(str(update_id) for update_id in group.update_ids) or "—"
+            lines.append(
+                f"<b>×{group.count}</b> <code>{key}</code> {html.escape(group.title)}\n"
+                f"📍 {html.escape(group.location)}\n"
+                f"🔎 update_id: {samples}\n"
+            )
+        if len(groups) > ERROR_DIGEST_LIMIT:
+            lines.append(f"… и еще {len(groups) - ERROR_DIGEST_LIMIT} видов ошибок")
+        return "\n".join(lines)
+
+    async def _flush_later(self, send: Callable[[str], Awaitable[None]]) -> None:
+        await asyncio.sleep(ERROR_DIGEST_INTERVAL)
+        text = self.render()
+        if not text:
+            return
+        try:
+            await send(text)
+        except Exception as e:
+            logger.error(f"Не удалось отправить дайджест ошибок: {e}")
+
+
+error_digest = ErrorDigest()
@@ -0,0 +1,156 @@
+import asyncio
+import json
+import time
+
+from collections.abc import Awaitable, Callable
+
+import aiohttp
+
+from logger import logger
+
+
+FX_RATES_URL = "https://www.cbr-xml-daily.ru/daily_json.js"
+FX_RATE_TTL = 3600
+FX_REFRESH_INTERVAL = 600
+FX_FETCH_TIMEOUT = 5
+FX_DEFAULT_RATES = {"USD": 100.0}
+
+FxSource = Callable[[], Awaitable[dict[str, float]]]
+
+
+async def fetch_cbr_rates() -> dict[str, float]:
+    """
+    Загружает курсы ЦБ РФ к рублю.
+
+    Returns:
+        dict[str, float]: Курс за одну единицу валюты по её коду, например {"USD": 92.5}
+    """
+    timeout = aiohttp.ClientTimeout(total=FX_FETCH_TIMEOUT)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        async with session.get(FX_RATES_URL) as response:
+            response.raise_for_status()
+            data = json.loads(await response.text())
+    return {code: float(item["Value"]) / float(item["Nominal"]) for code, item in data["Valute"].items()}
+
+
+class FxRateCache:
+    """
+    Кэш курсов валют для платежных сценариев.
+
+    Курсы читаются из памяти, поэтому расчет суммы в клавиатуре оплаты не ждет внешний
+    сервис. Чтение, заставшее курсы старше refresh_interval, запускает обновление в фоне;
+    после неудачного обновления следующая попытка будет не раньше чем через refresh_interval.
+    Если обновление не удалось, отдается последний успешно полученный курс, а возраст курса
+    виден в метриках. Только первое чтение после старта ждет источник; пока курсов нет
+    совсем, используется FX_DEFAULT_RATES. Источник и часы передаются в конструктор, поэтому
+    кэш проверяется без сети подставным источником.
+    """
+
+    def __init__(
+        self,
+        source: FxSource = fetch_cbr_rates,
+        ttl: float = FX_RATE_TTL,
+        defaults: dict[str, float] | None = None,
+        clock: Callable[[], float] = time.monotonic,
+        refresh_interval: float = FX_REFRESH_INTERVAL,
+    ) -> None:
+        self.source = source
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval
+        self.defaults = FX_DEFAULT_RATES if defaults is None else defaults
+        self.clock = clock
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self.fallbacks = 0
+        self._rates: dict[str, float] = {}
+        self._updated_at: float | None = None
+        self._attempted_at: float | None = None
+        self._lock = asyncio.Lock()
+        self._refresh_task: asyncio.Task | None = None
+
+    def age(self) -> float | None:
+        """Возраст курсов в секундах или None, если курсы еще не получены."""
+        return None if self._updated_at is None else self.clock() - self._updated_at
+
+    def is_stale(self) -> bool:
+        age = self.age()
+        return age is None or age > self.ttl
+
+    async def refresh(self) -> bool:
+        """
+        Запрашивает курсы у источника. При ошибке сохраняет прежние курсы.
+
+        Returns:
+            bool: True, если курсы обновлены
+        """
+        async with self._lock:
+            return await self._refresh_locked()
+
+    def _refresh_due(self) -> bool:
+        return self._attempted_at is None or self.clock() - self._attempted_at >= self.refresh_interval
+
+    async def _refresh_locked(self) -> bool:
+        self._attempted_at = self.clock()
+        try:
+            rates = await self.source()
+        except Exception as e:
+            self.refresh_errors += 1
+            logger.warning(f"[FX] Не удалось обновить курсы валют: {e}")
+            return False
+        if not rates:
+            self.refresh_errors += 1
+            logger.warning("[FX] Источник вернул пустой список курсов")
+            return False
+
+        self._rates = dict(rates)
+        self._updated_at = self.clock()
+        self.refreshes += 1
+        return True
+
+    async def get(self, currency: str = "USD") -> float:
+        """
+        Возвращает курс валюты к рублю.
+
+        Args:
+            currency: Код валюты, например "USD"
+
+        Returns:
+            float: Курс за одну единицу валюты
+        """
+        if self._attempted_at is None:
+            async with self._lock:
+                if self._attempted_at is None:
+                    await self._refresh_locked()
+        elif self._refresh_due() and (self._refresh_task is None or self._refresh_task.done()):
+            self._refresh_task = asyncio.create_task(self.refresh())
+
+        rate = self._rates.get(currency)
+        if rate is None:
+            self.fallbacks += 1
+            rate = self.defaults[currency]
+            logger.warning(f"[FX] Курс {currency} недоступен, используется значение по умолчанию {rate}")
+        return rate
+
+    def render_prometheus(self) -> str:
+        """Формирует метрики в текстовом формате Prometheus."""
+        age = self.age()
+        lines = [
+            "# TYPE fx_rate gauge",
+            "# TYPE fx_rate_age_seconds gauge",
+            "# TYPE fx_rate_stale gauge",
+            "# TYPE fx_rate_refresh_total counter",
+            "# TYPE fx_rate_refresh_errors_total counter",
+            "# TYPE fx_rate_fallback_total counter",
+        ]
+        for currency in self.defaults:
+            if currency in self._rates:
+                lines.append(f'fx_rate{{currency="{currency}"}} {self._rates[currency]}')
+        lines.append(f"fx_rate_age_seconds {-1 if age is None else round(age, 3)}")
+        lines.append(f"fx_rate_stale {int(self.is_stale())}")
+        lines.append(f"fx_rate_refresh_total {self.refreshes}")
+        lines.append(f"fx_rate_refresh_errors_total {self.refresh_errors}")
+        lines.append(f"fx_rate_fallback_total {self.fallbacks}")
+        return "\n".join(lines) + "\n"
+
+
+fx_rates = FxRateCache()
@@ -0,0 +1,158 @@
+import functools
+import time
+
+from collections.abc import Awaitable, Callable
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+
+HANDLER_LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+@dataclass
+class RequestTimings:
+    """Время, потраченное текущим апдейтом на базу данных и панели 3x-ui."""
+
+    db_time: float = 0.0
+    panel_time: float = 0.0
+    panel_depth: int = 0
+
+
+_request_timings: ContextVar[RequestTimings | None] = ContextVar("request_timings", default=None)
+
+
+def begin_request() -> RequestTimings:
+    """Начинает учет времени для апдейта в текущем контексте."""
+    timings = RequestTimings()
+    _request_timings.set(timings)
+    return timings
+
+
+def add_db_time(elapsed: float) -> None:
+    """Учитывает время запроса к БД. Запросы внутри операций с панелью относятся ко времени панели."""
+    timings = _request_timings.get()
+    if timings is not None and timings.panel_depth == 0:
+        timings.db_time += elapsed
+
+
+def track_panel_time[**P, R](func: Callable[P, Awaitable[R]]) -> Callable[P, Awaitable[R]]:
+    """Декоратор операций с панелями 3x-ui: время вложенных вызовов учитывается один раз."""
+
+    @functools.wraps(func)
+    async def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
+        timings = _request_timings.get()
+        if timings is None:
+            return await func(*args, **kwargs)
+
+        timings.panel_depth += 1
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            timings.panel_depth -= 1
+            if timings.panel_depth == 0:
+                timings.panel_time += time.perf_counter() - started
+
+    return wrapper
+
+
+@dataclass
+class HandlerStats:
+    """Накопленная статистика по одному обработчику или префиксу callback_data."""
+
+    calls: int = 0
+    errors: int = 0
+    in_flight: int = 0
+    total_time: float = 0.0
+    max_time: float = 0.0
+    db_time: float = 0.0
+    panel_time: float = 0.0
+    buckets: list[int] = field(default_factory=lambda: [0] * len(HANDLER_LATENCY_BUCKETS))
+
+    @property
+    def avg_time(self) -> float:
+        return self.total_time / self.calls if self.calls else 0.0
+
+    def quantile(self, q: float) -> float:
+        """Оценка квантиля задержки по верхней границе корзины гистограммы."""
+        target = q * self.calls
+        cumulative = 0
+        for bound, count in zip(HANDLER_LATENCY_BUCKETS, self.buckets, strict=True):
+            cumulative += count
+            if cumulative >= target:
+                return bound
+        return self.max_time
+
+
+class HandlerMetrics:
+    """Реестр задержек обработчиков апдейтов в пределах процесса."""
+
+    def __init__(self) -> None:
+        self._stats: dict[str, HandlerStats] = {}
+
+    def get(self, name: str) -> HandlerStats:
+        stats = self._stats.get(name)
+        if stats is None:
+            stats = self._stats[name] = HandlerStats()
+        return stats
+
+    def record(self, names: list[str], elapsed: float, timings: RequestTimings, error: bool) -> None:
+        for name in names:
+            stats = self.get(name)
+            stats.calls += 1
+            stats.errors += int(error)
+            stats.total_time += elapsed
+            stats.max_time = max(stats.max_time, elapsed)
+            stats.db_time += timings.db_time
+            stats.panel_time += timings.panel_time
+            for index, bound in enumerate(HANDLER_LATENCY_BUCKETS):
+                if elapsed <= bound:
+                    stats.buckets[index] += 1
+                    break
+
+    def top(
+        self, limit: int = 10, sort_by: str = "total_time", kind: str | None = None
+    ) -> list[tuple[str, HandlerStats]]:
+        """
+        Возвращает самые тяжелые записи по выбранной метрике HandlerStats.
+
+        kind выбирает обработчики ("handler"), префиксы callback_data ("callback")
+        или фоновые операции ("background").
+        """
+        items = [item for item in self._stats.items() if kind is None or item[0].startswith(f"{kind}:")]
+        return sorted(items, key=lambda item: getattr(item[1], sort_by), reverse=True)[:limit]
+
+    def reset(self) -> None:
+        for name, stats in list(self._stats.items()):
+            if stats.in_flight:
+                self._stats[name] = HandlerStats(in_flight=stats.in_flight)
+            else:
+                del self._stats[name]
+
+    def render_prometheus(self) -> str:
+        """Формирует метрики в текстовом формате Prometheus."""
+        lines = [
+            "# TYPE handler_duration_seconds histogram",
+            "# TYPE handler_errors_total counter",
+            "# TYPE handler_in_flight gauge",
+            "# TYPE handler_db_seconds_total counter",
+            "# TYPE handler_panel_seconds_total counter",
+        ]
+        for name, stats in self._stats.items():
+            kind, _, target = name.partition(":")
+            label = f'kind="{kind}",name="{target.replace(chr(34), chr(39))}"'
+            cumulative = 0
+            for bound, count in zip(HANDLER_LATENCY_BUCKETS, stats.buckets, strict=True):
+                cumulative += count
+                lines.append(f'handler_duration_seconds_bucket{{{label},le="{bound}"}} {cumulative}')
+            lines.append(f'handler_duration_seconds_bucket{{{label},le="+Inf"}} {stats.calls}')
+            lines.append(f"handler_duration_seconds_sum{{{label}}} {stats.total_time}")
+            lines.append(f"handler_duration_seconds_count{{{label}}} {stats.calls}")
+            lines.append(f"handler_errors_total{{{label}}} {stats.errors}")
+            lines.append(f"handler_in_flight{{{label}}} {stats.in_flight}")
+            lines.append(f"handler_db_seconds_total{{{label}}} {stats.db_time}")
+            lines.append(f"handler_panel_seconds_total{{{label}}} {stats.panel_time}")
+        return "\n".join(lines) + "\n"
+
+
+handler_metrics = HandlerMetrics()
@@ -0,0 +1,133 @@
+import asyncio
+import hashlib
+
+from collections import deque
+from typing import Any
+
+from config import API_TOKEN
+from logger import logger
+
+
+KEY_NAME_LENGTH = 7
+KEY_NAME_BATCH = 64
+KEY_NAME_ROUNDS = 4
+
+_ALPHABET = "0123456789abcdefghijklmnopqrstuvwxyz"
+_DOMAIN = len(_ALPHABET) ** KEY_NAME_LENGTH
+_HALF_BITS = ((_DOMAIN - 1).bit_length() + 1) // 2
+_HALF_MASK = (1 << _HALF_BITS) - 1
+
+
+def _round_value(secret: bytes, round_index: int, value: int) -> int:
+    digest = hashlib.blake2b(
+        value.to_bytes(8, "big"), key=secret, person=round_index.to_bytes(16, "big"), digest_size=8
+    ).digest()
+    return int.from_bytes(digest, "big") & _HALF_MASK
+
+
+def permute(number: int, secret: bytes) -> int:
+    """
+    Взаимно однозначно отображает номер из [0, 36^KEY_NAME_LENGTH) в то же множество.
+
+    Сбалансированная сеть Фейстеля на 2 * _HALF_BITS битах с ключевой раундовой функцией
+    и cycle-walking: значения вне домена прогоняются повторно, пока не попадут в него.
+
+    Args:
+        number: Номер из последовательности
+        secret: Ключ перестановки
+
+    Returns:
+        int: Переставленный номер
+    """
+    if not 0 <= number < _DOMAIN:
+        raise ValueError(f"Номер {number} вне пространства имён ключей")
+    value = number
+    while True:
+        left, right = value >> _HALF_BITS, value & _HALF_MASK
+        for round_index in range(KEY_NAME_ROUNDS):
+            left, right = right, left ^ _round_value(secret, round_index, right)
+        value = (left << _HALF_BITS) | right
+        if value < _DOMAIN:
+            return value
+
+
+def encode_base36(value: int, length: int = KEY_NAME_LENGTH) -> str:
+    """Кодирует число в base36 фиксированной длины."""
+    chars = []
+    for _ in range(length):
+        value, digit = divmod(value, len(_ALPHABET))
+        chars.append(_ALPHABET[digit])
+    return "".join(reversed(chars))
+
+
+def key_name_for(number: int, secret: bytes) -> str:
+    """Возвращает имя ключа для номера последовательности key_name_seq."""
+    return encode_base36(permute(number % _DOMAIN, secret))
+
+
+class KeyNameAllocator:
+    """
+    Выдаёт имена ключей без коллизий и без проверочных запросов на каждое имя.
+
+    Номера берутся из последовательности key_name_seq пачками по KEY_NAME_BATCH, поэтому
+    процессы и реплики получают непересекающиеся диапазоны. Номер проходит через ключевую
+    перестановку и кодируется в base36 длиной KEY_NAME_LENGTH: имена не идут подряд, и по
+    одному имени нельзя угадать соседние. Старые случайные имена короче, поэтому с новыми
+    не совпадают. Уникальность дополнительно гарантирует индекс idx_keys_email_unique.
+    Номера пачки, не выданные до перезапуска, просто пропускаются.
+    """
+
+    def __init__(self, secret: str = API_TOKEN, batch_size: int = KEY_NAME_BATCH) -> None:
+        self.secret = hashlib.blake2b(secret.encode(), person=b"key_names", digest_size=32).digest()
+        self.batch_size = batch_size
+        self._pool: deque[str] = deque()
+        self._lock = asyncio.Lock()
+
+    async def allocate(self, session: Any) -> str:
+        """
+        Выдаёт следующее имя ключа.
+
+        Args:
+            session: Соединение или пул asyncpg
+
+        Returns:
+            str: Новое имя ключа
+        """
+        if not self._pool:
+            async with self._lock:
+                if not self._pool:
+                    await self._refill(session, self.batch_size)
+        return self._pool.popleft()
+
+    async def allocate_many(self, session: Any, count: int) -> list[str]:
+        """
+        Выдаёт сразу несколько имён, например для массовой выдачи пробных ключей.
+
+        Args:
+            session: Соединение или пул asyncpg
+            count: Количество имён
+
+        Returns:
+            list[str]: Новые имена ключей
+        """
+        async with self._lock:
+            if len(self._pool) < count:
+                await self._refill(session, count - len(self._pool) + self.batch_size)
+            return [self._pool.popleft() for _ in range(count)]
+
+    async def _refill(self, session: Any, count: int) -> None:
+        numbers = await session.fetch("SELECT nextval('key_name_seq') AS n FROM generate_series(1, $1)", count)
+        names = [key_name_for(row["n"], self.secret) for row in numbers]
+
+        # После смены ключа перестановки новые имена могут совпасть с уже выданными
+        taken = await session.fetch("SELECT email FROM keys WHERE email = ANY($1::text[])", names)
+        if taken:
+            taken_names = {row["email"] for row in taken}
+            logger.warning(f"[Key Names] Пропущено {len(taken_names)} уже занятых имён ключей")
+            names = [name for name in names if name not in taken_names]
+        self._pool.extend(names)
+        if len(names) < count:
+            await self._refill(session, count - len(names))
+
+
+key_name_allocator = KeyNameAllocator()
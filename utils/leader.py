@@ -0,0 +1,121 @@
+import asyncio
+import hashlib
+
+import asyncpg
+
+from config import DATABASE_URL
+from logger import logger
+
+
+LEASE_CHECK_INTERVAL = 5
+LEASE_HEARTBEAT_TIMEOUT = 3
+
+
+def lease_key(name: str) -> int:
+    """Стабильный между процессами ключ advisory lock для имени задачи."""
+    return int.from_bytes(hashlib.blake2b(name.encode(), digest_size=8).digest(), "big", signed=True)
+
+
+class LeaderElection:
+    """
+    Выбор лидера для фоновых задач между репликами бота на advisory lock'ах PostgreSQL.
+
+    Каждая реплика держит одно выделенное соединение и пытается взять сессионный
+    `pg_try_advisory_lock` на каждую зарегистрированную задачу. Задачу выполняет только
+    держатель блокировки. Если лидер падает, соединение рвётся, PostgreSQL снимает
+    блокировку, и другая реплика забирает её в течение LEASE_CHECK_INTERVAL секунд.
+
+    Соединение должно идти напрямую в PostgreSQL или через pgbouncer в session-режиме:
+    в transaction-режиме сессионные блокировки не работают.
+    """
+
+    def __init__(self, dsn: str = DATABASE_URL, check_interval: float = LEASE_CHECK_INTERVAL) -> None:
+        self.dsn = dsn
+        self.check_interval = check_interval
+        self._conn: asyncpg.Connection | None = None
+        self._leases: dict[str, asyncio.Event] = {}
+        self._task: asyncio.Task | None = None
+        self._lock = asyncio.Lock()
+
+    def is_leader(self, name: str) -> bool:
+        """Возвращает True, если эта реплика сейчас держит блокировку задачи."""
+        event = self._leases.get(name)
+        return event is not None and event.is_set()
+
+    async def wait_for_leadership(self, name: str) -> None:
+        """
+        Ожидает, пока эта реплика не станет лидером для задачи.
+
+        Лидер возвращается сразу, остальные реплики блокируются до освобождения
+        блокировки текущим лидером.
+        """
+        if name not in self._leases:
+            self._leases[name] = asyncio.Event()
+            await self._refresh()
+            if self._task is None or self._task.done():
+                self._task = asyncio.create_task(self._maintain())
+        await self._leases[name].wait()
+
+    async def stop(self) -> None:
+        """Останавливает обслуживание блокировок и освобождает их."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._drop_leadership()
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
+
+    async def _maintain(self) -> None:
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                await self._refresh()
+            except Exception as e:
+                logger.error(f"Ошибка при обслуживании блокировок лидера: {e}")
+
+    async def _refresh(self) -> None:
+        async with self._lock:
+            if self._conn is not None and not self._conn.is_closed():
+                try:
+                    await self._conn.fetchval("SELECT 1", timeout=LEASE_HEARTBEAT_TIMEOUT)
+                except Exception as e:
+                    logger.warning(f"Соединение лидера потеряно: {e}")
+                    self._conn.terminate()
+                    self._conn = None
+            else:
+                self._conn = None
+
+            if self._conn is None:
+                self._drop_leadership()
+                try:
+                    self._conn = await asyncpg.connect(self.dsn)
+                except Exception as e:
+                    logger.error(f"Не удалось подключиться к базе данных для выбора лидера: {e}")
+                    return
+
+            for name, event in self._leases.items():
+                if event.is_set():
+                    continue
+                try:
+                    acquired = await self._conn.fetchval(
+                        "SELECT pg_try_advisory_lock($1)", lease_key(name), timeout=LEASE_HEARTBEAT_TIMEOUT
+                    )
+                except Exception as e:
+                    logger.warning(f"Не удалось взять блокировку задачи {name}: {e}")
+                    self._conn.terminate()
+                    self._conn = None
+                    self._drop_leadership()
+                    return
+                if acquired:
+                    event.set()
+                    logger.info(f"👑 Реплика стала лидером для задачи {name}")
+
+    def _drop_leadership(self) -> None:
+        for name, event in self._leases.items():
+            if event.is_set():
+                event.clear()
+                logger.warning(f"Реплика потеряла лидерство для задачи {name}")
+
+
+leader_election = LeaderElection()
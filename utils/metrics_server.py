@@ -0,0 +1,65 @@
+from aiohttp import web
+
+from logger import logger
+from utils.db_metrics import query_metrics
+from utils.fx_rates import fx_rates
+from utils.handler_metrics import handler_metrics
+from utils.rate_governor import rate_governor
+
+
+METRICS_PATH = "/metrics"
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9108
+
+_runner: web.AppRunner | None = None
+_start_attempted = False
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    """aiohttp-обработчик, отдающий все метрики процесса в формате Prometheus."""
+    body = (
+        handler_metrics.render_prometheus()
+        + query_metrics.render_prometheus()
+        + rate_governor.render_prometheus()
+        + fx_rates.render_prometheus()
+    )
+    return web.Response(text=body, content_type="text/plain")
+
+
+def setup_metrics_routes(app: web.Application, path: str = METRICS_PATH) -> None:
+    """Добавляет эндпоинт метрик в существующее aiohttp-приложение (например, рядом с webhook)."""
+    app.router.add_get(path, handle_metrics)
+
+
+async def start_metrics_server(host: str = METRICS_HOST, port: int = METRICS_PORT) -> web.AppRunner:
+    """
+    Запускает отдельный локальный HTTP-сервер метрик процесса.
+
+    По умолчанию слушает только 127.0.0.1, чтобы метрики не были доступны снаружи.
+    """
+    global _runner
+    app = web.Application()
+    setup_metrics_routes(app)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"📈 Метрики доступны на http://{host}:{port}{METRICS_PATH}")
+    _runner = runner
+    return runner
+
+
+async def ensure_metrics_server() -> None:
+    """
+    Запускает сервер метрик на METRICS_PORT, если процесс еще не запустил его сам.
+
+    Вызывается из MetricsMiddleware на первом апдейте, поэтому метрики доступны и в режиме
+    polling. Если порт занят, запуск не повторяется.
+    """
+    global _start_attempted
+    if _runner is not None or _start_attempted:
+        return
+    _start_attempted = True
+    try:
+        await start_metrics_server()
+    except OSError as e:
+        logger.warning(f"Не удалось запустить сервер метрик на порту {METRICS_PORT}: {e}")
@@ -0,0 +1,259 @@
+"""
+Обслуживание месячных секций таблицы payments.
+
+Секции на ближайшие PAYMENTS_PARTITIONS_AHEAD месяцев создаются при старте (init_db) и при
+записи платежа в новом месяце (add_payment), поэтому новые платежи не попадают в
+payments_default. Если задан PAYMENTS_RETENTION_MONTHS, команда обслуживания отсоединяет
+секции старше этого срока и переносит их в схему payments_archive: история пользователя и
+выгрузки перестают их читать, а данные остаются доступны для ручных отчетов. Секция
+отсоединяется только после того, как агрегатор статистики (utils/stats_rollups.py) обработал
+ее месяц, поэтому выручка на дашборде не меняется.
+
+Обслуживание запускается автоматически при старте и в начале каждого месяца
+(ensure_payments_maintenance) и выполняется одной репликой под advisory lock.
+
+Перенос существующих платежей в секционированную таблицу (миграция 0012) выполняется
+отдельно, пачками по PAYMENTS_MIGRATION_BATCH строк в своих транзакциях. В конце таблицы
+меняются местами в одной короткой транзакции. Команду можно прервать и запустить повторно.
+
+Использование:
+    python -m utils.payments_partitions migrate
+    python -m utils.payments_partitions maintain
+"""
+
+import asyncio
+import re
+import sys
+
+from datetime import datetime
+
+import asyncpg
+import pytz
+
+from config import DATABASE_URL
+from logger import logger
+from utils.db_metrics import InstrumentedConnection
+from utils.leader import lease_key
+
+
+PAYMENTS_PARTITIONS_AHEAD = 3
+PAYMENTS_RETENTION_MONTHS = 0
+PAYMENTS_PARTITIONS_LOCK_TIMEOUT = "5s"
+PAYMENTS_ARCHIVE_SCHEMA = "payments_archive"
+PAYMENTS_MIGRATION_BATCH = 50_000
+
+_PARTITION_NAME = re.compile(r"^payments_p(\d{4})_(\d{2})$")
+
+_maintenance_task: asyncio.Task | None = None
+
+
+def _add_months(moment: datetime, months: int) -> datetime:
+    index = moment.year * 12 + moment.month - 1 + months
+    return moment.replace(year=index // 12, month=index % 12 + 1, day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+async def ensure_payments_partitions(conn: asyncpg.Connection, months_ahead: int = PAYMENTS_PARTITIONS_AHEAD) -> None:
+    """
+    Создает недостающие секции payments с текущего месяца на `months_ahead` месяцев вперед.
+
+    Args:
+        conn: Соединение с базой данных
+        months_ahead: Сколько будущих месяцев должно иметь готовую секцию
+    """
+    async with conn.transaction():
+        await conn.execute(f"SET LOCAL lock_timeout = '{PAYMENTS_PARTITIONS_LOCK_TIMEOUT}'")
+        await conn.execute(
+            """
+            SELECT ensure_payments_partition(months.target)
+            FROM generate_series(
+                date_trunc('month', CURRENT_TIMESTAMP),
+                CURRENT_TIMESTAMP + make_interval(months => $1),
+                INTERVAL '1 month'
+            ) AS months (target)
+            """,
+            months_ahead,
+        )
+
+
+async def migrate_payments(conn: asyncpg.Connection, batch_size: int = PAYMENTS_MIGRATION_BATCH) -> None:
+    """
+    Переносит платежи в payments_partitioned и делает ее таблицей payments.
+
+    Новые и удаленные платежи во время переноса отражает триггер trg_payments_mirror, поэтому
+    бот может работать. Каждая пачка коммитится отдельно вместе с позицией в
+    payments_migration_progress, поэтому повторный запуск продолжает с последнего перенесенного id.
+
+    Args:
+        conn: Соединение с базой данных
+        batch_size: Количество строк в одной пачке
+    """
+    if await conn.fetchval("SELECT to_regclass('payments_partitioned')") is None:
+        logger.info("[Payments] Таблица payments уже секционирована")
+        return
+
+    await conn.execute(
+        """
+        SELECT ensure_payments_partition(months.target)
+        FROM generate_series(
+            date_trunc('month', COALESCE((SELECT MIN(created_at) FROM payments), CURRENT_TIMESTAMP)),
+            CURRENT_TIMESTAMP,
+            INTERVAL '1 month'
+        ) AS months (target)
+        """
+    )
+
+    last_id = await conn.fetchval("SELECT last_id FROM payments_migration_progress")
+    moved_total = 0
+    while True:
+        async with conn.transaction():
+            moved, batch_last_id = await conn.fetchrow(
+                """
+                WITH batch AS (
+                    SELECT id, tg_id, amount, payment_system, status,
+                           COALESCE(created_at, CURRENT_TIMESTAMP) AS created_at
+                    FROM payments
+                    WHERE id > $1
+                    ORDER BY id
+                    LIMIT $2
+                ), moved AS (
+                    INSERT INTO payments_partitioned (id, tg_id, amount, payment_system, status, created_at)
+                    SELECT * FROM batch
+                    ON CONFLICT DO NOTHING
+                )
+                SELECT COUNT(*), MAX(id) FROM batch
+                """,
+                last_id,
+                batch_size,
+            )
+            if not moved:
+                break
+            await conn.execute("UPDATE payments_migration_progress SET last_id = $1", batch_last_id)
+        last_id = batch_last_id
+        moved_total += moved
+        logger.info(f"[Payments] Перенесено платежей: {moved_total}, последний id {last_id}")
+
+    async with conn.transaction():
+        await conn.execute(f"SET LOCAL lock_timeout = '{PAYMENTS_PARTITIONS_LOCK_TIMEOUT}'")
+        await conn.execute("LOCK TABLE payments IN ACCESS EXCLUSIVE MODE")
+        await conn.execute(
+            """
+            INSERT INTO payments_partitioned (id, tg_id, amount, payment_system, status, created_at)
+            SELECT id, tg_id, amount, payment_system, status, COALESCE(created_at, CURRENT_TIMESTAMP)
+            FROM payments
+            WHERE id > $1
+            ON CONFLICT DO NOTHING
+            """,
+            last_id,
+        )
+        await conn.execute("DROP TRIGGER trg_payments_mirror ON payments")
+        await conn.execute("DROP FUNCTION mirror_payments_to_partitioned()")
+        await conn.execute("ALTER TABLE payments ALTER COLUMN id DROP DEFAULT")
+        await conn.execute("ALTER SEQUENCE payments_id_seq OWNED BY payments_partitioned.id")
+        await conn.execute("DROP TABLE payments")
+        await conn.execute("DROP TABLE payments_migration_progress")
+        await conn.execute("ALTER TABLE payments_partitioned RENAME TO payments")
+        await conn.execute(
+            "ALTER INDEX idx_payments_partitioned_tg_id_created_at RENAME TO idx_payments_tg_id_created_at"
+        )
+    logger.info(f"[Payments] Таблица payments секционирована, перенесено строк: {moved_total}")
+
+
+async def archive_payments_partitions(
+    conn: asyncpg.Connection, retention_months: int = PAYMENTS_RETENTION_MONTHS
+) -> list[str]:
+    """
+    Отсоединяет секции payments старше `retention_months` месяцев и переносит их в архивную схему.
+
+    Args:
+        conn: Соединение с базой данных
+        retention_months: Сколько полных месяцев истории оставить в payments; 0 — не архивировать
+
+    Returns:
+        list[str]: Имена перенесенных в архив секций
+    """
+    if retention_months <= 0:
+        return []
+    if await conn.fetchval("SELECT to_regclass('payments_partitioned')") is not None:
+        logger.warning("[Payments] Секции не архивируются, пока не выполнен перенос платежей")
+        return []
+
+    cutoff = _add_months(datetime.now(pytz.utc), -retention_months)
+    rollups_until = await conn.fetchval("SELECT processed_until FROM stats_rollup_watermarks WHERE name = 'hourly'")
+    partitions = await conn.fetch(
+        """
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'payments'::regclass
+        ORDER BY c.relname
+        """
+    )
+
+    archived = []
+    for row in partitions:
+        match = _PARTITION_NAME.match(row["relname"])
+        if not match:
+            continue
+        month_end = _add_months(datetime(int(match[1]), int(match[2]), 1, tzinfo=pytz.utc), 1)
+        if month_end > cutoff:
+            break
+        if rollups_until is None or rollups_until < month_end:
+            logger.warning(f"[Payments] Секция {row['relname']} не архивирована: статистика за месяц еще не собрана")
+            break
+
+        async with conn.transaction():
+            await conn.execute(f"SET LOCAL lock_timeout = '{PAYMENTS_PARTITIONS_LOCK_TIMEOUT}'")
+            await conn.execute(f'ALTER TABLE payments DETACH PARTITION "{row["relname"]}"')
+            await conn.execute(f'ALTER TABLE "{row["relname"]}" SET SCHEMA {PAYMENTS_ARCHIVE_SCHEMA}')
+        archived.append(row["relname"])
+        logger.info(f"[Payments] Секция {row['relname']} перенесена в {PAYMENTS_ARCHIVE_SCHEMA}")
+    return archived
+
+
+async def maintain_payments_partitions(conn: asyncpg.Connection) -> None:
+    """Создает будущие секции payments и архивирует устаревшие."""
+    await ensure_payments_partitions(conn)
+    await archive_payments_partitions(conn)
+    default_rows = await conn.fetchval("SELECT COUNT(*) FROM payments_default")
+    if default_rows:
+        logger.warning(f"[Payments] В payments_default {default_rows} строк вне месячных секций")
+
+
+def ensure_payments_maintenance() -> None:
+    """Запускает обслуживание секций payments в фоне, если оно еще не выполняется в процессе."""
+    global _maintenance_task
+    if _maintenance_task is None or _maintenance_task.done():
+        _maintenance_task = asyncio.create_task(_run_payments_maintenance())
+
+
+async def _run_payments_maintenance() -> None:
+    conn = None
+    try:
+        conn = await asyncpg.connect(DATABASE_URL, connection_class=InstrumentedConnection)
+        if not await conn.fetchval("SELECT pg_try_advisory_lock($1)", lease_key("payments_partitions")):
+            logger.info("[Payments] Обслуживание секций выполняется на другой реплике")
+            return
+        await maintain_payments_partitions(conn)
+    except Exception as e:
+        logger.error(f"[Payments] Ошибка при обслуживании секций: {e}")
+    finally:
+        if conn:
+            await conn.close()
+
+
+async def _main(command: str):
+    conn = await asyncpg.connect(DATABASE_URL, connection_class=InstrumentedConnection)
+    try:
+        if command == "migrate":
+            await migrate_payments(conn)
+        else:
+            await maintain_payments_partitions(conn)
+    finally:
+        await conn.close()
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] not in (["migrate"], ["maintain"]):
+        print("Использование: python -m utils.payments_partitions migrate|maintain")
+        sys.exit(1)
+    asyncio.run(_main(sys.argv[1]))
@@ -0,0 +1,232 @@
+import asyncio
+import time
+
+from contextvars import ContextVar
+from typing import TYPE_CHECKING, Any
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import Response, TelegramType
+from aiohttp import web
+from cachetools import TTLCache
+
+from logger import logger
+
+
+if TYPE_CHECKING:
+    from aiogram import Bot
+
+
+GLOBAL_RATE = 30
+GLOBAL_MIN_RATE = 10
+GLOBAL_BURST = 30
+BULK_SHARE = 0.8
+PRIVATE_CHAT_RATE = 1
+GROUP_CHAT_RATE = 20 / 60
+CHAT_BURST = 3
+RATE_BACKOFF_FACTOR = 0.7
+RATE_RECOVERY_INTERVAL = 10
+MAX_RETRIES = 3
+
+GOVERNED_METHOD_PREFIXES = ("Send", "Copy", "Forward", "Edit")
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+
+_traffic_priority: ContextVar[str] = ContextVar("telegram_traffic_priority", default=INTERACTIVE)
+
+
+def mark_bulk_traffic() -> None:
+    """
+    Помечает все отправки текущей задачи (и созданных из неё) как массовые.
+
+    Вызывается в начале фоновых задач — рассылок и уведомлений, чтобы ответы пользователям
+    не стояли в очереди за ними.
+    """
+    _traffic_priority.set(BULK)
+
+
+class RateBucket:
+    """Ограничитель частоты с допуском всплеска (GCRA), выдающий время, когда можно отправить запрос."""
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self.burst = burst
+        self._tat = 0.0
+        self.set_rate(rate)
+
+    def set_rate(self, rate: float) -> None:
+        self.rate = rate
+        self.interval = 1 / rate
+        self.tolerance = (self.burst - 1) * self.interval
+
+    def reserve(self, not_before: float) -> float:
+        start = max(not_before, self._tat - self.tolerance)
+        self._tat = max(self._tat, start) + self.interval
+        return start
+
+    def try_acquire(self, now: float) -> float:
+        """Занимает слот на текущий момент, если он свободен; иначе возвращает время ожидания."""
+        wait = self._tat - self.tolerance - now
+        if wait > 0:
+            return wait
+        self._tat = max(self._tat, now) + self.interval
+        return 0.0
+
+    def block_until(self, moment: float) -> None:
+        self._tat = max(self._tat, moment + self.tolerance)
+
+
+class RateGovernor(BaseRequestMiddleware):
+    """
+    Middleware сессии Bot, соблюдающее лимиты Telegram для всех исходящих сообщений.
+
+    Отправки и редактирования проходят через общий лимит бота и лимит конкретного чата:
+    1 сообщение в секунду в личку и 20 в минуту в группу, с небольшим всплеском. Массовые
+    отправки (см. mark_bulk_traffic) идут по своему расписанию с BULK_SHARE общего лимита и
+    занимают слот общего лимита только в момент отправки, не бронируя его наперед. Поэтому
+    очередь рассылки не сдвигает общее расписание, и интерактивный ответ ждет не дольше, чем
+    при обычной нагрузке.
+
+    TelegramRetryAfter обрабатывается здесь: чат блокируется на retry_after, общий лимит
+    снижается и плавно восстанавливается, а запрос повторяется до MAX_RETRIES раз.
+
+    Состояние хранится в памяти процесса. Лимит чата соблюдается, пока все отправки в чат
+    идут из одного процесса; общий лимит при нескольких процессах делится через set_max_rate.
+    """
+
+    def __init__(self, rate: float = GLOBAL_RATE) -> None:
+        self.max_rate = rate
+        self.min_rate = GLOBAL_MIN_RATE
+        self.global_bucket = RateBucket(rate, GLOBAL_BURST)
+        self.bulk_bucket = RateBucket(rate * BULK_SHARE, GLOBAL_BURST)
+        self.chat_buckets: TTLCache = TTLCache(maxsize=100_000, ttl=60)
+        self.waiting = {INTERACTIVE: 0, BULK: 0}
+        self.throttled = {INTERACTIVE: 0, BULK: 0}
+        self.retry_after_events = 0
+        self._last_rate_change = 0.0
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: "Bot",
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        if not type(method).__name__.startswith(GOVERNED_METHOD_PREFIXES):
+            return await make_request(bot, method)
+
+        priority = _traffic_priority.get()
+        chat_id = getattr(method, "chat_id", None)
+
+        for attempt in range(MAX_RETRIES + 1):
+            await self._acquire(priority, chat_id)
+            try:
+                response = await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                self._on_retry_after(chat_id, e.retry_after)
+                if attempt == MAX_RETRIES:
+                    raise
+                continue
+            self._recover_rate()
+            return response
+
+    def set_max_rate(self, rate: float) -> None:
+        """
+        Задает общий лимит этого процесса.
+
+        Лимит Telegram действует на весь бот, поэтому при нескольких процессах-воркерах
+        каждый получает свою долю (см. utils/webhook.py).
+        """
+        self.min_rate = GLOBAL_MIN_RATE * rate / self.max_rate
+        self.max_rate = rate
+        self._set_rate(min(self.global_bucket.rate, rate))
+
+    def _chat_bucket(self, chat_id: Any) -> RateBucket | None:
+        if chat_id is None:
+            return None
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            is_private = isinstance(chat_id, int) and chat_id > 0
+            bucket = RateBucket(PRIVATE_CHAT_RATE if is_private else GROUP_CHAT_RATE, CHAT_BURST)
+        self.chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def _acquire(self, priority: str, chat_id: Any) -> None:
+        now = time.monotonic()
+        start = now
+        chat_bucket = self._chat_bucket(chat_id)
+        if chat_bucket:
+            start = chat_bucket.reserve(start)
+
+        if priority == BULK:
+            start = self.bulk_bucket.reserve(start)
+            delay = start - now
+            throttled = delay > 0
+            self.waiting[priority] += 1
+            try:
+                if throttled:
+                    await asyncio.sleep(delay)
+                while (wait := self.global_bucket.try_acquire(time.monotonic())) > 0:
+                    throttled = True
+                    await asyncio.sleep(wait)
+            finally:
+                self.waiting[priority] -= 1
+            if throttled:
+                self.throttled[priority] += 1
+            return
+
+        start = self.global_bucket.reserve(start)
+        delay = start - now
+        if delay <= 0:
+            return
+
+        self.throttled[priority] += 1
+        self.waiting[priority] += 1
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            self.waiting[priority] -= 1
+
+    def _on_retry_after(self, chat_id: Any, retry_after: int) -> None:
+        self.retry_after_events += 1
+        resume_at = time.monotonic() + retry_after
+        chat_bucket = self._chat_bucket(chat_id)
+        (chat_bucket or self.global_bucket).block_until(resume_at)
+
+        rate = max(self.min_rate, self.global_bucket.rate * RATE_BACKOFF_FACTOR)
+        self._set_rate(rate)
+        logger.warning(f"⚠️ Flood control для чата {chat_id}: пауза {retry_after} с, общий лимит {rate:.1f} сообщ./с")
+
+    def _recover_rate(self) -> None:
+        if self.global_bucket.rate >= self.max_rate:
+            return
+        if time.monotonic() - self._last_rate_change >= RATE_RECOVERY_INTERVAL:
+            self._set_rate(min(self.max_rate, self.global_bucket.rate + 1))
+
+    def _set_rate(self, rate: float) -> None:
+        self._last_rate_change = time.monotonic()
+        self.global_bucket.set_rate(rate)
+        self.bulk_bucket.set_rate(rate * BULK_SHARE)
+
+    def render_prometheus(self) -> str:
+        """Формирует метрики в текстовом формате Prometheus."""
+        lines = [
+            "# TYPE telegram_send_queue_depth gauge",
+            "# TYPE telegram_send_throttled_total counter",
+            "# TYPE telegram_retry_after_total counter",
+            "# TYPE telegram_send_rate_limit gauge",
+        ]
+        for priority in (INTERACTIVE, BULK):
+            lines.append(f'telegram_send_queue_depth{{priority="{priority}"}} {self.waiting[priority]}')
+            lines.append(f'telegram_send_throttled_total{{priority="{priority}"}} {self.throttled[priority]}')
+        lines.append(f"telegram_retry_after_total {self.retry_after_events}")
+        lines.append(f"telegram_send_rate_limit {self.global_bucket.rate}")
+        return "\n".join(lines) + "\n"
+
+
+rate_governor = RateGovernor()
+
+
+async def handle_rate_metrics(request: web.Request) -> web.Response:
+    """aiohttp-обработчик, отдающий метрики ограничителя отправок в формате Prometheus."""
+    return web.Response(text=rate_governor.render_prometheus(), content_type="text/plain")
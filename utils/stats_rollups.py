@@ -0,0 +1,178 @@
+"""
+Почасовые агрегаты статистики: выручка, регистрации и выданные ключи.
+
+Агрегатор обрабатывает только строки, появившиеся с последнего прохода (watermark в
+stats_rollup_watermarks). Каждый проход пересчитывает целиком часы окна, начиная с часа
+перед watermark, поэтому повторный запуск идемпотентен, а поздно закоммиченные строки
+попадают в свой час. Дневные агрегаты — представления *_rollup_daily над почасовыми.
+
+Агрегатор запускается через ensure_stats_rollups() при создании пула соединений
+(SessionMiddleware) и работает только на реплике-лидере.
+
+Заполнение по существующим данным:
+    python -m utils.stats_rollups backfill
+"""
+
+import asyncio
+import sys
+
+from datetime import datetime, timedelta
+
+import asyncpg
+import pytz
+
+from config import DATABASE_URL
+from logger import logger
+from utils.db_metrics import InstrumentedConnection
+from utils.leader import leader_election
+
+
+ROLLUP_NAME = "hourly"
+ROLLUP_INTERVAL = 300
+ROLLUP_MAX_WINDOW = timedelta(days=30)
+
+_rollups_task: asyncio.Task | None = None
+
+TARIFF_PERIOD_SQL = """
+    CASE
+        WHEN (expiry_time - created_at) / 86400000.0 <= 29 THEN 'trial'
+        WHEN (expiry_time - created_at) / 86400000.0 <= 89 THEN '1'
+        WHEN (expiry_time - created_at) / 86400000.0 <= 179 THEN '3'
+        WHEN (expiry_time - created_at) / 86400000.0 <= 359 THEN '6'
+        ELSE '12'
+    END
+"""
+
+
+async def refresh_stats_rollups(conn: asyncpg.Connection) -> datetime:
+    """
+    Выполняет один проход агрегатора и возвращает новую позицию watermark.
+
+    За проход обрабатывается не более ROLLUP_MAX_WINDOW данных, чтобы первый запуск
+    на большой базе не держал одну длинную транзакцию.
+    """
+    async with conn.transaction():
+        watermark = await conn.fetchval(
+            "SELECT processed_until FROM stats_rollup_watermarks WHERE name = $1 FOR UPDATE", ROLLUP_NAME
+        )
+        if watermark is None:
+            watermark = await conn.fetchval(
+                """
+                SELECT COALESCE(
+                    LEAST(
+                        (SELECT MIN(created_at) FROM users),
+                        (SELECT MIN(created_at) FROM payments),
+                        (SELECT to_timestamp(MIN(created_at) / 1000.0) FROM keys)
+                    ),
+                    now()
+                )
+                """
+            )
+
+        now = datetime.now(pytz.utc)
+        window_start = watermark.replace(minute=0, second=0, microsecond=0) - timedelta(hours=1)
+        window_end = min(now, window_start + ROLLUP_MAX_WINDOW)
+        start_ms = int(window_start.timestamp() * 1000)
+        end_ms = int(window_end.timestamp() * 1000)
+
+        await conn.execute(
+            """
+            INSERT INTO payments_rollup_hourly (bucket, payment_system, payments_count, amount_sum)
+            SELECT date_trunc('hour', created_at), payment_system, COUNT(*), COALESCE(SUM(amount), 0)
+            FROM payments
+            WHERE created_at >= $1 AND created_at < $2
+            GROUP BY 1, 2
+            ON CONFLICT (bucket, payment_system)
+            DO UPDATE SET payments_count = EXCLUDED.payments_count, amount_sum = EXCLUDED.amount_sum
+            """,
+            window_start,
+            window_end,
+        )
+        await conn.execute(
+            """
+            INSERT INTO registrations_rollup_hourly (bucket, registrations)
+            SELECT date_trunc('hour', created_at), COUNT(*)
+            FROM users
+            WHERE created_at >= $1 AND created_at < $2
+            GROUP BY 1
+            ON CONFLICT (bucket) DO UPDATE SET registrations = EXCLUDED.registrations
+            """,
+            window_start,
+            window_end,
+        )
+        await conn.execute(
+            f"""
+            INSERT INTO keys_rollup_hourly (bucket, cluster_name, tariff_period, keys_created)
+            SELECT date_trunc('hour', to_timestamp(created_at / 1000.0)), server_id, {TARIFF_PERIOD_SQL}, COUNT(*)
+            FROM keys
+            WHERE created_at >= $1 AND created_at < $2
+            GROUP BY 1, 2, 3
+            ON CONFLICT (bucket, cluster_name, tariff_period) DO UPDATE SET keys_created = EXCLUDED.keys_created
+            """,  # noqa: S608
+            start_ms,
+            end_ms,
+        )
+        await conn.execute(
+            """
+            INSERT INTO stats_rollup_watermarks (name, processed_until)
+            VALUES ($1, $2)
+            ON CONFLICT (name) DO UPDATE SET processed_until = EXCLUDED.processed_until
+            """,
+            ROLLUP_NAME,
+            window_end,
+        )
+
+    logger.debug(f"Агрегаты статистики обновлены за период {window_start} — {window_end}")
+    return window_end
+
+
+async def _catch_up(conn: asyncpg.Connection, verbose: bool = False) -> None:
+    """Повторяет проходы агрегатора, пока watermark не догонит текущее время."""
+    while True:
+        processed_until = await refresh_stats_rollups(conn)
+        if verbose:
+            logger.info(f"Агрегаты статистики заполнены до {processed_until}")
+        if processed_until >= datetime.now(pytz.utc) - timedelta(minutes=1):
+            return
+
+
+def ensure_stats_rollups() -> None:
+    """Запускает periodic_stats_rollups(), если он еще не работает в этом процессе."""
+    global _rollups_task
+    if _rollups_task is None or _rollups_task.done():
+        _rollups_task = asyncio.create_task(periodic_stats_rollups())
+
+
+async def periodic_stats_rollups():
+    """Периодически обновляет агрегаты статистики. Выполняется только на реплике-лидере."""
+    while True:
+        await leader_election.wait_for_leadership("stats_rollups")
+
+        conn = None
+        try:
+            conn = await asyncpg.connect(DATABASE_URL, connection_class=InstrumentedConnection)
+            await _catch_up(conn)
+        except Exception as e:
+            logger.error(f"Ошибка при обновлении агрегатов статистики: {e}")
+        finally:
+            if conn:
+                await conn.close()
+
+        await asyncio.sleep(ROLLUP_INTERVAL)
+
+
+async def backfill_stats_rollups():
+    """Пересчитывает агрегаты по всей истории, начиная с самых старых данных."""
+    conn = await asyncpg.connect(DATABASE_URL)
+    try:
+        await conn.execute("DELETE FROM stats_rollup_watermarks WHERE name = $1", ROLLUP_NAME)
+        await _catch_up(conn, verbose=True)
+    finally:
+        await conn.close()
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["backfill"]:
+        print("Использование: python -m utils.stats_rollups backfill")
+        sys.exit(1)
+    asyncio.run(backfill_stats_rollups())
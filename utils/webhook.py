@@ -0,0 +1,275 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import queue
+import sys
+
+from typing import Any
+
+from aiohttp import web
+
+from logger import logger
+from utils.metrics_server import METRICS_PORT, start_metrics_server
+from utils.rate_governor import GLOBAL_RATE
+
+
+WEBHOOK_WORKERS = os.cpu_count() or 1
+WEBHOOK_QUEUE_SIZE = 10_000
+WORKER_CONCURRENCY = 100
+WORKER_SHUTDOWN_TIMEOUT = 10
+
+_TELEGRAM_AUTH_HEADER = "X-Telegram-Bot-Api-Secret-Token"  # noqa: S105
+
+
+def extract_chat_id(update: dict[str, Any]) -> int:
+    """
+    Определяет идентификатор чата, по которому шардируется апдейт.
+
+    Берётся отправитель события, а если его нет — чат. Апдейты одного пользователя
+    всегда попадают в один и тот же воркер, поэтому порядок их обработки и FSM-состояние
+    в MemoryStorage сохраняются.
+
+    Args:
+        update: Сырой апдейт Telegram
+
+    Returns:
+        int: Идентификатор для шардирования (0, если определить не удалось)
+    """
+    for field, payload in update.items():
+        if field == "update_id" or not isinstance(payload, dict):
+            continue
+        sender = payload.get("from") or payload.get("user")
+        if isinstance(sender, dict) and "id" in sender:
+            return sender["id"]
+        chat = payload.get("chat") or (payload.get("message") or {}).get("chat")
+        if isinstance(chat, dict) and "id" in chat:
+            return chat["id"]
+    return 0
+
+
+class UpdateSharder:
+    """
+    Принимает апдейты из webhook и раскладывает их по очередям воркеров.
+
+    Каждый воркер — отдельный процесс со своим Bot, Dispatcher и пулом соединений.
+    HTTP-обработчик только разбирает JSON, выбирает шард и кладёт сырые байты в очередь,
+    поэтому ответ Telegram отдаётся сразу, а обработка масштабируется по ядрам.
+    """
+
+    def __init__(self, workers: int = WEBHOOK_WORKERS, queue_size: int = WEBHOOK_QUEUE_SIZE) -> None:
+        self.workers = max(1, workers)
+        self._ctx = multiprocessing.get_context("spawn")
+        self._queues = [self._ctx.Queue(maxsize=queue_size) for _ in range(self.workers)]
+        self._processes: list[multiprocessing.Process] = []
+
+    def start(self) -> None:
+        """Запускает процессы-воркеры."""
+        for index, update_queue in enumerate(self._queues):
+            process = self._ctx.Process(
+                target=_worker_main,
+                args=(index, update_queue, self.workers),
+                name=f"update-worker-{index}",
+                daemon=True,
+            )
+            process.start()
+            self._processes.append(process)
+        logger.info(f"Запущено {self.workers} воркеров обработки апдейтов")
+
+    def stop(self, timeout: float = WORKER_SHUTDOWN_TIMEOUT) -> None:
+        """Отправляет воркерам сигнал завершения и дожидается их остановки."""
+        for update_queue in self._queues:
+            try:
+                update_queue.put(None, timeout=timeout)
+            except queue.Full:
+                logger.warning("Очередь воркера переполнена, сигнал завершения не доставлен")
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                logger.warning(f"Воркер {process.name} не завершился вовремя, принудительная остановка")
+                process.terminate()
+        self._processes.clear()
+
+    def submit(self, raw_update: bytes, chat_id: int) -> bool:
+        """
+        Кладёт апдейт в очередь воркера, отвечающего за чат.
+
+        Returns:
+            bool: False, если очередь воркера переполнена
+        """
+        try:
+            self._queues[chat_id % self.workers].put_nowait(raw_update)
+            return True
+        except queue.Full:
+            return False
+
+    def queue_sizes(self) -> list[int]:
+        """Возвращает текущую глубину очередей воркеров (приблизительно)."""
+        sizes = []
+        for update_queue in self._queues:
+            try:
+                sizes.append(update_queue.qsize())
+            except NotImplementedError:
+                sizes.append(-1)
+        return sizes
+
+
+def setup_webhook(
+    app: web.Application,
+    path: str,
+    url: str,
+    secret_token: str,
+    workers: int = WEBHOOK_WORKERS,
+) -> UpdateSharder:
+    """
+    Регистрирует webhook-приём апдейтов в aiohttp-приложении.
+
+    Воркеры запускаются при старте приложения, webhook устанавливается на `url`,
+    при остановке приложения воркеры корректно завершаются. Метрики процесса отдаются
+    локально на METRICS_PORT, метрики воркера с номером i — на METRICS_PORT + 1 + i.
+
+    Секрет должен быть одинаковым у всех реплик и перезапусков: Telegram хранит один секрет
+    на бот, и реплика со своим случайным секретом отвечала бы 401 на чужие апдейты.
+    Общий лимит отправок Telegram делится между воркерами поровну (GLOBAL_RATE / workers).
+
+    Args:
+        app: aiohttp-приложение, в котором уже живут webhook платёжных систем и подписок
+        path: Путь, на который Telegram присылает апдейты
+        url: Публичный URL webhook
+        secret_token: Секрет для заголовка X-Telegram-Bot-Api-Secret-Token
+        workers: Количество процессов-воркеров
+
+    Returns:
+        UpdateSharder: Распределитель апдейтов по воркерам
+
+    Raises:
+        ValueError: Если секрет не задан
+    """
+    if not secret_token:
+        raise ValueError("Для webhook нужен WEBHOOK_SECRET, общий для всех реплик")
+    sharder = UpdateSharder(workers=workers)
+
+    async def handle_update(request: web.Request) -> web.Response:
+        if request.headers.get(_TELEGRAM_AUTH_HEADER) != secret_token:
+            return web.Response(status=401)
+
+        raw_update = await request.read()
+        try:
+            update = json.loads(raw_update)
+        except ValueError:
+            logger.warning("Получен некорректный JSON в webhook")
+            return web.Response(status=400)
+
+        if not sharder.submit(raw_update, extract_chat_id(update)):
+            logger.warning(f"Очередь воркера переполнена, апдейт {update.get('update_id')} будет повторён Telegram")
+            return web.Response(status=503)
+        return web.Response()
+
+    async def on_startup(app: web.Application) -> None:
+        from bot import bot, dp
+        from handlers import router
+
+        sharder.start()
+        app["metrics_runner"] = await start_metrics_server()
+        if router.parent_router is None:
+            dp.include_router(router)
+        await bot.set_webhook(
+            url=url,
+            secret_token=secret_token,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+        logger.info(f"Webhook установлен: {url}")
+
+    async def on_cleanup(app: web.Application) -> None:
+        from bot import bot
+
+        await app["metrics_runner"].cleanup()
+        await asyncio.to_thread(sharder.stop)
+        await bot.session.close()
+
+    app.router.add_post(path, handle_update)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return sharder
+
+
+def _worker_main(index: int, update_queue: multiprocessing.Queue, workers: int) -> None:
+    """Точка входа процесса-воркера."""
+    try:
+        asyncio.run(_run_worker(index, update_queue, workers))
+    except KeyboardInterrupt:
+        pass
+
+
+async def _run_worker(index: int, update_queue: multiprocessing.Queue, workers: int) -> None:
+    """
+    Обрабатывает апдейты из очереди воркера.
+
+    Апдейты разных чатов обрабатываются параллельно (не более WORKER_CONCURRENCY одновременно),
+    апдейты одного чата — строго по очереди поступления. Воркер отправляет сообщения не
+    быстрее своей доли общего лимита Telegram.
+    """
+    from bot import bot, dp
+    from handlers import router
+    from utils.rate_governor import rate_governor
+
+    rate_governor.set_max_rate(GLOBAL_RATE / workers)
+    dp.include_router(router)
+    semaphore = asyncio.Semaphore(WORKER_CONCURRENCY)
+    tails: dict[int, asyncio.Task] = {}
+    loop = asyncio.get_running_loop()
+
+    async def process(update: dict, previous: asyncio.Task | None) -> None:
+        if previous is not None:
+            await asyncio.wait([previous])
+        async with semaphore:
+            try:
+                await dp.feed_raw_update(bot, update)
+            except Exception as e:
+                logger.error(f"Воркер {index}: ошибка обработки апдейта {update.get('update_id')}: {e}")
+
+    def release(chat_id: int, task: asyncio.Task) -> None:
+        if tails.get(chat_id) is task:
+            del tails[chat_id]
+
+    logger.info(f"Воркер {index} запущен (pid {os.getpid()})")
+    metrics_runner = await start_metrics_server(port=METRICS_PORT + 1 + index)
+    await dp.emit_startup(bot=bot)
+    try:
+        while True:
+            raw_update = await loop.run_in_executor(None, update_queue.get)
+            if raw_update is None:
+                break
+            update = json.loads(raw_update)
+            chat_id = extract_chat_id(update)
+            task = asyncio.create_task(process(update, tails.get(chat_id)))
+            tails[chat_id] = task
+            task.add_done_callback(lambda t, chat_id=chat_id: release(chat_id, t))
+
+        if tails:
+            await asyncio.wait(list(tails.values()), timeout=WORKER_SHUTDOWN_TIMEOUT)
+    finally:
+        await dp.emit_shutdown(bot=bot)
+        await metrics_runner.cleanup()
+        await bot.session.close()
+        logger.info(f"Воркер {index} остановлен")
+
+
+def run_webhook() -> None:
+    """
+    Запускает бота в режиме webhook с воркерами по числу ядер.
+
+    Настройки берутся из config.py: WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBAPP_HOST и WEBAPP_PORT.
+    """
+    from config import WEBAPP_HOST, WEBAPP_PORT, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_URL
+
+    app = web.Application()
+    setup_webhook(app, WEBHOOK_PATH, WEBHOOK_URL, WEBHOOK_SECRET)
+    web.run_app(app, host=WEBAPP_HOST, port=WEBAPP_PORT)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:]:
+        print("Использование: python -m utils.webhook")
+        sys.exit(1)
+    run_webhook()